@@ -33,6 +33,8 @@
 #define USBD_IDLE 0
 #define USBD_RECV_PACKET 1
 #define USBD_TSMT_PACKET 2
+#define USBD_RECV_WINDOW 3
+#define USBD_TSMT_BLOCK 4
 uint8_t usbd_state = USBD_IDLE;
 
 volatile uint8_t usbd_work_state = USBD_WORK_IDLE;
@@ -42,7 +44,19 @@ volatile uint8_t usbd_work_state = USBD_WORK_IDLE;
 
 #define W25Q_WRITE_BUFFER_SIZE 256 // 写Flash时所用的缓存大小，one page
 #define W25Q_READ_BUFFER_SIZE 1024 // 读Flash时所用的缓存大小，one page
+#define W25Q_BULK_BLOCK_SIZE 2048  // 按块读Flash时每块的大小
+#define USBD_CRC_SIZE 4
+#define W25Q_SECTOR_SIZE 4096
+#define USBD_HASH_MAX_SECTORS 64 // 单次计算CRC的最大扇区数（256KB）
+
+// LZSS解码（与上位机s_serial/lz.py对应）
+#define LZ_WINDOW_SIZE 1024 // 历史窗口大小，需为2的幂
+#define LZ_MIN_MATCH 3
+#define LZ_STATE_FLAG 0	 // 等待标志字节
+#define LZ_STATE_ITEM 1	 // 等待字面量或匹配的第一个字节
+#define LZ_STATE_MATCH 2 // 等待匹配的第二个字节
 #define USBD_PACKET_SIZE 64
+#define USBD_TX_TIMEOUT 10 // 等待上一次发送完成的超时时间(ms)
 
 uint8_t *w25q_usb_buffer = NULL; // 双缓存设计
 uint8_t *w25q_spi_buffer = NULL; // A用来从USB接收数据，B用来写入Flash
@@ -55,14 +69,39 @@ uint8_t *w25q_usb_buffer_ptr = 0; // 指向w25q_usb_buffer的顶部
 #define W25Q_USB_BUFFER_SENT 1
 uint8_t w25q_usb_buffer_state = W25Q_USB_BUFFER_HAVENT_SENT;
 
+uint8_t w25q_packet_seq = 0;	// 滑动窗口写Flash时已接收的包序号
+uint8_t w25q_window_failed = 0; // 滑动窗口写Flash是否已出错（出错后丢弃数据包直到结束指令）
+uint8_t w25q_block_pending = 0; // 按块读Flash时w25q_spi_buffer中是否有正在读取或待发送的块
+
+uint8_t w25q_lz_enabled = 0;	 // 滑动窗口写Flash的数据是否为压缩格式
+uint32_t w25q_lz_remaining = 0; // 尚未解码的原始数据长度
+uint8_t lz_history[LZ_WINDOW_SIZE];
+uint16_t lz_pos = 0;
+uint8_t lz_state = LZ_STATE_FLAG;
+uint8_t lz_flags = 0;
+uint8_t lz_flag_bits = 0;
+uint8_t lz_match_lo = 0;
+
 HAL_StatusTypeDef USBD_Respond(uint8_t respond);
+HAL_StatusTypeDef USBD_RespondSeq(uint8_t respond, uint8_t seq);
+HAL_StatusTypeDef USBD_TransmitWait(uint8_t *buffer, uint16_t len);
 void USBD_SwapW25QBuffer();
 void USBD_CleanUpRWFlash();
+uint8_t USBD_ProgramW25QPage();
+uint8_t USBD_FinishWriteFlash();
+void USBD_PollWindow();
+uint32_t USBD_Crc32(uint32_t crc, const uint8_t *data, uint32_t len);
+HAL_StatusTypeDef USBD_ReadW25QBlock();
+HAL_StatusTypeDef USBD_SendW25QBlock();
+void USBD_AbortBulkRead();
+uint8_t USBD_EmitW25QByte(uint8_t byte);
+uint8_t USBD_LzFeed(const uint8_t *data, uint32_t len);
 
 void USBD_Reset()
 {
 	usbd_state = USBD_IDLE;
 	w25q_usb_buffer_state = W25Q_USB_BUFFER_HAVENT_SENT;
+	USBD_RxQueue_Enable(0);
 
 	if (w25q_spi_buffer != NULL)
 	{
@@ -90,6 +129,13 @@ void USBD_Disable()
 
 void USBD_Poll()
 {
+	if (usbd_state == USBD_RECV_WINDOW)
+	{
+		// 滑动窗口写Flash时数据包来自接收队列
+		USBD_PollWindow();
+		return;
+	}
+
 	if (Recv_dlen == 0)
 		return;
 
@@ -326,6 +372,72 @@ void USBD_Poll()
 			USBD_Respond(RESPOND_OK);
 		}
 		break;
+		case CMD_WRITE_FLASH_WINDOW:
+		case CMD_WRITE_FLASH_LZ:
+		{
+			/*
+				滑动窗口写Flash指令格式如下：
+					1. 上位机发送指令头，格式为0xAA BBBBBBBB CC（6字节）
+					   AA：滑动窗口写Flash指令 (0x79); BBBBBBBB：32位起始地址（小端序），需要与Sector对齐
+					   CC：上位机请求的窗口大小（同时在途的包数）
+					2. MCU准备缓存并启用接收队列，进入USBD_RECV_WINDOW，
+					   回复RESPOND_OK与实际窗口大小（不超过接收队列深度）
+					3. 上位机无需等待回复，可连续发送至多窗口大小个64字节包（不足64字节则补全）
+					   MCU每处理完一包回复RESPOND_OK与包序号（低8位），写入逻辑与CMD_WRITE_FLASH相同
+					   出错时回复RESPOND_ERROR与包序号，此后丢弃数据包直到收到CMD_END_WRITE_FLASH
+					4. 上位机收到全部回复后发送CMD_END_WRITE_FLASH
+					   MCU写入剩余数据并清理缓存，回复结果与收到的包数（低8位），置USBD_IDLE
+				旧固件不识别该指令也不回复，上位机超时后改用CMD_WRITE_FLASH逐包应答
+
+				CMD_WRITE_FLASH_LZ (0x82)流程相同，指令头后附加32位原始数据长度（小端序，共10字节），
+				数据包为LZSS压缩流（格式见LZ_STATE_*与USBD_LzFeed），MCU边接收边解码写入，
+				解码出原始数据长度后忽略其余数据；结束时未解码完整则回复RESPOND_ERROR
+			*/
+			// 分配缓存区
+			if (w25q_usb_buffer != NULL || w25q_spi_buffer != NULL)
+			{
+				periph_error = PE_OTG_FS_RX_ERROR;
+				hardware_error = HE_W25Q_ERROR;
+				USBD_Respond(RESPOND_BUSY);
+				goto FUNC_END;
+			}
+			w25q_usb_buffer = (uint8_t *)malloc(sizeof(uint8_t) * W25Q_WRITE_BUFFER_SIZE);
+			w25q_spi_buffer = (uint8_t *)malloc(sizeof(uint8_t) * W25Q_WRITE_BUFFER_SIZE);
+			w25q_usb_buffer_ptr = w25q_usb_buffer;
+			w25q_usb_buffer_state = W25Q_USB_BUFFER_SENT; // 尚无待写入的数据
+			w25q_packet_seq = 0;
+			w25q_window_failed = 0;
+
+			// 压缩格式：记录原始数据长度并复位解码器
+			w25q_lz_enabled = (UserRxBuffer[0] == CMD_WRITE_FLASH_LZ);
+			if (w25q_lz_enabled)
+			{
+				w25q_lz_remaining = (uint32_t)UserRxBuffer[6];
+				w25q_lz_remaining |= (UserRxBuffer[7] << 8);
+				w25q_lz_remaining |= (UserRxBuffer[8] << 16);
+				w25q_lz_remaining |= (UserRxBuffer[9] << 24);
+				lz_pos = 0;
+				lz_state = LZ_STATE_FLAG;
+			}
+
+			// 记录地址指针（小端序）
+			w25q_addr_ptr = (uint32_t)UserRxBuffer[1];
+			w25q_addr_ptr |= (UserRxBuffer[2] << 8);
+			w25q_addr_ptr |= (UserRxBuffer[3] << 16);
+			w25q_addr_ptr |= (UserRxBuffer[4] << 24);
+
+			// 协商窗口大小
+			uint8_t window = UserRxBuffer[5];
+			if (window == 0 || window > USBD_RX_QUEUE_DEPTH)
+				window = USBD_RX_QUEUE_DEPTH;
+
+			// 移动状态，回复前启用接收队列
+			usbd_state = USBD_RECV_WINDOW;
+			USBD_RxQueue_Enable(1);
+
+			USBD_RespondSeq(RESPOND_OK, window);
+		}
+		break;
 		case CMD_READ_FLASH:
 		{
 			/*
@@ -426,6 +538,135 @@ void USBD_Poll()
 			usbd_state = USBD_TSMT_PACKET;
 		}
 		break;
+		case CMD_READ_FLASH_BULK:
+		{
+			/*
+				按块读Flash指令格式如下：
+					1. 上位机发送指令头：格式为0xAA BBBBBBBB CCCCCCCC（9字节）
+					   AA为按块读Flash指令(0x7C)；BBBBBBBB为32位起始地址；CCCCCCCC为32位读取长度（均为小端序）
+					2. MCU回复RESPOND_OK与块大小（16位小端序），随后发送第一块
+					   每块为块大小字节的数据加4字节CRC32（小端序，与zlib.crc32一致），最后一块不足时仍按整块读取
+					3. 上位机校验通过后回复RESPOND_OK，MCU发送下一块（下一块在上一块传输期间已由DMA读入）
+					   校验失败时上位机回复RESPOND_ERROR，MCU重发当前块；回复其他内容则终止读取
+					4. 最后一块得到RESPOND_OK后，MCU清理缓冲区，状态机移动到USBD_IDLE
+				旧固件不识别该指令也不回复，上位机超时后改用CMD_READ_FLASH
+			*/
+			static uint8_t header[3];
+
+			// 分配缓冲区
+			if (w25q_usb_buffer != NULL || w25q_spi_buffer != NULL)
+			{
+				periph_error = PE_OTG_FS_RX_ERROR;
+				hardware_error = HE_W25Q_ERROR;
+				USBD_Respond(RESPOND_BUSY);
+				goto FUNC_END;
+			}
+
+			// 记录地址指针与读取长度（小端序）
+			w25q_addr_ptr = (uint32_t)UserRxBuffer[1];
+			w25q_addr_ptr |= (UserRxBuffer[2] << 8);
+			w25q_addr_ptr |= (UserRxBuffer[3] << 16);
+			w25q_addr_ptr |= (UserRxBuffer[4] << 24);
+			w25q_read_len = (uint32_t)UserRxBuffer[5];
+			w25q_read_len |= (UserRxBuffer[6] << 8);
+			w25q_read_len |= (UserRxBuffer[7] << 16);
+			w25q_read_len |= (UserRxBuffer[8] << 24);
+
+			// 长度为0（或超出int32范围）时没有可发送的块
+			if (w25q_read_len <= 0)
+			{
+				USBD_Respond(RESPOND_ERROR);
+				goto FUNC_END;
+			}
+
+			w25q_usb_buffer = (uint8_t *)malloc(sizeof(uint8_t) * (W25Q_BULK_BLOCK_SIZE + USBD_CRC_SIZE));
+			w25q_spi_buffer = (uint8_t *)malloc(sizeof(uint8_t) * (W25Q_BULK_BLOCK_SIZE + USBD_CRC_SIZE));
+			w25q_block_pending = 0;
+
+			// 读取第一块
+			if (USBD_ReadW25QBlock() != HAL_OK)
+			{
+				USBD_AbortBulkRead();
+				USBD_Respond(RESPOND_BUSY);
+				goto FUNC_END;
+			}
+
+			header[0] = RESPOND_OK;
+			header[1] = W25Q_BULK_BLOCK_SIZE & 0xFF;
+			header[2] = (W25Q_BULK_BLOCK_SIZE >> 8) & 0xFF;
+			USBD_TransmitWait(header, sizeof(header));
+
+			// 发送第一块，同时读取下一块
+			if (USBD_SendW25QBlock() != HAL_OK)
+			{
+				USBD_AbortBulkRead();
+				USBD_Respond(RESPOND_BUSY);
+				goto FUNC_END;
+			}
+
+			// 状态转移
+			usbd_state = USBD_TSMT_BLOCK;
+		}
+		break;
+		case CMD_FLASH_HASH:
+		{
+			/*
+				计算Flash内容的CRC32，用于上位机增量下载时比较哪些扇区需要重写
+					1. 上位机发送：0xAA BBBBBBBB CCCCCCCC（9字节）
+					   AA为指令(0x7F)；BBBBBBBB为起始地址；CCCCCCCC为长度（均为小端序）
+					2. MCU从起始地址起每4KB（一个扇区）计算一个CRC32，最后一段不足4KB时只计算剩余长度
+					3. MCU回复RESPOND_OK、段数（16位小端序）与各段CRC32（小端序，与zlib.crc32一致）
+					   长度超过USBD_HASH_MAX_SECTORS个扇区或读取失败时回复RESPOND_ERROR
+				旧固件不识别该指令也不回复，上位机超时后进行完整写入
+			*/
+			static uint8_t hash_respond[3 + USBD_HASH_MAX_SECTORS * USBD_CRC_SIZE];
+			uint8_t page[W25Q_WRITE_BUFFER_SIZE];
+
+			uint32_t addr = (uint32_t)UserRxBuffer[1];
+			addr |= (UserRxBuffer[2] << 8);
+			addr |= (UserRxBuffer[3] << 16);
+			addr |= (UserRxBuffer[4] << 24);
+			uint32_t len = (uint32_t)UserRxBuffer[5];
+			len |= (UserRxBuffer[6] << 8);
+			len |= (UserRxBuffer[7] << 16);
+			len |= (UserRxBuffer[8] << 24);
+
+			uint32_t count = (len + W25Q_SECTOR_SIZE - 1) / W25Q_SECTOR_SIZE;
+			if (count > USBD_HASH_MAX_SECTORS)
+			{
+				USBD_Respond(RESPOND_ERROR);
+				goto FUNC_END;
+			}
+
+			for (uint32_t i = 0; i < count; i++)
+			{
+				uint32_t crc = 0;
+				uint32_t sector_len = len - i * W25Q_SECTOR_SIZE;
+				if (sector_len > W25Q_SECTOR_SIZE)
+					sector_len = W25Q_SECTOR_SIZE;
+
+				// 按页读取并累加CRC
+				for (uint32_t offset = 0; offset < sector_len; offset += W25Q_WRITE_BUFFER_SIZE)
+				{
+					uint16_t size = sector_len - offset > W25Q_WRITE_BUFFER_SIZE ? W25Q_WRITE_BUFFER_SIZE : sector_len - offset;
+					if (W25Q_ReadData_4ba(addr + i * W25Q_SECTOR_SIZE + offset, page, size) != HAL_OK)
+					{
+						periph_error = PE_SPI1_RX_ERROR;
+						hardware_error = HE_W25Q_ERROR;
+						USBD_Respond(RESPOND_ERROR);
+						goto FUNC_END;
+					}
+					crc = USBD_Crc32(crc, page, size);
+				}
+				SERIALIZE(crc, hash_respond + 3 + i * USBD_CRC_SIZE);
+			}
+
+			hash_respond[0] = RESPOND_OK;
+			hash_respond[1] = count & 0xFF;
+			hash_respond[2] = (count >> 8) & 0xFF;
+			USBD_TransmitWait(hash_respond, 3 + count * USBD_CRC_SIZE);
+		}
+		break;
 		case CMD_CLEAN_FLASH_A:
 		{
 			DEBUG_CODE(OLED_ShowString(1, 1, "Chip Erase"););
@@ -493,56 +734,8 @@ void USBD_Poll()
 		if (Recv_dlen == 1 && UserRxBuffer[0] == CMD_END_WRITE_FLASH)
 		{
 			// Error_Handler();
-			// 全部写入
-			if (w25q_usb_buffer_state == W25Q_USB_BUFFER_HAVENT_SENT)
-			{
-				// 交换缓存
-				USBD_SwapW25QBuffer();
-				w25q_usb_buffer_ptr = w25q_usb_buffer;
-
-				// 擦除Sector
-				if ((w25q_addr_ptr & 0x0FFF) == 0x0000)
-				{
-					// OLED_ShowHexNum(4, 2, w25q_addr_ptr, 8);
-
-					if (W25Q_SectorErase_4ba(w25q_addr_ptr) != HAL_OK)
-					{
-						hardware_error = HE_W25Q_ERROR;
-						USBD_CleanUpRWFlash();
-						USBD_Respond(RESPOND_ERROR);
-						goto FUNC_END;
-					}
-				}
-
-				// OLED_ShowHexNum(4, 1, w25q_addr_ptr, 8);
-
-				// 启动发送
-				if (SPI_WaitTx() != HAL_OK)
-				{
-					periph_error = PE_SPI1_TX_ERROR;
-					hardware_error = HE_W25Q_ERROR;
-					USBD_CleanUpRWFlash();
-					USBD_Respond(RESPOND_ERROR);
-					goto FUNC_END;
-				}
-				if (W25Q_PageProgram_4ba_DMA(w25q_addr_ptr, w25q_spi_buffer, W25Q_WRITE_BUFFER_SIZE) != HAL_OK)
-				{
-					periph_error = PE_SPI1_TX_ERROR;
-					hardware_error = HE_W25Q_ERROR;
-					USBD_CleanUpRWFlash();
-					USBD_Respond(RESPOND_ERROR);
-					goto FUNC_END;
-				}
-			}
-
-			// 终止写Flash
-			if (SPI_WaitTx() != HAL_OK)
-			{
-				periph_error = PE_SPI1_TX_ERROR;
-				hardware_error = HE_W25Q_ERROR;
-			}
-			USBD_CleanUpRWFlash();
-			USBD_Respond(RESPOND_OK);
+			// 全部写入，终止写Flash
+			USBD_Respond(USBD_FinishWriteFlash());
 		}
 		else
 		{
@@ -562,41 +755,8 @@ void USBD_Poll()
 			// 写入Flash
 			if (w25q_usb_buffer_ptr - w25q_usb_buffer >= W25Q_WRITE_BUFFER_SIZE)
 			{
-				// 交换缓存
-				USBD_SwapW25QBuffer();
-				w25q_usb_buffer_ptr = w25q_usb_buffer;
-
-				// 擦除扇区
-				if ((w25q_addr_ptr & 0x0FFF) == 0x0000)
+				if (USBD_ProgramW25QPage() != RESPOND_OK)
 				{
-					// OLED_ShowString(4, 1, "E");
-					// OLED_ShowHexNum(4, 2, w25q_addr_ptr, 8);
-
-					if (W25Q_SectorErase_4ba(w25q_addr_ptr) != HAL_OK)
-					{
-						hardware_error = HE_W25Q_ERROR;
-						USBD_CleanUpRWFlash();
-						USBD_Respond(RESPOND_ERROR);
-						goto FUNC_END;
-					}
-				}
-
-
-				// OLED_ShowHexNum(4, 2, w25q_addr_ptr, 8);
-
-				// 启动发送
-				if (SPI_WaitTx() != HAL_OK)
-				{
-					periph_error = PE_SPI1_TX_ERROR;
-					hardware_error = HE_W25Q_ERROR;
-					USBD_CleanUpRWFlash();
-					USBD_Respond(RESPOND_ERROR);
-					goto FUNC_END;
-				}
-				if (W25Q_PageProgram_4ba_DMA(w25q_addr_ptr, w25q_spi_buffer, W25Q_WRITE_BUFFER_SIZE) != HAL_OK)
-				{
-					periph_error = PE_SPI1_TX_ERROR;
-					hardware_error = HE_W25Q_ERROR;
 					USBD_CleanUpRWFlash();
 					USBD_Respond(RESPOND_ERROR);
 					goto FUNC_END;
@@ -691,6 +851,43 @@ void USBD_Poll()
 		}
 	}
 	break;
+	case USBD_TSMT_BLOCK:
+	{
+		if (Recv_dlen == 1 && UserRxBuffer[0] == RESPOND_OK)
+		{
+			if (!w25q_block_pending)
+			{
+				// 全部传输完成
+				USBD_CleanUpRWFlash();
+				goto FUNC_END;
+			}
+
+			// 发送下一块
+			if (USBD_SendW25QBlock() != HAL_OK)
+			{
+				USBD_AbortBulkRead();
+				USBD_Respond(RESPOND_BUSY);
+				goto FUNC_END;
+			}
+		}
+		else if (Recv_dlen == 1 && UserRxBuffer[0] == RESPOND_ERROR)
+		{
+			// 上位机校验失败，重发当前块
+			if (USBD_TransmitWait(w25q_usb_buffer, W25Q_BULK_BLOCK_SIZE + USBD_CRC_SIZE) != HAL_OK)
+			{
+				periph_error = PE_OTG_FS_TX_ERROR;
+				USBD_AbortBulkRead();
+				USBD_Respond(RESPOND_BUSY);
+				goto FUNC_END;
+			}
+		}
+		else
+		{
+			USBD_AbortBulkRead();
+			USBD_Respond(RESPOND_ERROR);
+		}
+	}
+	break;
 	default:
 		break;
 	}
@@ -706,6 +903,32 @@ HAL_StatusTypeDef USBD_Respond(uint8_t respond)
 	return (HAL_StatusTypeDef)CDC_Transmit_FS(&respond, 1);
 }
 
+HAL_StatusTypeDef USBD_RespondSeq(uint8_t respond, uint8_t seq)
+{
+	// 连续回复时上一次发送可能尚未完成，轮流使用两个缓存并等待端点空闲
+	static uint8_t buffers[2][2];
+	static uint8_t index = 0;
+
+	uint8_t *buffer = buffers[index];
+	index ^= 1;
+	buffer[0] = respond;
+	buffer[1] = seq;
+	return USBD_TransmitWait(buffer, 2);
+}
+
+HAL_StatusTypeDef USBD_TransmitWait(uint8_t *buffer, uint16_t len)
+{
+	// 等待上一次发送完成后再发送，buffer需保持有效直到发送完成
+	uint32_t start = HAL_GetTick();
+	uint8_t result;
+	while ((result = CDC_Transmit_FS(buffer, len)) == USBD_BUSY)
+	{
+		if (HAL_GetTick() - start > USBD_TX_TIMEOUT)
+			return HAL_TIMEOUT;
+	}
+	return result == USBD_OK ? HAL_OK : HAL_ERROR;
+}
+
 void USBD_SwapW25QBuffer()
 {
 	uint8_t *temp = w25q_usb_buffer;
@@ -720,4 +943,256 @@ void USBD_CleanUpRWFlash()
 	free(w25q_spi_buffer);
 	w25q_usb_buffer = NULL;
 	w25q_spi_buffer = NULL;
-}
\ No newline at end of file
+}
+
+uint8_t USBD_ProgramW25QPage()
+{
+	// 交换缓存，将写满的一页写入Flash（位于扇区起始处时先擦除扇区）
+	USBD_SwapW25QBuffer();
+	w25q_usb_buffer_ptr = w25q_usb_buffer;
+
+	// 擦除扇区
+	if ((w25q_addr_ptr & 0x0FFF) == 0x0000)
+	{
+		if (W25Q_SectorErase_4ba(w25q_addr_ptr) != HAL_OK)
+		{
+			hardware_error = HE_W25Q_ERROR;
+			return RESPOND_ERROR;
+		}
+	}
+
+	// 启动发送
+	if (SPI_WaitTx() != HAL_OK)
+	{
+		periph_error = PE_SPI1_TX_ERROR;
+		hardware_error = HE_W25Q_ERROR;
+		return RESPOND_ERROR;
+	}
+	if (W25Q_PageProgram_4ba_DMA(w25q_addr_ptr, w25q_spi_buffer, W25Q_WRITE_BUFFER_SIZE) != HAL_OK)
+	{
+		periph_error = PE_SPI1_TX_ERROR;
+		hardware_error = HE_W25Q_ERROR;
+		return RESPOND_ERROR;
+	}
+	return RESPOND_OK;
+}
+
+uint8_t USBD_FinishWriteFlash()
+{
+	// 写入未满一页的剩余数据，等待写入完成并清理缓存
+	uint8_t result = RESPOND_OK;
+	if (w25q_usb_buffer_state == W25Q_USB_BUFFER_HAVENT_SENT)
+		result = USBD_ProgramW25QPage();
+
+	if (result == RESPOND_OK && SPI_WaitTx() != HAL_OK)
+	{
+		periph_error = PE_SPI1_TX_ERROR;
+		hardware_error = HE_W25Q_ERROR;
+	}
+	USBD_CleanUpRWFlash();
+	return result;
+}
+
+void USBD_PollWindow()
+{
+	static uint8_t packet[USBD_PACKET_SIZE];
+	uint32_t len = USBD_RxQueue_Pop(packet);
+	if (len == 0)
+		return;
+
+	usbd_work_state = USBD_WORK_BUSY;
+	if (len == 1 && packet[0] == CMD_END_WRITE_FLASH)
+	{
+		// 终止写Flash，回复结果与收到的包数
+		uint8_t result = RESPOND_ERROR;
+		if (w25q_window_failed || (w25q_lz_enabled && w25q_lz_remaining != 0))
+			USBD_CleanUpRWFlash();
+		else
+			result = USBD_FinishWriteFlash();
+		USBD_RxQueue_Enable(0);
+		USBD_RespondSeq(result, w25q_packet_seq);
+	}
+	else if (!w25q_window_failed && w25q_lz_enabled)
+	{
+		// 解码并写入
+		uint8_t result = USBD_LzFeed(packet, len);
+		if (result != RESPOND_OK)
+			w25q_window_failed = 1;
+		USBD_RespondSeq(result, w25q_packet_seq++);
+	}
+	else if (!w25q_window_failed)
+	{
+		// 将数据转移到w25q_usb_buffer
+		memcpy(w25q_usb_buffer_ptr, packet, USBD_PACKET_SIZE);
+		w25q_usb_buffer_state = W25Q_USB_BUFFER_HAVENT_SENT;
+		w25q_usb_buffer_ptr += USBD_PACKET_SIZE;
+
+		uint8_t result = RESPOND_OK;
+		if (w25q_usb_buffer_ptr - w25q_usb_buffer >= W25Q_WRITE_BUFFER_SIZE)
+		{
+			result = USBD_ProgramW25QPage();
+			w25q_addr_ptr += W25Q_WRITE_BUFFER_SIZE;
+			w25q_usb_buffer_state = W25Q_USB_BUFFER_SENT;
+		}
+
+		// 出错后保持USBD_RECV_WINDOW，丢弃在途的数据包直到结束指令
+		if (result != RESPOND_OK)
+			w25q_window_failed = 1;
+		USBD_RespondSeq(result, w25q_packet_seq++);
+	}
+	usbd_work_state = USBD_WORK_IDLE;
+}
+
+uint32_t USBD_Crc32(uint32_t crc, const uint8_t *data, uint32_t len)
+{
+	// CRC-32（多项式0xEDB88320，与zlib.crc32(data, crc)一致，可分段累加），首次调用时生成查找表
+	static uint32_t table[256];
+	static uint8_t table_ready = 0;
+	if (!table_ready)
+	{
+		for (uint32_t i = 0; i < 256; i++)
+		{
+			uint32_t c = i;
+			for (uint8_t k = 0; k < 8; k++)
+				c = (c & 1) ? (0xEDB88320 ^ (c >> 1)) : (c >> 1);
+			table[i] = c;
+		}
+		table_ready = 1;
+	}
+
+	crc ^= 0xFFFFFFFF;
+	while (len--)
+		crc = table[(crc ^ *data++) & 0xFF] ^ (crc >> 8);
+	return crc ^ 0xFFFFFFFF;
+}
+
+HAL_StatusTypeDef USBD_ReadW25QBlock()
+{
+	// 剩余长度大于0时，启动DMA将下一块读入w25q_spi_buffer
+	w25q_block_pending = 0;
+	if (w25q_read_len <= 0)
+		return HAL_OK;
+
+	if (W25Q_ReadData_4ba_DMA(w25q_addr_ptr, w25q_spi_buffer, W25Q_BULK_BLOCK_SIZE) != HAL_OK)
+	{
+		periph_error = PE_SPI1_RX_ERROR;
+		hardware_error = HE_W25Q_ERROR;
+		return HAL_ERROR;
+	}
+	w25q_block_pending = 1;
+
+	// 地址自增
+	w25q_addr_ptr += W25Q_BULK_BLOCK_SIZE;
+	w25q_read_len -= W25Q_BULK_BLOCK_SIZE;
+	return HAL_OK;
+}
+
+HAL_StatusTypeDef USBD_SendW25QBlock()
+{
+	// 等待读取完成
+	if (SPI_WaitRx() != HAL_OK)
+	{
+		periph_error = PE_SPI1_RX_ERROR;
+		hardware_error = HE_W25Q_ERROR;
+		w25q_block_pending = 0;
+		return HAL_ERROR;
+	}
+
+	// 交换缓冲并附加CRC
+	USBD_SwapW25QBuffer();
+	uint32_t crc = USBD_Crc32(0, w25q_usb_buffer, W25Q_BULK_BLOCK_SIZE);
+	SERIALIZE(crc, w25q_usb_buffer + W25Q_BULK_BLOCK_SIZE);
+
+	// 读取下一块
+	if (USBD_ReadW25QBlock() != HAL_OK)
+		return HAL_ERROR;
+
+	// 发送当前块
+	if (USBD_TransmitWait(w25q_usb_buffer, W25Q_BULK_BLOCK_SIZE + USBD_CRC_SIZE) != HAL_OK)
+	{
+		periph_error = PE_OTG_FS_TX_ERROR;
+		return HAL_ERROR;
+	}
+	return HAL_OK;
+}
+
+void USBD_AbortBulkRead()
+{
+	// 释放缓冲前等待仍在进行的DMA读取
+	if (w25q_block_pending)
+		SPI_WaitRx();
+	w25q_block_pending = 0;
+	USBD_CleanUpRWFlash();
+}
+
+uint8_t USBD_EmitW25QByte(uint8_t byte)
+{
+	// 输出一个解码后的字节，写满一页时写入Flash
+	if (w25q_lz_remaining == 0)
+		return RESPOND_OK;
+	w25q_lz_remaining--;
+
+	lz_history[lz_pos++ & (LZ_WINDOW_SIZE - 1)] = byte;
+	*w25q_usb_buffer_ptr++ = byte;
+	w25q_usb_buffer_state = W25Q_USB_BUFFER_HAVENT_SENT;
+
+	if (w25q_usb_buffer_ptr - w25q_usb_buffer >= W25Q_WRITE_BUFFER_SIZE)
+	{
+		uint8_t result = USBD_ProgramW25QPage();
+		w25q_addr_ptr += W25Q_WRITE_BUFFER_SIZE;
+		w25q_usb_buffer_state = W25Q_USB_BUFFER_SENT;
+		return result;
+	}
+	return RESPOND_OK;
+}
+
+uint8_t USBD_LzFeed(const uint8_t *data, uint32_t len)
+{
+	/*
+		LZSS解码，压缩流可在任意位置被分包，解码状态跨包保存
+		数据由若干组构成：每组以1字节标志开头，后接8项
+		标志位（从最低位起）为0表示1字节字面量，为1表示2字节匹配：
+		第1字节为(偏移-1)的低8位，第2字节高2位为(偏移-1)的高2位，低6位为(长度-3)
+	*/
+	for (uint32_t i = 0; i < len && w25q_lz_remaining > 0; i++)
+	{
+		uint8_t byte = data[i];
+		uint8_t result = RESPOND_OK;
+		switch (lz_state)
+		{
+		case LZ_STATE_FLAG:
+			lz_flags = byte;
+			lz_flag_bits = 8;
+			lz_state = LZ_STATE_ITEM;
+			continue;
+		case LZ_STATE_ITEM:
+			if (lz_flags & 1)
+			{
+				lz_match_lo = byte;
+				lz_state = LZ_STATE_MATCH;
+				continue;
+			}
+			result = USBD_EmitW25QByte(byte);
+			break;
+		case LZ_STATE_MATCH:
+		{
+			uint16_t offset = (((uint16_t)(byte >> 6) << 8) | lz_match_lo) + 1;
+			uint8_t length = (byte & 0x3F) + LZ_MIN_MATCH;
+			for (uint8_t k = 0; k < length && result == RESPOND_OK; k++)
+				result = USBD_EmitW25QByte(lz_history[(uint16_t)(lz_pos - offset) & (LZ_WINDOW_SIZE - 1)]);
+			lz_state = LZ_STATE_ITEM;
+		}
+		break;
+		default:
+			break;
+		}
+		if (result != RESPOND_OK)
+			return result;
+
+		// 当前项处理完毕，取下一个标志位
+		lz_flags >>= 1;
+		if (--lz_flag_bits == 0)
+			lz_state = LZ_STATE_FLAG;
+	}
+	return RESPOND_OK;
+}
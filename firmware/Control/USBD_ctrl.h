@@ -20,6 +20,10 @@ extern volatile uint8_t usbd_work_state;
 #define CMD_RESET                   0x70 // 复位
 #define CMD_END_WRITE_FLASH         0x73
 #define CMD_SET_SPEED               0x76
+#define CMD_WRITE_FLASH_WINDOW      0x79 // 滑动窗口写Flash
+#define CMD_READ_FLASH_BULK         0x7C // 按块读Flash（每块附带CRC32）
+#define CMD_FLASH_HASH              0x7F // 按扇区计算Flash内容的CRC32
+#define CMD_WRITE_FLASH_LZ          0x82 // 滑动窗口写Flash（数据为LZSS压缩格式）
 
 #define CMD_CLEAN_FLASH_A           0xAB
 #define CMD_CLEAN_FLASH_B           0xCD
@@ -35,6 +35,16 @@
 uint32_t Recv_dlen;
 uint8_t UserRxBuffer[USER_BUFFER_SIZE];
 
+/* 接收队列：启用后收到的包依次入队，由USBD_Poll出队处理，主机可连续发送多个包（滑动窗口）
+   队列满时暂不重新启动接收，主机端的OUT包被NAK，直到有包出队 */
+static uint8_t rx_queue[USBD_RX_QUEUE_DEPTH][USER_BUFFER_SIZE];
+static uint32_t rx_queue_len[USBD_RX_QUEUE_DEPTH];
+static volatile uint8_t rx_queue_head = 0;
+static volatile uint8_t rx_queue_tail = 0;
+static volatile uint8_t rx_queue_count = 0;
+static volatile uint8_t rx_queue_enabled = 0;
+static volatile uint8_t rx_queue_paused = 0;
+
 /* USER CODE END PV */
 
 /** @addtogroup STM32_USB_OTG_DEVICE_LIBRARY
@@ -264,6 +274,23 @@ static int8_t CDC_Control_FS(uint8_t cmd, uint8_t* pbuf, uint16_t length)
 static int8_t CDC_Receive_FS(uint8_t* Buf, uint32_t *Len)
 {
   /* USER CODE BEGIN 6 */
+  if (rx_queue_enabled)
+  {
+    // 入队，队列未满时立即继续接收
+    uint32_t len = *Len > USER_BUFFER_SIZE ? USER_BUFFER_SIZE : *Len;
+    memcpy(rx_queue[rx_queue_head], Buf, len);
+    rx_queue_len[rx_queue_head] = len;
+    rx_queue_head = (rx_queue_head + 1) % USBD_RX_QUEUE_DEPTH;
+    rx_queue_count++;
+
+    USBD_CDC_SetRxBuffer(&hUsbDeviceFS, &Buf[0]);
+    if (rx_queue_count < USBD_RX_QUEUE_DEPTH)
+      USBD_CDC_ReceivePacket(&hUsbDeviceFS);
+    else
+      rx_queue_paused = 1;
+    return (USBD_OK);
+  }
+
   if (usbd_work_state == USBD_WORK_IDLE)
   {
     if (*Len >= 16)
@@ -342,6 +369,51 @@ static int8_t CDC_TransmitCplt_FS(uint8_t *Buf, uint32_t *Len, uint8_t epnum)
 }
 
 /* USER CODE BEGIN PRIVATE_FUNCTIONS_IMPLEMENTATION */
+/**
+  * @brief  启用或停用接收队列，队列中未处理的包被丢弃
+  * @param  enable: 1启用，0停用
+  * @retval None
+  */
+void USBD_RxQueue_Enable(uint8_t enable)
+{
+  __disable_irq();
+  rx_queue_head = 0;
+  rx_queue_tail = 0;
+  rx_queue_count = 0;
+  rx_queue_enabled = enable;
+  if (rx_queue_paused)
+  {
+    rx_queue_paused = 0;
+    USBD_CDC_ReceivePacket(&hUsbDeviceFS);
+  }
+  __enable_irq();
+}
+
+/**
+  * @brief  从接收队列取出一包
+  * @param  dst: 目标缓存，至少USER_BUFFER_SIZE字节
+  * @retval 包长度，队列为空时返回0
+  */
+uint32_t USBD_RxQueue_Pop(uint8_t *dst)
+{
+  if (rx_queue_count == 0)
+    return 0;
+
+  uint32_t len = rx_queue_len[rx_queue_tail];
+  memcpy(dst, rx_queue[rx_queue_tail], len);
+  rx_queue_tail = (rx_queue_tail + 1) % USBD_RX_QUEUE_DEPTH;
+
+  __disable_irq();
+  rx_queue_count--;
+  if (rx_queue_paused)
+  {
+    // 队列有空位，恢复接收
+    rx_queue_paused = 0;
+    USBD_CDC_ReceivePacket(&hUsbDeviceFS);
+  }
+  __enable_irq();
+  return len;
+}
 
 
 /* USER CODE END PRIVATE_FUNCTIONS_IMPLEMENTATION */
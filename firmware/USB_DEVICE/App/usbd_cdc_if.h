@@ -55,6 +55,8 @@
 #define USER_BUFFER_SIZE 64
 extern uint32_t Recv_dlen;
 extern uint8_t UserRxBuffer[USER_BUFFER_SIZE];
+
+#define USBD_RX_QUEUE_DEPTH 8 // 滑动窗口写Flash时的接收队列深度（包）
 /* USER CODE END EXPORTED_DEFINES */
 
 /**
@@ -111,6 +113,8 @@ extern USBD_CDC_ItfTypeDef USBD_Interface_fops_FS;
 uint8_t CDC_Transmit_FS(uint8_t* Buf, uint16_t Len);
 
 /* USER CODE BEGIN EXPORTED_FUNCTIONS */
+void USBD_RxQueue_Enable(uint8_t enable);
+uint32_t USBD_RxQueue_Pop(uint8_t *dst);
 
 /* USER CODE END EXPORTED_FUNCTIONS */
 
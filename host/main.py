@@ -85,7 +85,7 @@ class Application(tk.Tk):
         self.message_queue.put(msg)
 
     def add_task(self, task : Message):
-        self.serial_ctrl.add_task(task)
+        return self.serial_ctrl.add_task(task)
 
     def add_port_monitor_message(self, msg : str):
         self.port_monitor.add_message(msg)
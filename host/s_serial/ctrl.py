@@ -2,17 +2,31 @@ from serial import SerialTimeoutException
 from abc import ABC, abstractmethod
 import numpy as np
 from typing import List
+from collections import deque
+from concurrent.futures import Future
+import itertools
+import threading
 import queue
+import time
+import zlib
+import io
 import os
 
 from .core import SerialCore
 from .msg import MsgType, Message
+from .lz import LZReader, compress
 
 # respond
 RESPOND_OK                  = 0xAA
 RESPOND_BUSY                = 0xAD
 RESPOND_ERROR               = 0xB0
 RESPOND_TIMEOUT             = 0xB3
+RESPOND_PREEMPTED           = 0xB6  # 仅上位机使用：传输被紧急请求中断
+
+# request priority（数值越小越先执行）
+PRIORITY_URGENT             = 0
+PRIORITY_NORMAL             = 1
+PRIORITY_BULK               = 2
 
 class AbstractCoord(ABC):
     @abstractmethod
@@ -57,6 +71,17 @@ class JointCoord(AbstractCoord):
     def get_size() -> int:
         return 6 * 4
 
+class SerialRequest:
+    """一次串口请求，deadline为time.monotonic()时间，future在请求执行完成后给出结果"""
+    def __init__(self, task : Message, priority : int, deadline : float | None):
+        self.task = task
+        self.priority = priority
+        self.deadline = deadline
+        self.future = Future()
+
+    def expired(self) -> bool:
+        return self.deadline is not None and time.monotonic() > self.deadline
+
 class SerialCtrl:
     # cmd
     CMD_IMMEDIATE_STOP          = 0x55
@@ -71,6 +96,10 @@ class SerialCtrl:
     CMD_RESET                   = 0x70
     CMD_END_WRITE_FLASH         = 0x73
     CMD_SET_SPEED               = 0x76
+    CMD_WRITE_FLASH_WINDOW      = 0x79
+    CMD_READ_FLASH_BULK         = 0x7C
+    CMD_FLASH_HASH              = 0x7F
+    CMD_WRITE_FLASH_LZ          = 0x82
 
     CMD_CLEAN_FLASH_A           = 0xAB
     CMD_CLEAN_FLASH_B           = 0xCD
@@ -79,19 +108,61 @@ class SerialCtrl:
 
     USD_CDC_PACKET_SIZE         = 64
     IO_BUFFER_SIZE              = 4096
+    FLASH_SECTOR_SIZE           = 4096  # W25Q扇区大小（擦除的最小单位），增量写入以扇区为单位
+    FLASH_HASH_MAX_SECTORS      = 64    # 单次CRC请求的最大扇区数（与固件USBD_HASH_MAX_SECTORS一致）
+    WRITE_FLASH_WINDOW          = 8     # 滑动窗口写Flash时请求的在途包数，0表示始终逐包应答
+    WRITE_FLASH_COMPRESS        = True  # 固件支持时以压缩格式写Flash
+    COMPRESS_PROBE_SIZE         = 4096  # 判断是否值得压缩时试压缩的数据量
+    COMPRESS_MIN_RATIO          = 0.9   # 试压缩后小于原大小的该比例时才压缩传输
+    READ_FLASH_RETRIES          = 3     # 按块读Flash时单块校验失败的最大重试次数
+    FILE_BUFFER_SIZE            = 65536 # 读Flash时写文件的缓冲大小
+    PROGRESS_STEP               = 1.0   # 进度条两次更新之间的最小进度变化（百分比）
+
+    # 各类请求的优先级，未列出的为PRIORITY_NORMAL
+    TASK_PRIORITY = {
+        MsgType.STOP                : PRIORITY_URGENT,
+        MsgType.WRITE_FLASH         : PRIORITY_BULK,
+        MsgType.READ_FLASH          : PRIORITY_BULK,
+        MsgType.CLEAN_FLASH         : PRIORITY_BULK,
+    }
+    # 各类请求的默认期限（秒，从提交时算起），未列出的不设期限
+    # 排队超过期限的请求不再发送，执行中的Flash读写超过期限时中止，结果均为RESPOND_TIMEOUT
+    TASK_DEADLINE = {
+        MsgType.SEND_ORTHOGONAL_CMD : 5.0,
+        MsgType.SEND_JOINT_CMD      : 5.0,
+        MsgType.OPEN_GRIPPER        : 5.0,
+        MsgType.CLOSE_GRIPPER       : 5.0,
+        MsgType.SEND_SET_SPEED_CMD  : 5.0,
+        MsgType.READ_STATE          : 5.0,
+        MsgType.VISUAL_MODE         : 0.5,  # 过时的视觉坐标没有意义
+    }
 
     def __init__(self, GUI):
         self.GUI = GUI
         self.core = SerialCore(GUI)
-        self.task_queue = queue.Queue()
-
-    def open_port(self, port : str, baudrate : int, timeout : float):
+        self.task_queue = queue.PriorityQueue()    # (优先级, 序号, SerialRequest)
+        self.task_seq = itertools.count()           # 同优先级的请求按提交顺序执行
+        self.current = None                         # 正在执行的请求
+        self.urgent_lock = threading.Lock()
+        self.urgent_pending = 0                     # 已提交但尚未开始执行的紧急请求数
+        self.write_window = None    # 与固件协商得到的窗口大小，None表示尚未协商，0表示固件不支持
+        self.bulk_read = None       # 固件是否支持按块读Flash，None表示尚未协商
+        self.flash_hash = None      # 固件是否支持按扇区计算CRC32，None表示尚未协商
+        self.lz_write = None        # 固件是否支持压缩格式写Flash，None表示尚未协商
+
+    def open_port(self, port : str, baudrate : int, timeout : float) -> int:
+        self.write_window = None
+        self.bulk_read = None
+        self.flash_hash = None
+        self.lz_write = None
         try:
             self.core.open_port(port, baudrate, timeout)
         except:
             self.GUI.add_message(Message(MsgType.OPEN_PORT, "FAILED"))
+            return RESPOND_ERROR
         else:
             self.GUI.add_message(Message(MsgType.OPEN_PORT, "OK"))
+            return RESPOND_OK
 
     # private methods
     @staticmethod
@@ -130,6 +201,14 @@ class SerialCtrl:
         except:
             return RESPOND_ERROR
 
+    def _interrupted(self) -> int | None:
+        """Flash传输在包或块之间检查是否应中止：有紧急请求等待时返回RESPOND_PREEMPTED，当前请求超过期限时返回RESPOND_TIMEOUT"""
+        if self.urgent_pending > 0:
+            return RESPOND_PREEMPTED
+        if self.current is not None and self.current.expired():
+            return RESPOND_TIMEOUT
+        return None
+
     # public methods
     def immediate_stop(self) -> int:
         #self.GUI.add_message(Msg.SET_PROGRESS_BAR + "0")
@@ -204,119 +283,370 @@ class SerialCtrl:
     def close_gripper(self) -> int:
         return self._send_byte_cmd(self.CMD_CLOSE_GRIPPER)
 
-    def write_flash(self, addr : int, file_path : str) -> int:
-        # 发送指令头
-        cmd = bytes([self.CMD_WRITE_FLASH, addr & 0xFF, (addr >> 8) & 0xFF, (addr >> 16) & 0xFF, (addr >> 24) & 0xFF])
-        try:
-            self.core.send(cmd)
+    def _iter_packets(self, file, read_size : int | None = None):
+        """按64字节分包读取文件，不足64字节的包以0xFF补全，同时给出已读取的字节数"""
+        position = 0
+        while True:
+            chunk = file.read(read_size or self.IO_BUFFER_SIZE)
+            if not chunk:
+                break
+            for i in range(0, len(chunk), self.USD_CDC_PACKET_SIZE):
+                sub_chunk = chunk[i:i + self.USD_CDC_PACKET_SIZE]
+                position += len(sub_chunk)
+                if len(sub_chunk) < self.USD_CDC_PACKET_SIZE:
+                    sub_chunk += bytes([0xFF] * (self.USD_CDC_PACKET_SIZE - len(sub_chunk)))
+                yield sub_chunk, position
+
+    def _should_compress(self, file) -> bool:
+        """试压缩文件开头的一段数据，压缩率足够时才压缩传输"""
+        if not self.WRITE_FLASH_COMPRESS or self.lz_write is False or self.WRITE_FLASH_WINDOW <= 0:
+            return False
+        start = file.tell()
+        sample = file.read(self.COMPRESS_PROBE_SIZE)
+        file.seek(start)
+        return len(sample) > 0 and len(compress(sample)) < len(sample) * self.COMPRESS_MIN_RATIO
+
+    def _start_write_flash(self, addr : int, size : int, compressed : bool):
+        """发送写Flash指令头，返回(结果, 是否压缩传输)，固件不支持压缩格式时退回未压缩传输"""
+        addr_bytes = bytes([addr & 0xFF, (addr >> 8) & 0xFF, (addr >> 16) & 0xFF, (addr >> 24) & 0xFF])
+        if compressed and self.write_window != 0:
+            size_bytes = bytes([size & 0xFF, (size >> 8) & 0xFF, (size >> 16) & 0xFF, (size >> 24) & 0xFF])
+            self.core.send(bytes([self.CMD_WRITE_FLASH_LZ]) + addr_bytes + bytes([self.WRITE_FLASH_WINDOW]) + size_bytes)
+            respond = self.core.recv(2)
+            if len(respond) == 2 and respond[0] == RESPOND_OK and respond[1] > 0:
+                self.lz_write = True
+                self.write_window = respond[1]
+                return RESPOND_OK, True
+            if len(respond) > 0:
+                return respond[0], False
+            # 固件不支持压缩格式，不会回复
+            self.lz_write = False
+
+        return self._start_write_flash_raw(addr_bytes), False
+
+    def _start_write_flash_raw(self, addr_bytes : bytes) -> int:
+        """发送未压缩的写Flash指令头，固件支持时协商滑动窗口，否则退回逐包应答"""
+        if self.write_window != 0 and self.WRITE_FLASH_WINDOW > 0:
+            self.core.send(bytes([self.CMD_WRITE_FLASH_WINDOW]) + addr_bytes + bytes([self.WRITE_FLASH_WINDOW]))
+            respond = self.core.recv(2)
+            if len(respond) == 2 and respond[0] == RESPOND_OK and respond[1] > 0:
+                self.write_window = respond[1]
+                return RESPOND_OK
+            if len(respond) > 0:
+                # 固件支持但当前无法写入（如繁忙）
+                return respond[0]
+            # 旧固件不识别该指令，不会回复
+            self.write_window = 0
+
+        self.core.send(bytes([self.CMD_WRITE_FLASH]) + addr_bytes)
+        respond = self.core.recv(1)
+        if len(respond) == 0:
+            return RESPOND_TIMEOUT
+        return respond[0]
+
+    def _write_packets_stop_and_wait(self, packets, total : int, done : int) -> int:
+        """逐包发送，每包等待MCU回复后再发送下一包"""
+        reported = float(done) / float(total) * 100.0
+        for packet, position in packets:
+            interrupted = self._interrupted()
+            if interrupted is not None:
+                return interrupted
+            self.core.send(packet)
             respond = self.core.recv(1)
+            reported = self._update_progress(float(done + position) / float(total) * 100.0, reported)
             if len(respond) == 0:
                 return RESPOND_TIMEOUT
             if respond[0] != RESPOND_OK:
                 return respond[0]
+        return RESPOND_OK
+
+    def _write_packets_windowed(self, packets, total : int, done : int) -> int:
+        """滑动窗口发送，至多write_window个包在途，按包序号核对MCU的回复"""
+        in_flight = deque()     # 在途包对应的原始数据位置
+        ack_seq = 0
+        reported = float(done) / float(total) * 100.0
+
+        def wait_ack() -> int:
+            respond = self.core.recv(2)
+            if len(respond) != 2:
+                return RESPOND_TIMEOUT
+            if respond[0] != RESPOND_OK:
+                return respond[0]
+            if respond[1] != ack_seq & 0xFF:
+                return RESPOND_ERROR
+            return RESPOND_OK
+
+        packets = iter(packets)
+        interrupted = None
+        while True:
+            # 需要中止时不再发送新包，收完在途包的回复后返回
+            if interrupted is None:
+                interrupted = self._interrupted()
+            packet, position = next(packets, (None, None)) if interrupted is None else (None, None)
+            if packet is None and not in_flight:
+                return RESPOND_OK if interrupted is None else interrupted
+
+            # 窗口已满或已发完时，等待最早的在途包的回复
+            if packet is None or len(in_flight) >= self.write_window:
+                result = wait_ack()
+                if result != RESPOND_OK:
+                    return result
+                ack_seq += 1
+                reported = self._update_progress(float(done + in_flight.popleft()) / float(total) * 100.0, reported)
+
+            if packet is not None:
+                self.core.send(packet)
+                in_flight.append(position)
+
+    def _write_flash_data(self, addr : int, file, size : int, total : int | None = None, done : int = 0) -> int:
+        """从addr起写入file中的size字节（指令头、数据包与结束指令），total与done用于计算进度"""
+        # 发送指令头
+        try:
+            result, compressed = self._start_write_flash(addr, size, self._should_compress(file))
+            if result != RESPOND_OK:
+                return result
         except SerialTimeoutException:
             return RESPOND_TIMEOUT
         except:
             return RESPOND_ERROR
 
-        self.GUI.add_message(Message(MsgType.SET_PROGRESS_BAR, 0))
+        windowed = self.write_window is not None and self.write_window > 0
+        total = max(total or size, 1)
+        if compressed:
+            # 边读边压缩，进度按已压缩的原始数据量计算
+            reader = LZReader(file)
+            packets = ((packet, reader.consumed) for packet, _ in self._iter_packets(reader, self.USD_CDC_PACKET_SIZE))
+        else:
+            packets = self._iter_packets(file)
 
         # 发送文件
         try:
-            with open(file_path, 'rb') as file:
-                file_size = os.path.getsize(file_path)
-                write_percentage = 0.0
-
-                while True:
-                    # 读取文件块
-                    chunk = file.read(self.IO_BUFFER_SIZE)
-                    if not chunk:
-                        break
-
-                    for i in range(0, len(chunk), self.USD_CDC_PACKET_SIZE):
-                        sub_chunk = chunk[i:i + self.USD_CDC_PACKET_SIZE]
-                        if len(sub_chunk) < self.USD_CDC_PACKET_SIZE:
-                            padding = bytes([0xFF] * (self.USD_CDC_PACKET_SIZE - len(sub_chunk)))
-                            sub_chunk += padding
-
-                        # 发送文件块
-                        try:
-                            self.core.send(sub_chunk)
-                            respond = self.core.recv(1)
-                            write_percentage += float(len(sub_chunk)) / float(file_size) * 100.0
-                            write_percentage = min(write_percentage, 100)
-                            self.GUI.add_message(Message(MsgType.SET_PROGRESS_BAR, write_percentage))
-                            if len(respond) == 0:
-                                return RESPOND_TIMEOUT
-                            if respond[0] != RESPOND_OK:
-                                return respond[0]
-                        except SerialTimeoutException:
-                            return RESPOND_TIMEOUT
-                        except:
-                            return RESPOND_ERROR
-
-                    '''
-                    if len(chunk) < self.USD_CDC_PACKET_SIZE:
-                        padding = bytes([0xFF] * (self.USD_CDC_PACKET_SIZE - len(chunk)))
-                        chunk += padding
-
-                    # 发送文件块
-                    try:
-                        self.core.send(chunk)
-                        respond = self.core.recv(1)
-                        if len(respond) == 0:
-                            return RESPOND_TIMEOUT
-                        if respond[0] != RESPOND_OK:
-                            return respond[0]
-                        write_percentage += float(self.USD_CDC_PACKET_SIZE) / float(file_size) * 100.0
-                        write_percentage = min(write_percentage, 100)
-                        self.GUI.add_message(Message(MsgType.SET_PROGRESS_BAR, write_percentage))
-                    except SerialTimeoutException:
-                        return RESPOND_TIMEOUT
-                    '''
+            if windowed:
+                result = self._write_packets_windowed(packets, total, done)
+            else:
+                result = self._write_packets_stop_and_wait(packets, total, done)
+        except SerialTimeoutException:
+            return RESPOND_TIMEOUT
+        except:
+            return RESPOND_ERROR
 
-        except FileNotFoundError:
-            self.GUI.add_message(Message(MsgType.CREATE_ERROR_WINDOW, "文件无法打开"))
-            return RESPOND_OK
+        if result != RESPOND_OK and not windowed and self._interrupted() is None:
+            return result
 
-        # 发送结束指令
+        # 发送结束指令（滑动窗口模式出错或传输被中止时也需发送，使MCU退出接收状态）
         try:
             self.core.send(bytes([self.CMD_END_WRITE_FLASH]))
-            respond = self.core.recv(1)
-            self.GUI.add_message(Message(MsgType.SET_PROGRESS_BAR, 100))
-            self.GUI.add_message(Message(MsgType.CREATE_INFO_WINDOW, "写入Flash成功"))
+            respond = self.core.recv(2 if windowed else 1)
+            if result != RESPOND_OK:
+                return result
             if len(respond) == 0:
                 return RESPOND_TIMEOUT
             return respond[0]
         except SerialTimeoutException:
             return RESPOND_TIMEOUT
 
-    def read_flash(self, addr : int, size : int, file_path : str) -> int:
-        # 发送指令头
+    def flash_hashes(self, addr : int, size : int) -> List[int] | None:
+        """读取设备上从addr起每个扇区（最后一段只计剩余长度）的CRC32，固件不支持或出错时返回None"""
+        if self.flash_hash is False:
+            return None
+        # 固件单次最多计算FLASH_HASH_MAX_SECTORS个扇区，超出时分块请求
+        chunk_size = self.FLASH_SECTOR_SIZE * self.FLASH_HASH_MAX_SECTORS
+        hashes = []
+        for offset in range(0, size, chunk_size):
+            chunk = self._flash_hashes_chunk(addr + offset, min(chunk_size, size - offset))
+            if chunk is None:
+                return None
+            hashes += chunk
+        return hashes
+
+    def _flash_hashes_chunk(self, addr : int, size : int) -> List[int] | None:
+        cmd = bytes([self.CMD_FLASH_HASH, addr & 0xFF, (addr >> 8) & 0xFF, (addr >> 16) & 0xFF, (addr >> 24) & 0xFF, size & 0xFF, (size >> 8) & 0xFF, (size >> 16) & 0xFF, (size >> 24) & 0xFF])
+        try:
+            self.core.send(cmd)
+            respond = self.core.recv(1)
+            if len(respond) == 0:
+                # 旧固件不识别该指令，不会回复
+                self.flash_hash = False
+                return None
+            self.flash_hash = True
+            if respond[0] != RESPOND_OK:
+                # 出错时固件只回复一个字节，不再等待后续数据
+                return None
+            respond = self.core.recv(2)
+            if len(respond) != 2:
+                return None
+            count = respond[0] | (respond[1] << 8)
+            crc_bytes = self.core.recv(count * 4)
+            if len(crc_bytes) != count * 4:
+                return None
+            return [int.from_bytes(crc_bytes[i:i + 4], 'little') for i in range(0, len(crc_bytes), 4)]
+        except:
+            return None
+
+    def _write_flash_delta(self, addr : int, data : bytes) -> int | None:
+        """只重写内容有变化的扇区，无法确定设备上的内容时返回None（由调用者完整写入）"""
+        sector = self.FLASH_SECTOR_SIZE
+        if addr % sector != 0 or len(data) == 0:
+            return None
+        local = [zlib.crc32(data[i:i + sector]) for i in range(0, len(data), sector)]
+        device = self.flash_hashes(addr, len(data))
+        if device is None or len(device) != len(local):
+            return None
+
+        # 相邻的变化扇区合并为一次写入
+        runs = []
+        for i, (a, b) in enumerate(zip(local, device)):
+            if a == b:
+                continue
+            if runs and runs[-1][1] == i:
+                runs[-1][1] = i + 1
+            else:
+                runs.append([i, i + 1])
+        if not runs:
+            return RESPOND_OK
+
+        total = sum(len(data[begin * sector:end * sector]) for begin, end in runs)
+        done = 0
+        for begin, end in runs:
+            chunk = data[begin * sector:end * sector]
+            result = self._write_flash_data(addr + begin * sector, io.BytesIO(chunk), len(chunk), total, done)
+            if result != RESPOND_OK:
+                return result
+            done += len(chunk)
+
+        # 校验写入结果，不一致时由调用者完整写入
+        if self.flash_hashes(addr, len(data)) != local:
+            return None
+        return RESPOND_OK
+
+    def write_flash(self, addr : int, file_path : str, delta : bool = False) -> int:
+        try:
+            file = open(file_path, 'rb')
+        except (FileNotFoundError, OSError):
+            self.GUI.add_message(Message(MsgType.CREATE_ERROR_WINDOW, "文件无法打开"))
+            return RESPOND_OK
+
+        self.GUI.add_message(Message(MsgType.SET_PROGRESS_BAR, 0))
+        with file:
+            result = None
+            if delta:
+                # 增量写入：比较各扇区的CRC32，只重写变化的扇区
+                result = self._write_flash_delta(addr, file.read())
+                file.seek(0)
+            if result is None:
+                result = self._write_flash_data(addr, file, os.path.getsize(file_path))
+
+        if result == RESPOND_OK:
+            self.GUI.add_message(Message(MsgType.SET_PROGRESS_BAR, 100))
+            self.GUI.add_message(Message(MsgType.CREATE_INFO_WINDOW, "写入Flash成功"))
+        return result
+
+    def _update_progress(self, percentage : float, reported : float) -> float:
+        """进度变化达到PROGRESS_STEP时才通知界面，返回最近一次通知的进度"""
+        percentage = min(percentage, 100)
+        if percentage - reported >= self.PROGRESS_STEP:
+            self.GUI.add_message(Message(MsgType.SET_PROGRESS_BAR, percentage))
+            return percentage
+        return reported
+
+    def _start_read_flash_bulk(self, addr : int, size : int):
+        """发送按块读Flash指令头，返回(结果, 块大小)，旧固件不回复时块大小为0"""
+        cmd = bytes([self.CMD_READ_FLASH_BULK, addr & 0xFF, (addr >> 8) & 0xFF, (addr >> 16) & 0xFF, (addr >> 24) & 0xFF, size & 0xFF, (size >> 8) & 0xFF, (size >> 16) & 0xFF, (size >> 24) & 0xFF])
+        self.core.send(cmd)
+        respond = self.core.recv(3)
+        if len(respond) == 3 and respond[0] == RESPOND_OK:
+            self.bulk_read = True
+            return RESPOND_OK, respond[1] | (respond[2] << 8)
+        if len(respond) > 0:
+            return respond[0], 0
+        # 旧固件不识别该指令，不会回复
+        self.bulk_read = False
+        return RESPOND_OK, 0
+
+    def _abort_read_flash(self):
+        """回复RESPOND_OK与RESPOND_ERROR以外的内容使MCU终止读取，并接收MCU的回复"""
+        self.core.send(bytes([RESPOND_TIMEOUT]))
+        self.core.recv(1)
+
+    def _read_flash_blocks(self, file, size : int, block_size : int) -> int:
+        """按块接收，每块校验CRC32后回复，校验失败时请求重发"""
+        frame_size = block_size + 4
+        remaining = size
+        reported = 0.0
+        while remaining > 0:
+            retries = 0
+            while True:
+                frame = self.core.recv(frame_size)
+                if len(frame) != frame_size:
+                    # MCU出错时只回复1字节
+                    return frame[0] if len(frame) == 1 else RESPOND_TIMEOUT
+                block = frame[:block_size]
+                if zlib.crc32(block) == int.from_bytes(frame[block_size:], 'little'):
+                    break
+                retries += 1
+                if retries > self.READ_FLASH_RETRIES:
+                    # 多次校验失败
+                    self._abort_read_flash()
+                    return RESPOND_ERROR
+                self.core.send(bytes([RESPOND_ERROR]))
+
+            file.write(block[:remaining])
+            remaining -= len(block)
+            interrupted = self._interrupted() if remaining > 0 else None
+            if interrupted is not None:
+                self._abort_read_flash()
+                return interrupted
+            # 最后一块的ACK使MCU结束读取
+            self.core.send(bytes([RESPOND_OK]))
+            reported = self._update_progress(float(size - max(remaining, 0)) / float(size) * 100.0, reported)
+        return RESPOND_OK
+
+    def _read_flash_packets(self, file, addr : int, size : int) -> int:
+        """逐包接收，每64字节回复一次（旧固件）"""
         cmd = bytes([self.CMD_READ_FLASH, addr & 0xFF, (addr >> 8) & 0xFF, (addr >> 16) & 0xFF, (addr >> 24) & 0xFF, size & 0xFF, (size >> 8) & 0xFF, (size >> 16) & 0xFF, (size >> 24) & 0xFF])
         read_percentage = 0.0
+        reported = 0.0
+        self.core.send(cmd)
+        while True:
+            respond = self.core.recv(self.USD_CDC_PACKET_SIZE)
+            if len(respond) == self.USD_CDC_PACKET_SIZE:
+                # 成功读取，写入文件
+                file.write(respond)
+                interrupted = self._interrupted()
+                if interrupted is not None:
+                    self._abort_read_flash()
+                    return interrupted
+                # 发送ACK
+                self.core.send(bytes([RESPOND_OK]))
+                read_percentage += float(self.USD_CDC_PACKET_SIZE) / float(size) * 100.0
+                reported = self._update_progress(read_percentage, reported)
+            elif len(respond) == 1 and respond[0] == RESPOND_OK:
+                # 完成读取
+                return RESPOND_OK
+            else:
+                # 读取失败
+                return RESPOND_ERROR
+
+    def read_flash(self, addr : int, size : int, file_path : str) -> int:
+        if size <= 0:
+            self.GUI.add_message(Message(MsgType.CREATE_ERROR_WINDOW, "读取长度必须大于0"))
+            return RESPOND_OK
         self.GUI.add_message(Message(MsgType.SET_PROGRESS_BAR, 0))
         try:
-            with open(file_path, 'wb') as file:
-                self.core.send(cmd)
-                while True:
-                    respond = self.core.recv(self.USD_CDC_PACKET_SIZE)
-                    if len(respond) == self.USD_CDC_PACKET_SIZE:
-                        # 成功读取，写入文件
-                        file.write(respond)
-                        # 发送ACK
-                        self.core.send(bytes([RESPOND_OK]))
-                        read_percentage += float(self.USD_CDC_PACKET_SIZE) / float(size) * 100.0
-                        read_percentage = min(read_percentage, 100)
-                        self.GUI.add_message(Message(MsgType.SET_PROGRESS_BAR, read_percentage))
-                    elif len(respond) == 1 and respond[0] == RESPOND_OK:
-                        # 完成读取
-                        self.GUI.add_message(Message(MsgType.SET_PROGRESS_BAR, 100))
-                        self.GUI.add_message(Message(MsgType.CREATE_INFO_WINDOW, "读取Flash成功"))
-                        break
-                    else:
-                        # 读取失败
-                        return RESPOND_ERROR
+            with open(file_path, 'wb', buffering=self.FILE_BUFFER_SIZE) as file:
+                result, block_size = RESPOND_OK, 0
+                if self.bulk_read is not False:
+                    # 发送指令头
+                    result, block_size = self._start_read_flash_bulk(addr, size)
+                    if result != RESPOND_OK:
+                        return result
+
+                if block_size > 0:
+                    result = self._read_flash_blocks(file, size, block_size)
+                else:
+                    result = self._read_flash_packets(file, addr, size)
+                if result != RESPOND_OK:
+                    return result
         except SerialTimeoutException:
             return RESPOND_TIMEOUT
         except FileNotFoundError:
@@ -324,6 +654,9 @@ class SerialCtrl:
             return RESPOND_OK
         except:
             return RESPOND_ERROR
+
+        self.GUI.add_message(Message(MsgType.SET_PROGRESS_BAR, 100))
+        self.GUI.add_message(Message(MsgType.CREATE_INFO_WINDOW, "读取Flash成功"))
         return RESPOND_OK
 
     def clean_flash(self) -> int:
@@ -357,54 +690,97 @@ class SerialCtrl:
 
     def run(self):
         while True:
-            task = self.task_queue.get()
-            if task is None:
+            _, _, request = self.task_queue.get()
+            if request.priority == PRIORITY_URGENT:
+                with self.urgent_lock:
+                    self.urgent_pending -= 1
+            # 已被调用者取消
+            if not request.future.set_running_or_notify_cancel():
                 continue
-            elif task.dict["type"] == MsgType.OPEN_PORT:
-                port_name = task.dict["data"]
-                self.open_port(port_name, 115200, 1)
-            elif task.dict["type"] == MsgType.RESET:
-                self._result_handler(self.reset())
-            elif task.dict["type"] == MsgType.STOP:
-                self._result_handler(self.immediate_stop())
-            elif task.dict["type"] == MsgType.OPEN_GRIPPER:
-                self._result_handler(self.open_gripper())
-            elif task.dict["type"] == MsgType.CLOSE_GRIPPER:
-                self._result_handler(self.close_gripper())
-            elif task.dict["type"] == MsgType.SEND_ORTHOGONAL_CMD:
-                self._result_handler(self.immediate_orthogonal(task.dict["data"]))
-            elif task.dict["type"] == MsgType.SEND_JOINT_CMD:
-                self._result_handler(self.immediate_joint(task.dict["data"]))
-            elif task.dict["type"] == MsgType.READ_STATE:
-                result = self.get_state()
-                if result["state"] != RESPOND_OK:
-                    self.GUI.add_message(Message(MsgType.SET_IMM_CONSOLE_TEXT, "获取状态失败"))
-                else:
-                    text = ("M1: {:.2f}  M2: {:.2f}  M3: {:.2f}\nM4: {:.2f}  S1: {:.2f}  S2: {:.2f}\n"
-                            .format(result["joint_coord"].m1, result["joint_coord"].m2, result["joint_coord"].m3, result["joint_coord"].m4, result["joint_coord"].s1, result["joint_coord"].s2))
-                    self.GUI.add_message(Message(MsgType.SET_IMM_CONSOLE_TEXT, text))
-            elif task.dict["type"] == MsgType.WRITE_FLASH:
-                addr = task.dict["data"]["address"]
-                file_path = task.dict["data"]["file_path"]
-                self._result_handler(self.write_flash(addr, file_path))
-            elif task.dict["type"] == MsgType.READ_FLASH:
-                addr = task.dict["data"]["address"]
-                length = task.dict["data"]["length"]
-                save_path = task.dict["data"]["save_path"]
-                self._result_handler(self.read_flash(addr, length, save_path))
-            elif task.dict["type"] == MsgType.CLEAN_FLASH:
-                self._result_handler(self.clean_flash())
-            elif task.dict["type"] == MsgType.SEND_SET_SPEED_CMD:
-                self._result_handler(self.set_speed(task.dict["data"]["m1_speed"],
-                    task.dict["data"]["m2_speed"], task.dict["data"]["m3_speed"],
-                    task.dict["data"]["m4_speed"], task.dict["data"]["s1_speed"],
-                    task.dict["data"]["s2_speed"]))
-            elif task.dict["type"] == MsgType.VISUAL_MODE:
-                self._result_handler(self.visual_mode(task.dict["data"]["x"], task.dict["data"]["y"], task.dict["data"]["rot"], task.dict["data"]["qr_id"]))
-
-
-    def add_task(self, task : Message):
-        self.task_queue.put(task)
+            # 排队超过期限，不再发送
+            if request.expired():
+                request.future.set_result(RESPOND_TIMEOUT)
+                continue
+
+            self.current = request
+            try:
+                request.future.set_result(self._execute(request.task))
+            except Exception as e:
+                request.future.set_exception(e)
+            finally:
+                self.current = None
+
+    def _execute(self, task : Message):
+        """执行一个请求并通知界面，返回对应方法的结果"""
+        if task is None:
+            return None
+        elif task.dict["type"] == MsgType.OPEN_PORT:
+            port_name = task.dict["data"]
+            return self.open_port(port_name, 115200, 1)
+        elif task.dict["type"] == MsgType.READ_STATE:
+            result = self.get_state()
+            if result["state"] != RESPOND_OK:
+                self.GUI.add_message(Message(MsgType.SET_IMM_CONSOLE_TEXT, "获取状态失败"))
+            else:
+                text = ("M1: {:.2f}  M2: {:.2f}  M3: {:.2f}\nM4: {:.2f}  S1: {:.2f}  S2: {:.2f}\n"
+                        .format(result["joint_coord"].m1, result["joint_coord"].m2, result["joint_coord"].m3, result["joint_coord"].m4, result["joint_coord"].s1, result["joint_coord"].s2))
+                self.GUI.add_message(Message(MsgType.SET_IMM_CONSOLE_TEXT, text))
+            return result
+
+        result = None
+        if task.dict["type"] == MsgType.RESET:
+            result = self.reset()
+        elif task.dict["type"] == MsgType.STOP:
+            result = self.immediate_stop()
+        elif task.dict["type"] == MsgType.OPEN_GRIPPER:
+            result = self.open_gripper()
+        elif task.dict["type"] == MsgType.CLOSE_GRIPPER:
+            result = self.close_gripper()
+        elif task.dict["type"] == MsgType.SEND_ORTHOGONAL_CMD:
+            result = self.immediate_orthogonal(task.dict["data"])
+        elif task.dict["type"] == MsgType.SEND_JOINT_CMD:
+            result = self.immediate_joint(task.dict["data"])
+        elif task.dict["type"] == MsgType.WRITE_FLASH:
+            addr = task.dict["data"]["address"]
+            file_path = task.dict["data"]["file_path"]
+            delta = task.dict["data"].get("delta", False)
+            result = self.write_flash(addr, file_path, delta)
+        elif task.dict["type"] == MsgType.READ_FLASH:
+            addr = task.dict["data"]["address"]
+            length = task.dict["data"]["length"]
+            save_path = task.dict["data"]["save_path"]
+            result = self.read_flash(addr, length, save_path)
+        elif task.dict["type"] == MsgType.CLEAN_FLASH:
+            result = self.clean_flash()
+        elif task.dict["type"] == MsgType.SEND_SET_SPEED_CMD:
+            result = self.set_speed(task.dict["data"]["m1_speed"],
+                task.dict["data"]["m2_speed"], task.dict["data"]["m3_speed"],
+                task.dict["data"]["m4_speed"], task.dict["data"]["s1_speed"],
+                task.dict["data"]["s2_speed"])
+        elif task.dict["type"] == MsgType.VISUAL_MODE:
+            result = self.visual_mode(task.dict["data"]["x"], task.dict["data"]["y"], task.dict["data"]["rot"], task.dict["data"]["qr_id"])
+        self._result_handler(result)
+        return result
+
+    def add_task(self, task : Message, priority : int | None = None, deadline : float | None = None) -> Future:
+        """提交请求，返回的future在请求执行完成后给出结果（即对应方法的返回值）
+
+        priority与deadline（秒）省略时取TASK_PRIORITY与TASK_DEADLINE中的默认值。
+        PRIORITY_URGENT的请求使正在进行的Flash读写在下一个包或块处中止（结果为RESPOND_PREEMPTED）；
+        擦除整片Flash期间MCU无法响应，紧急请求只能等待擦除完成。
+        在asyncio中可通过asyncio.wrap_future()等待结果。
+        """
+        task_type = task.dict["type"] if task is not None else None
+        if priority is None:
+            priority = self.TASK_PRIORITY.get(task_type, PRIORITY_NORMAL)
+        if deadline is None:
+            deadline = self.TASK_DEADLINE.get(task_type)
+        request = SerialRequest(task, priority, None if deadline is None else time.monotonic() + deadline)
+        if priority == PRIORITY_URGENT:
+            with self.urgent_lock:
+                self.urgent_pending += 1
+        self.task_queue.put((priority, next(self.task_seq), request))
+        return request.future
 
     def _result_handler(self, result : int):
         if result == RESPOND_BUSY:
@@ -415,4 +791,6 @@ class SerialCtrl:
             self.GUI.add_message(Message(MsgType.CREATE_ERROR_WINDOW, "出现未知错误"))
         elif result == RESPOND_TIMEOUT:
             #self.GUI.add_message(Msg.CREATE_ERROR_WINDOW + "通信超时")
-            self.GUI.add_message(Message(MsgType.CREATE_ERROR_WINDOW, "通信超时"))
\ No newline at end of file
+            self.GUI.add_message(Message(MsgType.CREATE_ERROR_WINDOW, "通信超时"))
+        elif result == RESPOND_PREEMPTED:
+            self.GUI.add_message(Message(MsgType.CREATE_ERROR_WINDOW, "操作已被紧急停止中断"))
\ No newline at end of file
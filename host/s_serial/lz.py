@@ -0,0 +1,169 @@
+'''
+写Flash时使用的LZSS压缩格式（解码器见固件USBD_ctrl.c中的USBD_LzFeed）
+
+数据由若干组构成：每组以1字节标志开头，后接8项，
+标志位（从最低位起）为0表示1字节字面量，为1表示2字节匹配：
+第1字节为(偏移-1)的低8位，第2字节高2位为(偏移-1)的高2位，低6位为(长度-3)。
+偏移范围1~1024，长度范围3~66；解码出原始数据长度后忽略其余数据。
+'''
+
+LZ_WINDOW_SIZE      = 1024  # 历史窗口大小，与固件一致
+LZ_MIN_MATCH        = 3
+LZ_MAX_MATCH        = 66
+LZ_MAX_CHAIN        = 32    # 查找匹配时最多比较的候选位置数
+LZ_READ_CHUNK       = 256   # LZReader每次从源文件读取的字节数
+
+
+class LZCompressor:
+    """流式压缩，可多次调用compress()，最后调用flush()"""
+
+    def __init__(self):
+        self.buffer = bytearray()   # 窗口内的历史数据与尚未编码的数据
+        self.base = 0               # buffer[0]在整个数据流中的位置
+        self.pos = 0                # 下一个待编码字节在buffer中的位置
+        self.head = {}              # 3字节前缀 -> 最近出现的流位置
+        self.prev = [None] * LZ_WINDOW_SIZE  # 流位置 -> 同前缀的上一个流位置（按窗口大小循环使用）
+        self.flags = 0
+        self.items = 0
+        self.group = bytearray()
+        self.out = bytearray()
+
+    def compress(self, data : bytes) -> bytes:
+        self.buffer += data
+        self._encode(final=False)
+        return self._take()
+
+    def flush(self) -> bytes:
+        self._encode(final=True)
+        self._flush_group()
+        return self._take()
+
+    def _take(self) -> bytes:
+        out = bytes(self.out)
+        self.out.clear()
+        return out
+
+    def _insert(self, p : int):
+        if p + LZ_MIN_MATCH > len(self.buffer):
+            return
+        key = bytes(self.buffer[p:p + LZ_MIN_MATCH])
+        stream_pos = self.base + p
+        self.prev[stream_pos % LZ_WINDOW_SIZE] = self.head.get(key)
+        self.head[key] = stream_pos
+
+    def _find_match(self):
+        buf = self.buffer
+        p = self.pos
+        limit = min(LZ_MAX_MATCH, len(buf) - p)
+        if limit < LZ_MIN_MATCH:
+            return 0, 0
+
+        stream_pos = self.base + p
+        candidate = self.head.get(bytes(buf[p:p + LZ_MIN_MATCH]))
+        best_len, best_offset = 0, 0
+        for _ in range(LZ_MAX_CHAIN):
+            if candidate is None or stream_pos - candidate > LZ_WINDOW_SIZE:
+                break
+            c = candidate - self.base
+            n = 0
+            while n < limit and buf[c + n] == buf[p + n]:
+                n += 1
+            if n > best_len:
+                best_len, best_offset = n, stream_pos - candidate
+                if n == limit:
+                    break
+            previous = self.prev[candidate % LZ_WINDOW_SIZE]
+            # 循环槽位可能已被更新的位置覆盖
+            candidate = previous if previous is not None and previous < candidate else None
+        return best_len, best_offset
+
+    def _encode(self, final : bool):
+        # 非最终调用时保留足够的前瞻数据，保证匹配长度不受分块影响
+        end = len(self.buffer) if final else len(self.buffer) - LZ_MAX_MATCH
+        while self.pos < end:
+            length, offset = self._find_match()
+            if length >= LZ_MIN_MATCH:
+                value = offset - 1
+                self.group += bytes([value & 0xFF, ((value >> 8) << 6) | (length - LZ_MIN_MATCH)])
+                self._next_item(True)
+            else:
+                length = 1
+                self.group.append(self.buffer[self.pos])
+                self._next_item(False)
+            for k in range(length):
+                self._insert(self.pos + k)
+            self.pos += length
+
+        # 丢弃窗口以外的历史
+        drop = self.pos - LZ_WINDOW_SIZE
+        if drop > 0:
+            del self.buffer[:drop]
+            self.base += drop
+            self.pos -= drop
+
+    def _next_item(self, is_match : bool):
+        if is_match:
+            self.flags |= 1 << self.items
+        self.items += 1
+        if self.items == 8:
+            self._flush_group()
+
+    def _flush_group(self):
+        if self.items == 0:
+            return
+        self.out.append(self.flags)
+        self.out += self.group
+        self.flags = 0
+        self.items = 0
+        self.group.clear()
+
+
+class LZReader:
+    """以文件方式读取另一个文件压缩后的数据，consumed为已读入压缩器的原始字节数"""
+
+    def __init__(self, file):
+        self.file = file
+        self.compressor = LZCompressor()
+        self.pending = bytearray()
+        self.consumed = 0
+        self.eof = False
+
+    def read(self, size : int) -> bytes:
+        while len(self.pending) < size and not self.eof:
+            chunk = self.file.read(LZ_READ_CHUNK)
+            if chunk:
+                self.consumed += len(chunk)
+                self.pending += self.compressor.compress(chunk)
+            else:
+                self.pending += self.compressor.flush()
+                self.eof = True
+        data = bytes(self.pending[:size])
+        del self.pending[:size]
+        return data
+
+
+def compress(data : bytes) -> bytes:
+    compressor = LZCompressor()
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress(data : bytes, size : int) -> bytes:
+    """参考解码器（与固件逻辑一致），解码出size字节后停止"""
+    out = bytearray()
+    i = 0
+    while len(out) < size and i < len(data):
+        flags = data[i]
+        i += 1
+        for bit in range(8):
+            if len(out) >= size or i >= len(data):
+                break
+            if flags >> bit & 1:
+                value = data[i] | ((data[i + 1] >> 6) << 8)
+                length = (data[i + 1] & 0x3F) + LZ_MIN_MATCH
+                i += 2
+                for _ in range(length):
+                    out.append(out[len(out) - value - 1])
+            else:
+                out.append(data[i])
+                i += 1
+    return bytes(out[:size])
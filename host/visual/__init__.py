@@ -1,2 +1,2 @@
 from .visual_detect import visual_detect, set_thread_alive
-from .visual_detect_2 import visual_detect_2, set_loop_flag
\ No newline at end of file
+from .visual_detect_2 import visual_detect_2, set_loop_flag, open_frame_source, DetectionSession, TargetFusion, load_camera_calibration
\ No newline at end of file
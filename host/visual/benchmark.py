@@ -0,0 +1,256 @@
+"""视觉流水线基准测试（无界面运行，输出各阶段延迟分位数、吞吐量与检出率的JSON）
+
+用法（在host目录下）:
+    python -m visual.benchmark --synthetic 200 --output bench.json
+    python -m visual.benchmark --source recording.mp4
+"""
+import argparse
+import json
+import platform
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from .visual_detect_2 import (CUDA_AVAILABLE, FrameCache, QRDetector, detect_and_decode_qrcode,
+                              find_squares_optimized, merge_close_squares, open_frame_source,
+                              zoom_and_search)
+
+# 基准测试参数
+BENCH_FRAME_SIZE = (640, 480)  # 合成帧尺寸(宽, 高)
+BENCH_QR_MODULE_RANGE = (4, 7)  # 合成二维码每个模块的像素数范围
+BENCH_QR_QUIET_ZONE = 4  # 二维码静区宽度(模块)
+BENCH_MAX_TILT = 30  # 合成目标的最大旋转角度(度)
+BENCH_SQUARE_SIZE_RANGE = (80, 160)  # 合成方形边长范围(像素)
+BENCH_SQUARE_MATCH_RATIO = 0.25  # 方形中心偏差小于边长的该比例即视为检出
+BENCH_WARMUP_FRAMES = 5  # 预热帧数（不计入统计）
+BENCH_PERCENTILES = (50, 95, 99)
+
+STAGES = ('barcode_decode', 'find_squares_optimized', 'detect_and_decode_qrcode',
+          'merge_close_squares', 'zoom_and_search')
+
+
+def _rotated_square(center, side, angle):
+    """返回以center为中心、边长为side、旋转angle度的方形四个角点"""
+    half = side / 2
+    corners = np.float32([[-half, -half], [half, -half], [half, half], [-half, half]])
+    theta = np.deg2rad(angle)
+    rotation = np.float32([[np.cos(theta), -np.sin(theta)], [np.sin(theta), np.cos(theta)]])
+    return corners @ rotation.T + np.float32(center)
+
+
+def _textured_background(rng, width, height):
+    """生成带纹理和杂物的背景"""
+    coarse = rng.integers(60, 200, (height // 16 + 1, width // 16 + 1), dtype=np.uint8)
+    background = cv2.resize(coarse, (width, height), interpolation=cv2.INTER_CUBIC)
+    background = cv2.add(background, rng.integers(0, 30, (height, width), dtype=np.uint8))
+    background = cv2.cvtColor(background, cv2.COLOR_GRAY2BGR)
+    for _ in range(int(rng.integers(5, 15))):
+        p1 = tuple(int(v) for v in rng.integers(0, (width, height)))
+        p2 = tuple(int(v) for v in rng.integers(0, (width, height)))
+        color = tuple(int(v) for v in rng.integers(0, 256, 3))
+        cv2.line(background, p1, p2, color, int(rng.integers(1, 4)))
+    return background
+
+
+def synthetic_qr_frame(rng, index, size=BENCH_FRAME_SIZE):
+    """生成一帧合成图像：纹理背景上放置一个旋转的二维码和一个方形，返回(frame, 真值)"""
+    width, height = size
+    frame = _textured_background(rng, width, height)
+    encoder = cv2.QRCodeEncoder.create()
+
+    # 二维码（带白色静区）放在左半幅，方形放在右半幅，避免相互遮挡
+    data = f"{index}\n{rng.choice(['left', 'right'])}\n{rng.choice(['yes', 'no'])}"
+    modules = encoder.encode(data)
+    modules = cv2.copyMakeBorder(modules, BENCH_QR_QUIET_ZONE, BENCH_QR_QUIET_ZONE,
+                                 BENCH_QR_QUIET_ZONE, BENCH_QR_QUIET_ZONE, cv2.BORDER_CONSTANT, value=255)
+    module_px = int(rng.integers(*BENCH_QR_MODULE_RANGE, endpoint=True))
+    qr_side = modules.shape[0] * module_px
+    qr_side = min(qr_side, int(min(width / 2, height) / 1.5))
+    qr_image = cv2.resize(modules, (qr_side, qr_side), interpolation=cv2.INTER_NEAREST)
+    qr_image = cv2.cvtColor(qr_image, cv2.COLOR_GRAY2BGR)
+
+    margin = qr_side * 0.75
+    qr_center = (rng.uniform(margin, width / 2 - margin / 2), rng.uniform(margin, height - margin))
+    qr_corners = _rotated_square(qr_center, qr_side, rng.uniform(-BENCH_MAX_TILT, BENCH_MAX_TILT))
+    src = np.float32([[0, 0], [qr_side, 0], [qr_side, qr_side], [0, qr_side]])
+    M = cv2.getPerspectiveTransform(src, qr_corners)
+    warped = cv2.warpPerspective(qr_image, M, (width, height), flags=cv2.INTER_LINEAR)
+    mask = cv2.warpPerspective(np.full((qr_side, qr_side), 255, np.uint8), M, (width, height))
+    frame[mask > 0] = warped[mask > 0]
+
+    square_side = rng.uniform(*BENCH_SQUARE_SIZE_RANGE)
+    square_margin = square_side * 0.75
+    square_center = (rng.uniform(width / 2 + square_margin, width - square_margin),
+                     rng.uniform(square_margin, height - square_margin))
+    square_corners = _rotated_square(square_center, square_side, rng.uniform(-BENCH_MAX_TILT, BENCH_MAX_TILT))
+    color = tuple(int(v) for v in rng.integers(0, 40, 3))
+    cv2.fillConvexPoly(frame, np.int32(np.round(square_corners)), color)
+
+    return frame, {'qr': [data], 'squares': [square_corners]}
+
+
+def synthetic_frames(count, seed=0, size=BENCH_FRAME_SIZE):
+    """合成帧序列（固定随机种子，结果可复现）"""
+    rng = np.random.default_rng(seed)
+    for index in range(count):
+        yield synthetic_qr_frame(rng, index, size)
+
+
+def recorded_frames(source, limit=None):
+    """录制帧序列（无真值）"""
+    cap = open_frame_source(source, realtime=False)
+    if not cap.isOpened():
+        raise RuntimeError(f"无法打开帧源: {source}")
+    try:
+        count = 0
+        while limit is None or count < limit:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if len(frame.shape) == 2:
+                frame = cv2.cvtColor(frame, cv2.COLOR_GRAY2BGR)
+            count += 1
+            yield frame, None
+    finally:
+        cap.release()
+
+
+def _square_hits(truth_squares, squares):
+    """统计被检出的真值方形数量（按中心距离匹配）"""
+    if not squares:
+        return 0
+    centers = np.array([np.mean(s, axis=0) for s in squares])
+    hits = 0
+    for corners in truth_squares:
+        side = np.linalg.norm(corners[1] - corners[0])
+        distances = np.linalg.norm(centers - corners.mean(axis=0), axis=1)
+        hits += int(np.min(distances) <= side * BENCH_SQUARE_MATCH_RATIO)
+    return hits
+
+
+class PipelineBenchmark:
+    """逐帧依次运行各检测阶段并记录耗时（顺序执行以隔离各阶段的延迟）"""
+
+    def __init__(self):
+        self.detector = QRDetector()
+        self.timings = {stage: [] for stage in STAGES}
+        self.frame_times = []
+        self.truth = {'qr': 0, 'squares': 0}
+        self.hits = {'qr': 0, 'squares': 0}
+
+    def _timed(self, stage, func, *args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.timings[stage].append(time.perf_counter() - start)
+        return result
+
+    def run_frame(self, frame, truth=None, record=True):
+        timings = self.timings
+        if not record:
+            self.timings = {stage: [] for stage in STAGES}
+
+        start = time.perf_counter()
+        cache = FrameCache(frame)
+        # 整帧pyzbar解码由各检测器共享，单独计时以免计入先访问缓存的阶段
+        self._timed('barcode_decode', cache.barcodes)
+        squares = self._timed('find_squares_optimized', find_squares_optimized, frame, cache=cache)
+        qr_results = self._timed('detect_and_decode_qrcode', detect_and_decode_qrcode, frame,
+                                 detector=self.detector, cache=cache)
+        merged = self._timed('merge_close_squares', merge_close_squares, squares) if squares else []
+
+        # 与主循环一致：优先放大方形区域，否则放大二维码区域
+        zoom_rect = merged[0] if merged else (qr_results[0]["polygon"] if qr_results else None)
+        if zoom_rect is not None:
+            self._timed('zoom_and_search', zoom_and_search, frame, zoom_rect)
+        elapsed = time.perf_counter() - start
+
+        if not record:
+            self.timings = timings
+            return
+
+        self.frame_times.append(elapsed)
+        if truth is not None:
+            decoded = {qr["data"] for qr in qr_results}
+            self.truth['qr'] += len(truth['qr'])
+            self.hits['qr'] += sum(data in decoded for data in truth['qr'])
+            self.truth['squares'] += len(truth['squares'])
+            self.hits['squares'] += _square_hits(truth['squares'], merged)
+
+    @staticmethod
+    def summarize(samples):
+        """延迟统计(毫秒)"""
+        if not samples:
+            return {'count': 0}
+        samples_ms = np.asarray(samples) * 1000
+        summary = {'count': len(samples), 'mean_ms': round(float(samples_ms.mean()), 3)}
+        for p, value in zip(BENCH_PERCENTILES, np.percentile(samples_ms, BENCH_PERCENTILES)):
+            summary[f'p{p}_ms'] = round(float(value), 3)
+        return summary
+
+    def report(self, source):
+        total = sum(self.frame_times)
+        return {
+            'source': source,
+            'frames': len(self.frame_times),
+            'throughput_fps': round(len(self.frame_times) / total, 2) if total > 0 else None,
+            'frame': self.summarize(self.frame_times),
+            'stages': {stage: self.summarize(samples) for stage, samples in self.timings.items()},
+            'recall': {key: (round(self.hits[key] / self.truth[key], 4) if self.truth[key] else None)
+                       for key in self.truth},
+            'environment': {
+                'python': platform.python_version(),
+                'numpy': np.__version__,
+                'opencv': cv2.__version__,
+                'cuda': CUDA_AVAILABLE,
+                'machine': platform.machine(),
+            },
+        }
+
+    def shutdown(self):
+        self.detector.shutdown()
+
+
+def run_benchmark(frames, source, warmup=BENCH_WARMUP_FRAMES):
+    """对帧序列运行基准测试，返回报告字典"""
+    bench = PipelineBenchmark()
+    try:
+        for index, (frame, truth) in enumerate(frames):
+            bench.run_frame(frame, truth, record=index >= warmup)
+        return bench.report(source)
+    finally:
+        bench.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="视觉流水线基准测试")
+    parser.add_argument('--source', help="视频文件、图像序列目录或.npy帧文件（省略时使用合成帧）")
+    parser.add_argument('--synthetic', type=int, default=200, help="合成帧数量")
+    parser.add_argument('--limit', type=int, help="录制帧最多处理的帧数")
+    parser.add_argument('--seed', type=int, default=0, help="合成帧随机种子")
+    parser.add_argument('--size', default=f"{BENCH_FRAME_SIZE[0]}x{BENCH_FRAME_SIZE[1]}", help="合成帧尺寸，如640x480")
+    parser.add_argument('--warmup', type=int, default=BENCH_WARMUP_FRAMES, help="预热帧数")
+    parser.add_argument('--output', help="JSON报告输出路径（默认输出到标准输出）")
+    args = parser.parse_args(argv)
+
+    if args.source:
+        frames = recorded_frames(args.source, args.limit)
+        source = args.source
+    else:
+        width, height = (int(v) for v in args.size.lower().split('x'))
+        frames = synthetic_frames(args.synthetic + args.warmup, args.seed, (width, height))
+        source = f"synthetic(seed={args.seed}, size={width}x{height})"
+
+    report = run_benchmark(frames, source, args.warmup)
+    text = json.dumps(report, indent=2, ensure_ascii=False)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(text)
+    else:
+        print(text)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,218 @@
+"""相机标定（内参、畸变与工作平面单应性），并预计算像素到平面毫米坐标的查找表
+
+标定流程（在host目录下）:
+    python -m visual.calibration --images calib_images --pattern 9x6 --square 25 \
+        --plane calib_images/plane.png --output calibration/camera_0.npz
+
+--images目录中为不同姿态拍摄的棋盘格图像，用于拟合内参与畸变；
+--plane为棋盘格平放在工作平面上时拍摄的图像，用于拟合平面单应性。
+平面坐标以图像中心对应的平面点为原点，x向右、y向下，单位为毫米，与原先的中心坐标系一致。
+指定--board-origin时平面坐标改以标定板原点为原点：多个相机拍摄同一位置的标定板平面图像后，
+各相机的坐标位于同一世界坐标系中，可以进行多相机融合。
+"""
+import argparse
+import json
+import os
+import sys
+
+import cv2
+import numpy as np
+
+CALIB_IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+CALIB_SUBPIX_CRITERIA = (cv2.TERM_CRITERIA_EPS + cv2.TERM_CRITERIA_MAX_ITER, 30, 0.001)
+CALIB_MIN_VIEWS = 3  # 拟合内参所需的最少有效图像数
+
+
+def load_images(directory):
+    """按文件名顺序读取目录中的标定图像"""
+    paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                   if name.lower().endswith(CALIB_IMAGE_EXTENSIONS))
+    return [(path, image) for path, image in ((p, cv2.imread(p)) for p in paths) if image is not None]
+
+
+def find_checkerboard_points(image, pattern_size, square_size):
+    """检测棋盘格内角点，返回(图像点, 平面点(mm))，未检测到时返回None"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    found, corners = cv2.findChessboardCorners(gray, pattern_size,
+                                               cv2.CALIB_CB_ADAPTIVE_THRESH | cv2.CALIB_CB_NORMALIZE_IMAGE)
+    if not found:
+        return None
+    corners = cv2.cornerSubPix(gray, corners, (11, 11), (-1, -1), CALIB_SUBPIX_CRITERIA)
+
+    cols, rows = pattern_size
+    object_points = np.zeros((rows * cols, 3), np.float32)
+    object_points[:, :2] = np.mgrid[0:cols, 0:rows].T.reshape(-1, 2) * square_size
+    return corners.reshape(-1, 2), object_points
+
+
+def find_qr_board_points(image, layout):
+    """检测二维码标定板，layout为{二维码内容: [左上角x(mm), 左上角y(mm), 边长(mm)]}
+
+    每个识别到的二维码贡献四个角点（顺序与OpenCV返回的顶点一致：左上、右上、右下、左下）。
+    """
+    ok, data, points, _ = cv2.QRCodeDetector().detectAndDecodeMulti(image)
+    if not ok:
+        return None
+
+    image_points, object_points = [], []
+    for text, corners in zip(data, points):
+        if text not in layout:
+            continue
+        x, y, size = layout[text]
+        image_points.append(corners.reshape(4, 2))
+        object_points.append([[x, y, 0], [x + size, y, 0], [x + size, y + size, 0], [x, y + size, 0]])
+    if len(image_points) < 2:
+        return None
+    return np.concatenate(image_points).astype(np.float32), np.asarray(object_points, np.float32).reshape(-1, 3)
+
+
+class CameraCalibration:
+    """相机标定结果及预计算的查找表
+
+    world_map[v, u]为原始(未去畸变)像素(u, v)对应的工作平面坐标(mm)，
+    每次检测只需查表插值，无需逐点去畸变和透视变换。
+    """
+
+    def __init__(self, camera_matrix, dist_coeffs, homography, image_size, camera_height=None, world_frame=False):
+        self.camera_matrix = np.asarray(camera_matrix, np.float64)
+        self.dist_coeffs = np.asarray(dist_coeffs, np.float64).reshape(-1)
+        self.homography = np.asarray(homography, np.float64)  # 去畸变像素 -> 平面坐标(mm)
+        self.world_frame = bool(world_frame)  # True: 以标定板原点为原点（多相机共享），False: 以图像中心为原点
+        self.image_size = tuple(int(v) for v in image_size)  # (宽, 高)
+        self.camera_height = camera_height  # 相机光心到工作平面的距离(mm)
+
+        width, height = self.image_size
+        self.undistort_maps = cv2.initUndistortRectifyMap(self.camera_matrix, self.dist_coeffs, None,
+                                                          self.camera_matrix, self.image_size, cv2.CV_16SC2)
+
+        # 对每个像素去畸变后再做透视变换，得到像素到平面坐标的查找表
+        u, v = np.meshgrid(np.arange(width, dtype=np.float32), np.arange(height, dtype=np.float32))
+        pixels = np.stack([u, v], axis=-1).reshape(-1, 1, 2)
+        undistorted = cv2.undistortPoints(pixels, self.camera_matrix, self.dist_coeffs, P=self.camera_matrix)
+        self.world_map = cv2.perspectiveTransform(undistorted, self.homography).reshape(height, width, 2)
+
+    def matches(self, frame_width, frame_height):
+        """标定是否适用于该分辨率"""
+        return self.image_size == (frame_width, frame_height)
+
+    def pixel_to_mm(self, points):
+        """原始像素坐标 -> 平面坐标(mm)，查找表双线性插值"""
+        points = np.asarray(points, np.float32).reshape(-1, 2)
+        width, height = self.image_size
+        x = np.clip(points[:, 0], 0, width - 1.001)
+        y = np.clip(points[:, 1], 0, height - 1.001)
+        x0, y0 = x.astype(np.int32), y.astype(np.int32)
+        fx, fy = (x - x0)[:, None], (y - y0)[:, None]
+        m = self.world_map
+        top = m[y0, x0] * (1 - fx) + m[y0, x0 + 1] * fx
+        bottom = m[y0 + 1, x0] * (1 - fx) + m[y0 + 1, x0 + 1] * fx
+        return top * (1 - fy) + bottom * fy
+
+    def undistort(self, image):
+        """整帧去畸变（使用预计算的映射表）"""
+        return cv2.remap(image, *self.undistort_maps, cv2.INTER_LINEAR)
+
+    @classmethod
+    def fit(cls, views, plane_view, image_size, board_origin=False):
+        """由多组(图像点, 平面点)拟合内参与畸变，由工作平面上的一组点拟合平面单应性
+
+        board_origin为True时保留标定板坐标系作为世界坐标系，否则以图像中心对应的平面点为原点。
+        """
+        if len(views) < CALIB_MIN_VIEWS:
+            raise ValueError(f"有效标定图像不足{CALIB_MIN_VIEWS}张")
+        image_points = [points for points, _ in views]
+        object_points = [objects for _, objects in views]
+        rms, camera_matrix, dist_coeffs, _, _ = cv2.calibrateCamera(object_points, image_points, image_size,
+                                                                    None, None)
+
+        plane_pixels, plane_objects = plane_view
+        undistorted = cv2.undistortPoints(plane_pixels.reshape(-1, 1, 2), camera_matrix, dist_coeffs,
+                                          P=camera_matrix)
+        homography, _ = cv2.findHomography(undistorted, plane_objects[:, :2], cv2.RANSAC)
+
+        # 以图像中心对应的平面点为原点
+        if not board_origin:
+            center = np.float64([[[(image_size[0] - 1) / 2, (image_size[1] - 1) / 2]]])
+            origin = cv2.perspectiveTransform(center, homography).reshape(2)
+            homography = np.array([[1, 0, -origin[0]], [0, 1, -origin[1]], [0, 0, 1]]) @ homography
+
+        # 相机到工作平面的距离
+        _, rvec, tvec = cv2.solvePnP(plane_objects, plane_pixels, camera_matrix, dist_coeffs)
+        rotation, _ = cv2.Rodrigues(rvec)
+        camera_height = float(abs((-rotation.T @ tvec)[2, 0]))
+
+        calibration = cls(camera_matrix, dist_coeffs, homography, image_size, camera_height, board_origin)
+        calibration.rms = rms
+        return calibration
+
+    def save(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.savez(path, camera_matrix=self.camera_matrix, dist_coeffs=self.dist_coeffs,
+                 homography=self.homography, image_size=np.int32(self.image_size),
+                 camera_height=np.float64(self.camera_height if self.camera_height is not None else np.nan),
+                 world_frame=np.bool_(self.world_frame))
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            camera_height = float(data['camera_height'])
+            world_frame = bool(data['world_frame']) if 'world_frame' in data.files else False
+            return cls(data['camera_matrix'], data['dist_coeffs'], data['homography'], data['image_size'],
+                       None if np.isnan(camera_height) else camera_height, world_frame)
+
+
+def load_calibration(path):
+    """读取标定文件，文件不存在或无法读取时返回None"""
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return CameraCalibration.load(path)
+    except Exception:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="相机标定")
+    parser.add_argument('--images', required=True, help="标定图像目录")
+    parser.add_argument('--plane', required=True, help="标定板平放在工作平面上时的图像")
+    parser.add_argument('--pattern', default="9x6", help="棋盘格内角点数(列x行)")
+    parser.add_argument('--square', type=float, default=25.0, help="棋盘格方格边长(mm)")
+    parser.add_argument('--qr-layout', help="二维码标定板布局JSON（指定时使用二维码标定板代替棋盘格）")
+    parser.add_argument('--board-origin', action='store_true',
+                        help="以标定板原点为世界坐标原点（多相机融合时各相机都需如此标定）")
+    parser.add_argument('--output', required=True, help="标定结果输出路径(.npz)")
+    args = parser.parse_args(argv)
+
+    if args.qr_layout:
+        with open(args.qr_layout, encoding='utf-8') as f:
+            layout = json.load(f)
+        detect = lambda image: find_qr_board_points(image, layout)
+    else:
+        pattern_size = tuple(int(v) for v in args.pattern.lower().split('x'))
+        detect = lambda image: find_checkerboard_points(image, pattern_size, args.square)
+
+    views, image_size = [], None
+    for path, image in load_images(args.images):
+        points = detect(image)
+        if points is None:
+            print(f"未检测到标定板: {path}")
+            continue
+        views.append(points)
+        image_size = image.shape[1::-1]
+
+    plane_image = cv2.imread(args.plane)
+    plane_view = detect(plane_image) if plane_image is not None else None
+    if plane_view is None:
+        print(f"工作平面图像中未检测到标定板: {args.plane}")
+        return 1
+
+    calibration = CameraCalibration.fit(views, plane_view, image_size or plane_image.shape[1::-1], args.board_origin)
+    calibration.save(args.output)
+    print(f"标定完成: 重投影误差 {calibration.rms:.3f}px, 相机高度 {calibration.camera_height:.1f}mm -> {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
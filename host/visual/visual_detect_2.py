@@ -3,23 +3,30 @@ import numpy as np
 import os
 import time
 from pyzbar import pyzbar
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait
+from multiprocessing import resource_tracker, shared_memory
 from collections import deque
-from threading import Lock
+from functools import lru_cache, partial
+from threading import Condition, Lock, Thread
 import warnings
+import weakref
 import logging
+from abc import ABC, abstractmethod
 from pyzbar.pyzbar import decode as pyzbar_decode
+from pyzbar.locations import Point, Rect
 
 from widgets.console import VisualConsole
+from .calibration import load_calibration
 from s_serial import Message, MsgType
 
 # 忽略警告
 warnings.filterwarnings("ignore", category=RuntimeWarning)
 
-LOOP_FLAG = True
 def set_loop_flag(flag):
-    global LOOP_FLAG
-    LOOP_FLAG = flag
+    """兼容旧接口：flag为False时停止所有正在运行的检测会话"""
+    if not flag:
+        for session in list(ACTIVE_SESSIONS):
+            session.stop()
 
 # 初始化日志
 logging.basicConfig(
@@ -37,6 +44,8 @@ THRESH = 100  # Canny边缘检测阈值
 N = 11  # 阈值级别数量
 MIN_AREA = 1000  # 最小面积阈值
 MAX_COSINE = 0.3  # 最大角度余弦值(用于检测直角)
+SQUARE_THRESH_LEVELS = N  # 方形检测使用的阈值级别数量（含第0级Canny边缘）
+ADAPTIVE_THRESH_LEVELS = False  # 是否按灰度分布自适应选择阈值
 
 # 坐标网格参数
 GRID_SPACING = 50  # 网格间距(像素)
@@ -57,6 +66,7 @@ MERGE_ANGLE_THRESHOLD = 30
 # 像素到毫米的转换
 PX_TO_MM = 1.25# 0.5mm/像素
 CAMERA_HEIGHT = 800  # 相机高度(mm)
+CALIBRATION_FILE_PATTERN = "calibration/camera_{}.npz"  # 各摄像头的标定文件，存在时替代上面两个常数
 
 # 数字显示参数
 DIGIT_DISPLAY_SIZE = 100
@@ -73,6 +83,17 @@ QR_COLOR = (0, 255, 0)
 
 # 并行处理设置
 MAX_WORKERS = 4  # 最大线程数
+VISION_BACKEND = 'thread'  # 检测后端：'thread'（线程池）或'process'（进程池，帧经共享内存传递）
+SHARED_FRAME_SLOTS = MAX_WORKERS + 2  # 进程后端的共享内存帧槽数量
+
+# 帧源参数
+REPLAY_DEFAULT_FPS = 30.0  # 回放文件缺少帧率信息时使用的帧率
+REPLAY_FRAME_EXTENSIONS = ('.png', '.npy')  # 图像序列目录中识别的帧文件
+CAPTURE_THREADED = True  # 摄像头是否使用独立采集线程
+CAPTURE_POLICY = 'latest'  # 采集丢帧策略：'latest'（总是取最新帧）或'drop_oldest'（按序处理，满时丢弃最旧帧）
+CAPTURE_RING_SIZE = 4  # 采集环形缓冲区帧数（至少3：采集中、待取、处理中各一帧）
+CAPTURE_MAX_FAILURES = 30  # 连续采集失败多少次后停止采集线程
+CAPTURE_SET_TIMEOUT = 0.2  # 设置摄像头属性时等待采集线程执行结果的时间(秒)
 
 # 优化参数
 GAUSSIAN_BLUR_SIZE = (3, 3)  # 高斯模糊核大小
@@ -83,6 +104,11 @@ BRIGHTNESS_ADJUSTMENT_RATE = 0.1  # 亮度调整速率
 TARGET_QR_BRIGHTNESS = 120  # 目标二维码亮度值
 MIN_BRIGHTNESS = -50  # 最小亮度调整值
 MAX_BRIGHTNESS = 50  # 最大亮度调整值
+BRIGHTNESS_CONTROL = 'lut'  # 亮度补偿方式：'lut'（查表作用于检测ROI和显示图像）或'camera'（调节摄像头属性）
+CAMERA_BRIGHTNESS_PROP = cv2.CAP_PROP_GAIN  # 'camera'方式调节的摄像头属性（也可改为CAP_PROP_EXPOSURE）
+CAMERA_BRIGHTNESS_RANGE = (0, 255)  # 摄像头属性的取值范围
+CAMERA_BRIGHTNESS_RATE = 0.2  # 每单位亮度偏差对应的属性调整量
+CAMERA_CONTROL_INTERVAL = 0.5  # 两次设置摄像头属性的最小间隔(秒)
 
 # 圆形检测参数
 CIRCLE_MIN_DIST = 30  # 圆心之间的最小距离
@@ -91,12 +117,9 @@ CIRCLE_PARAM2 = 64  # 累加器阈值
 CIRCLE_MIN_RADIUS = 10  # 最小半径
 CIRCLE_MAX_RADIUS = 100  # 最大半径
 
-# 输出全局变量
-DETECTED = False
-AXIS_X = 0
-AXIS_Y = 0
-ROT = 0
-CURRENT_BRIGHTNESS = 0
+# 多相机会话参数
+ACTIVE_SESSIONS = weakref.WeakSet()  # 正在运行的检测会话
+FUSION_MAX_AGE = 1.0  # 融合时只使用该时间(秒)内更新过的相机目标
 
 # 安全状态记录
 secure_status = {}  # 使用QR码ID作为键，True/False作为值
@@ -108,16 +131,91 @@ SECURE_LOCK = Lock()  # 安全状态数据锁
 HISTORY_LENGTH = 5  # 使用最近5帧进行平滑
 position_history = []
 
+
+
+class CoordinateWindow:
+    """坐标滑动窗口（固定容量的环形缓冲区，增量维护累加和并按时间戳淘汰旧样本）"""
+
+    def __init__(self, capacity=100):
+        self.capacity = capacity
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.values = np.zeros((capacity, 3), dtype=np.float64)  # x, y, rot
+        self.sums = np.zeros(3, dtype=np.float64)
+        self.start = 0
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def append(self, t, x, y, rot):
+        """添加一个样本，缓冲区满时淘汰最旧的样本"""
+        if self.count == self.capacity:
+            self._pop_oldest()
+        idx = (self.start + self.count) % self.capacity
+        self.times[idx] = t
+        self.values[idx] = (x, y, rot)
+        self.sums += self.values[idx]
+        self.count += 1
+
+    def _pop_oldest(self):
+        self.sums -= self.values[self.start]
+        self.start = (self.start + 1) % self.capacity
+        self.count -= 1
+        if self.count == 0:
+            self.sums[:] = 0  # 清除累计的浮点误差
+
+    def expire(self, now, window):
+        """淘汰时间早于now - window的样本"""
+        while self.count and now - self.times[self.start] > window:
+            self._pop_oldest()
+
+    def latest(self, n=None):
+        """按时间顺序返回最近n个样本的(时间, 坐标)数组"""
+        n = self.count if n is None else min(n, self.count)
+        idx = (self.start + np.arange(self.count - n, self.count)) % self.capacity
+        return self.times[idx], self.values[idx]
+
+    def mean(self):
+        """平均值（O(1)）"""
+        return self.sums / self.count if self.count else None
+
+    def median(self):
+        """中位数"""
+        return np.median(self.latest()[1], axis=0) if self.count else None
+
+    def robust_mean(self, k=3.0):
+        """剔除离群点后的平均值（以中位数绝对偏差为尺度，超过k倍的样本视为离群）"""
+        if not self.count:
+            return None
+        values = self.latest()[1]
+        median = np.median(values, axis=0)
+        mad = np.median(np.abs(values - median), axis=0) * 1.4826
+        inliers = np.all(np.abs(values - median) <= k * np.maximum(mad, 1e-6), axis=1)
+        return values[inliers].mean(axis=0) if np.any(inliers) else median
+
+    def clear(self):
+        """清空窗口"""
+        self.sums[:] = 0
+        self.start = 0
+        self.count = 0
+
+    def average(self, mode='mean'):
+        """按模式('mean', 'median', 'robust')计算平均坐标"""
+        if mode == 'median':
+            return self.median()
+        if mode == 'robust':
+            return self.robust_mean()
+        return self.mean()
+
+
 # 坐标历史记录
-COORDINATE_HISTORY = deque(maxlen=100)  # 存储最近100个坐标点（约1秒数据）
-COORD_LOCK = Lock()  # 坐标历史数据锁
-LAST_AVG_TIME = time.time()  # 上次计算平均值的时间
+COORD_HISTORY_CAPACITY = 100  # 每个会话最多保存的坐标点数（约1秒数据）
+COORD_WINDOW = 1.0  # 平均坐标的时间窗口(秒)
+COORD_EMIT_INTERVAL = 1.0  # 输出平均坐标的间隔(秒)
+COORD_AVERAGE_MODE = 'mean'  # 平均方式：'mean'、'median'或'robust'（剔除离群点）
 
 # 优先级锁定机制参数
 PRIORITY_LOCK_DURATION = 2.0  # 优先级锁定持续时间(秒)
-priority_lock = None  # 当前锁定的二维码ID
-priority_lock_time = 0  # 锁定开始时间
-PRIORITY_LOCK = Lock()  # 优先级锁数据锁
 
 # 放大搜索参数
 ZOOM_FACTOR = 1.5  # 放大系数
@@ -132,6 +230,13 @@ ZOOM_ENABLED = True  # 是否启用放大功能
 ZOOM_WINDOW_VISIBLE = False  # 放大窗口是否可见
 LOCAL_SEARCH_RADIUS = 200  # 在最近二维码附近搜索的范围(像素)
 
+# ROI跟踪参数
+TRACKING_ENABLED = True  # 锁定目标后是否只在预测ROI内检测
+TRACK_FULL_SCAN_INTERVAL = 10  # 跟踪模式下每隔K帧强制整帧扫描
+TRACK_ROI_PADDING = 0.5  # ROI相对目标尺寸的外扩比例
+TRACK_ROI_MIN_PADDING = 40  # ROI最小外扩像素
+TRACK_MIN_ROI_SIZE = 32  # ROI最小边长(像素)
+
 # 调试颜色定义
 DEBUG_COLORS = {
     'standard_qr': (0, 255, 0),  # 绿色 - 标准QR码
@@ -149,44 +254,162 @@ LAST_ZOOMED_FRAME_LOCK = Lock()
 MOTION_WINDOW_SIZE = 5  # 时域分析帧数
 MOTION_DEBLUR_ITER = 3  # 反卷积迭代次数
 MIN_MOTION_THRESH = 2.0  # 最小有效运动像素/帧
+MOTION_ESTIMATOR = 'phase'  # 运动估计方式：'phase'（金字塔相位相关）、'lk'（稀疏LK光流）或'farneback'（稠密光流）
+MOTION_PYRAMID_LEVELS = 2  # 相位相关前pyrDown的次数
+MOTION_LK_MAX_CORNERS = 50  # 稀疏LK跟踪的角点数
+MOTION_ORB_FEATURES = 100  # 小运动验证使用的ORB特征点数
+
+# 倾斜二维码候选参数
+TILTED_MIN_AREA = 1000  # 候选轮廓最小面积
+TILTED_MIN_SQUARENESS = 0.3  # 最小方正度（长宽比 x 填充率）
+TILTED_IOU_THRESHOLD = 0.6  # 候选去重的IoU阈值
+TILTED_MAX_CANDIDATES = 8  # 每帧最多校正解码的候选数
+TILTED_DECODE_WORKERS = 4  # 并行解码线程数
+
+# 检测策略调度参数
+QR_DETECT_TIME_BUDGET = 0.06  # 每帧二维码检测的时间预算(秒)
+STRATEGY_STATS_ALPHA = 0.2  # 策略耗时/成功率统计的滑动平均系数
+STRATEGY_INITIAL_COST = {  # 各策略的初始耗时估计(秒)，决定首次运行时的顺序
+    'standard_qr': 0.005,
+    'motion_blur_qr': 0.03,
+    'tilted_qr': 0.05,
+}
+
+
+
+class FrameCache:
+    """单帧预处理缓存（灰度/模糊/边缘图按需惰性计算，供所有检测器共享）"""
+
+    def __init__(self, frame):
+        # 所有检测器共享同一帧缓冲，通过只读视图访问以防止被意外修改（不改变调用者的数组）
+        self.frame = frame.view()
+        self.frame.flags.writeable = False
+        self._cache = {}
+        self._lock = Lock()
+        self._key_locks = {}
 
+    def get(self, key, compute):
+        """获取缓存项，不存在时调用compute计算（同一项只计算一次）"""
+        value = self._cache.get(key)
+        if value is not None:
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, Lock())
+        with key_lock:
+            value = self._cache.get(key)
+            if value is None:
+                value = compute()
+                self._cache[key] = value
+        return value
+
+    def gray(self):
+        """灰度图"""
+        return self.get('gray', lambda: self.frame if self.frame.ndim == 2
+                        else cv2.cvtColor(self.frame, cv2.COLOR_BGR2GRAY))
+
+    def blurred(self, ksize=GAUSSIAN_BLUR_SIZE):
+        """高斯模糊后的灰度图"""
+        return self.get(('blurred', ksize), lambda: cv2.GaussianBlur(self.gray(), ksize, 0))
+
+    def edges(self, low, high, ksize=None):
+        """Canny边缘图（ksize为None时直接在灰度图上计算）"""
+        source = self.gray if ksize is None else partial(self.blurred, ksize)
+        return self.get(('edges', low, high, ksize), lambda: cv2.Canny(source(), low, high))
+
+    def barcodes(self):
+        """整帧pyzbar解码结果（每帧只解码一次，供方形掩码和二维码检测共用）"""
+        return list(self.get('barcodes', lambda: pyzbar_decode(self.frame)))
 
 
 class MotionBlurProcessor:
     """运动模糊二维码处理核心类"""
 
-    def __init__(self):
+    ESTIMATORS = ('phase', 'lk', 'farneback')
+
+    def __init__(self, estimator=MOTION_ESTIMATOR):
         self.frame_buffer = deque(maxlen=MOTION_WINDOW_SIZE)
+        self.gray_buffer = deque(maxlen=MOTION_WINDOW_SIZE)
         self.motion_vectors = deque(maxlen=MOTION_WINDOW_SIZE - 1)
         self.lock = Lock()
+        self.set_estimator(estimator)
+
+        # 复用的特征检测/匹配对象，以及上一帧的ORB特征（下一次估计时作为前一帧直接使用）
+        self.orb = cv2.ORB_create(MOTION_ORB_FEATURES)
+        self.matcher = cv2.BFMatcher(cv2.NORM_HAMMING)
+        self.orb_cache = (None, None, None)  # (灰度图, 关键点, 描述子)
+        self.windows = {}  # 相位相关使用的汉宁窗，按尺寸缓存
+
+    def set_estimator(self, estimator):
+        """运行时切换运动估计方式"""
+        if estimator not in self.ESTIMATORS:
+            raise ValueError(f"未知的运动估计方式: {estimator}")
+        self.estimator = estimator
+
+    def estimate_motion(self, gray1, gray2):
+        """运动估计（输入为灰度图，返回gray1到gray2的平移(dx, dy)）"""
+        if self.estimator == 'lk':
+            motion = self._estimate_lk(gray1, gray2)
+        elif self.estimator == 'farneback':
+            flow = cv2.calcOpticalFlowFarneback(gray1, gray2, None, 0.5, 3, 15, 3, 5, 1.2, 0)
+            motion = np.median(flow.reshape(-1, 2), axis=0)
+        else:
+            motion = self._estimate_phase(gray1, gray2)
 
-    def estimate_motion(self, frame1, frame2):
-        """改进的运动估计（结合光流和特征匹配）"""
-        gray1 = cv2.cvtColor(frame1, cv2.COLOR_BGR2GRAY)
-        gray2 = cv2.cvtColor(frame2, cv2.COLOR_BGR2GRAY)
-
-        # 双策略运动估计
-        flow = cv2.calcOpticalFlowFarneback(gray1, gray2, None, 0.5, 3, 15, 3, 5, 1.2, 0)
-        median_flow = np.median(flow.reshape(-1, 2), axis=0)
-
-        if np.linalg.norm(median_flow) < MIN_MOTION_THRESH:
+        if np.linalg.norm(motion) < MIN_MOTION_THRESH:
             # 小运动时使用特征点匹配验证
-            orb = cv2.ORB_create(100)
-            kp1, des1 = orb.detectAndCompute(gray1, None)
-            kp2, des2 = orb.detectAndCompute(gray2, None)
-
-            if des1 is not None and des2 is not None:
-                bf = cv2.BFMatcher(cv2.NORM_HAMMING)
-                matches = bf.knnMatch(des1, des2, k=2)
-                good = [m for m, n in matches if m.distance < 0.75 * n.distance]
+            feature_flow = self._estimate_orb(gray1, gray2)
+            if feature_flow is not None:
+                return feature_flow
+
+        return motion
+
+    def _estimate_phase(self, gray1, gray2):
+        """在缩小的金字塔层上做相位相关"""
+        small1, small2 = gray1, gray2
+        for _ in range(MOTION_PYRAMID_LEVELS):
+            small1, small2 = cv2.pyrDown(small1), cv2.pyrDown(small2)
+
+        size = small1.shape[::-1]
+        window = self.windows.get(size)
+        if window is None:
+            window = self.windows[size] = cv2.createHanningWindow(size, cv2.CV_32F)
+
+        (dx, dy), _ = cv2.phaseCorrelate(np.float32(small1), np.float32(small2), window)
+        return np.float32([dx, dy]) * (1 << MOTION_PYRAMID_LEVELS)
+
+    def _estimate_lk(self, gray1, gray2):
+        """跟踪少量角点的稀疏LK光流，角点不足时回退到相位相关"""
+        corners = cv2.goodFeaturesToTrack(gray1, MOTION_LK_MAX_CORNERS, 0.01, 10)
+        if corners is not None:
+            tracked, status, _ = cv2.calcOpticalFlowPyrLK(gray1, gray2, corners, None)
+            good = status.reshape(-1) == 1
+            if np.count_nonzero(good) >= 5:
+                return np.median((tracked - corners).reshape(-1, 2)[good], axis=0)
+        return self._estimate_phase(gray1, gray2)
+
+    def _orb_features(self, gray):
+        cached_gray, keypoints, descriptors = self.orb_cache
+        if cached_gray is not gray:
+            keypoints, descriptors = self.orb.detectAndCompute(gray, None)
+            self.orb_cache = (gray, keypoints, descriptors)
+        return keypoints, descriptors
+
+    def _estimate_orb(self, gray1, gray2):
+        """ORB特征匹配估计平移，匹配不足时返回None"""
+        kp1, des1 = self._orb_features(gray1)
+        kp2, des2 = self._orb_features(gray2)
+        if des1 is None or des2 is None or len(des1) < 2 or len(des2) < 2:
+            return None
 
-                if len(good) > 10:
-                    src_pts = np.float32([kp1[m.queryIdx].pt for m in good])
-                    dst_pts = np.float32([kp2[m.trainIdx].pt for m in good])
-                    feature_flow = np.median(dst_pts - src_pts, axis=0)
-                    return feature_flow
+        matches = self.matcher.knnMatch(des1, des2, k=2)
+        good = [pair[0] for pair in matches if len(pair) == 2 and pair[0].distance < 0.75 * pair[1].distance]
+        if len(good) <= 10:
+            return None
 
-        return median_flow
+        src_pts = np.float32([kp1[m.queryIdx].pt for m in good])
+        dst_pts = np.float32([kp2[m.trainIdx].pt for m in good])
+        return np.median(dst_pts - src_pts, axis=0)
 
     def temporal_integration(self, frames, motions):
         """时域多帧融合（确保输出为三通道图像）"""
@@ -234,25 +457,35 @@ class MotionBlurProcessor:
                  1, thickness=1)
         kernel /= kernel.sum()
 
-        # Richardson-Lucy反卷积
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        # Richardson-Lucy反卷积（浮点运算，输出8位灰度图供解码使用）
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY).astype(np.float32)
         result = gray.copy()
         for _ in range(MOTION_DEBLUR_ITER):
             conv = cv2.filter2D(result, -1, kernel)
-            ratio = cv2.divide(gray, conv + 1e-6, dtype=cv2.CV_32F)
+            ratio = cv2.divide(gray, conv + 1e-6)
             result *= cv2.filter2D(ratio, -1, kernel[::-1, ::-1])
 
-        return cv2.normalize(result, None, 0, 255, cv2.NORM_MINMAX)
+        return cv2.normalize(result, None, 0, 255, cv2.NORM_MINMAX, dtype=cv2.CV_8U)
+
+    def process_frame(self, frame, gray=None):
+        """处理单帧并更新缓冲区（可传入已计算的灰度图）"""
+        if gray is None:
+            gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
 
-    def process_frame(self, frame):
-        """处理单帧并更新缓冲区"""
         with self.lock:
-            if len(self.frame_buffer) >= 1:
-                prev_frame = self.frame_buffer[-1]
-                motion = self.estimate_motion(prev_frame, frame)
+            # 帧尺寸变化（如ROI与整帧交替）时旧帧无法对齐，清空历史
+            if self.gray_buffer and self.gray_buffer[-1].shape != gray.shape:
+                self.frame_buffer.clear()
+                self.gray_buffer.clear()
+                self.motion_vectors.clear()
+
+            if len(self.gray_buffer) >= 1:
+                motion = self.estimate_motion(self.gray_buffer[-1], gray)
                 self.motion_vectors.append(motion)
 
-            self.frame_buffer.append(frame)
+            # 帧可能是采集环形缓冲区的槽位，随后会被覆盖，需保留副本
+            self.frame_buffer.append(frame.copy())
+            self.gray_buffer.append(gray)
 
             # 当缓冲足够时进行处理
             if len(self.frame_buffer) >= MOTION_WINDOW_SIZE:
@@ -264,49 +497,149 @@ class MotionBlurProcessor:
                 return deblurred
         return None
 
+    def reset(self):
+        """清空帧缓冲区和运动向量"""
+        with self.lock:
+            self.frame_buffer.clear()
+            self.gray_buffer.clear()
+            self.motion_vectors.clear()
+
+
+def select_tilted_candidates(contours, hierarchy, max_candidates=TILTED_MAX_CANDIDATES):
+    """筛选倾斜二维码候选：按层级和IoU去重，按方正度排序后取前K个，返回minAreaRect列表"""
+    areas = np.array([cv2.contourArea(cnt) for cnt in contours])
+    bounding = np.array([cv2.boundingRect(cnt) for cnt in contours], dtype=np.float64).reshape(-1, 4)
+
+    def iou(i, others):
+        x1 = np.maximum(bounding[i, 0], bounding[others, 0])
+        y1 = np.maximum(bounding[i, 1], bounding[others, 1])
+        x2 = np.minimum(bounding[i, 0] + bounding[i, 2], bounding[others, 0] + bounding[others, 2])
+        y2 = np.minimum(bounding[i, 1] + bounding[i, 3], bounding[others, 1] + bounding[others, 3])
+        inter = np.clip(x2 - x1, 0, None) * np.clip(y2 - y1, 0, None)
+        union = bounding[i, 2] * bounding[i, 3] + bounding[others, 2] * bounding[others, 3] - inter
+        return inter / np.maximum(union, 1e-10)
+
+    candidates = []
+    for i in np.flatnonzero(areas >= TILTED_MIN_AREA):
+        # 同一条边缘的内外两条轮廓互为父子，只保留外侧一条
+        parent = hierarchy[i][3]
+        if parent >= 0 and areas[parent] >= TILTED_MIN_AREA and iou(i, np.array([parent]))[0] > TILTED_IOU_THRESHOLD:
+            continue
+
+        rect = cv2.minAreaRect(contours[i])
+        width, height = rect[1]
+        if width < 1 or height < 1:
+            continue
+        squareness = min(width, height) / max(width, height) * min(1.0, areas[i] / (width * height))
+        if squareness >= TILTED_MIN_SQUARENESS:
+            candidates.append((squareness, i, rect))
+
+    # 按方正度从高到低做非极大值抑制
+    candidates.sort(key=lambda c: c[0], reverse=True)
+    selected, selected_idx = [], []
+    for _, i, rect in candidates:
+        if selected_idx and np.any(iou(i, np.array(selected_idx)) > TILTED_IOU_THRESHOLD):
+            continue
+        selected.append(rect)
+        selected_idx.append(i)
+        if len(selected) >= max_candidates:
+            break
+    return selected
+
+
+class StrategyStats:
+    """检测策略的耗时与成功率统计（指数滑动平均）"""
+
+    def __init__(self, initial_cost, alpha=STRATEGY_STATS_ALPHA):
+        self.alpha = alpha
+        self.cost = initial_cost
+        self.success_rate = 0.5
+        self.runs = 0
+
+    def record(self, elapsed, success):
+        """记录一次运行的耗时和是否成功"""
+        if self.runs == 0:
+            self.cost = elapsed
+        else:
+            self.cost += self.alpha * (elapsed - self.cost)
+        self.success_rate += self.alpha * (float(success) - self.success_rate)
+        self.runs += 1
+
+    def decay(self):
+        """策略被跳过时降低其耗时估计，使其之后有机会被重新测量"""
+        self.cost *= 1 - self.alpha
+
+    def score(self):
+        """单位耗时的成功率，越高越优先"""
+        return self.success_rate / max(self.cost, 1e-4)
+
 
 class QRDetector:
-    """增强版二维码检测器（集成运动模糊处理）"""
+    """增强版二维码检测器（集成运动模糊处理，应在整个摄像头运行期间复用以保留帧历史）"""
 
-    def __init__(self):
+    def __init__(self, time_budget=QR_DETECT_TIME_BUDGET):
         self.motion_processor = MotionBlurProcessor()
         self.executor = ThreadPoolExecutor(max_workers=4)
+        self.decode_executor = ThreadPoolExecutor(max_workers=TILTED_DECODE_WORKERS)
         self.last_valid = None
 
-    def detect_standard_qr(self, frame):
-        """标准二维码检测"""
+        # 策略调度
+        self.time_budget = time_budget
+        self.strategies = {
+            'standard_qr': self.detect_standard_qr,
+            'motion_blur_qr': self.detect_motion_blur_qr,
+            'tilted_qr': self.detect_tilted_qr,
+        }
+        self.stats = {name: StrategyStats(STRATEGY_INITIAL_COST[name]) for name in self.strategies}
+        self.last_tier = None  # 上一帧命中的策略
+        self.last_skipped = []  # 上一帧因预算不足跳过的策略
+
+    def detect_standard_qr(self, frame, cache=None):
+        """标准二维码检测（传入cache时复用该帧的整帧解码结果）"""
+        if cache is not None:
+            return cache.barcodes()
         return pyzbar_decode(frame)
 
-    def detect_tilted_qr(self, frame):
-        """倾斜二维码检测"""
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        edges = cv2.Canny(gray, 50, 150)
-        contours, _ = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
-        results = []
-
-        for cnt in contours:
-            if cv2.contourArea(cnt) < 1000:
-                continue
-
-            rect = cv2.minAreaRect(cnt)
-            box = cv2.boxPoints(rect)
-            box = np.int32(box)
-
-            # 透视变换校正
+    def detect_tilted_qr(self, frame, cache=None):
+        """倾斜二维码检测（候选去重、按方正度排序取前K个，透视校正后并行解码）"""
+        if cache is None:
+            cache = FrameCache(frame)
+        edges = cache.edges(50, 150)
+        contours, hierarchy = cv2.findContours(edges, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        if not contours:
+            return []
+
+        candidates = select_tilted_candidates(contours, hierarchy[0])
+        if not candidates:
+            return []
+
+        # 透视变换校正
+        patches = []
+        for rect in candidates:
             width, height = int(rect[1][0]), int(rect[1][1])
+            box = cv2.boxPoints(rect).astype(np.float32)
             dst = np.array([[0, 0], [width - 1, 0], [width - 1, height - 1], [0, height - 1]], dtype="float32")
-            M = cv2.getPerspectiveTransform(box.astype(np.float32), dst)
-            warped = cv2.warpPerspective(frame, M, (width, height))
+            M = cv2.getPerspectiveTransform(box, dst)
+            patches.append((M, cv2.warpPerspective(frame, M, (width, height))))
+
+        # 并行解码所有校正后的图块
+        decoded_patches = self.decode_executor.map(pyzbar_decode, [patch for _, patch in patches])
 
-            decoded = pyzbar_decode(warped)
+        results = []
+        for (M, _), decoded in zip(patches, decoded_patches):
             for d in decoded:
-                d.rect = box  # 保存原始位置
-                results.append(d)
+                # 将二维码顶点映射回原始图像坐标
+                points = np.float32([[p.x, p.y] for p in d.polygon]).reshape(-1, 1, 2)
+                points = cv2.perspectiveTransform(points, np.linalg.inv(M)).reshape(-1, 2)
+                results.append(d._replace(
+                    rect=Rect(*cv2.boundingRect(points)),
+                    polygon=[Point(int(x), int(y)) for x, y in points]))
         return results
 
-    def detect_motion_blur_qr(self, frame):
+    def detect_motion_blur_qr(self, frame, cache=None):
         """运动模糊二维码检测"""
-        processed = self.motion_processor.process_frame(frame)
+        gray = cache.gray() if cache is not None else None
+        processed = self.motion_processor.process_frame(frame, gray)
         if processed is not None:
             # 并行尝试多种解码方式
             futures = [
@@ -324,20 +657,715 @@ class QRDetector:
             return results
         return []
 
-    def multi_strategy_detect(self, frame):
+    def multi_strategy_detect(self, frame, cache=None):
         """多策略联合检测"""
-        # 第一级：快速标准检测
-        standard_results = self.detect_standard_qr(frame)
-        if standard_results:
-            return standard_results
+        results, _ = self.scheduled_detect(frame, cache)
+        return results
+
+    def scheduled_detect(self, frame, cache=None, time_budget=None):
+        """按时间预算调度的多策略检测，返回(结果, 命中的策略名)
+
+        策略按最近的成功率/耗时排序，预计会超出预算的策略将被跳过（至少运行一个策略）。
+        """
+        if cache is None:
+            cache = FrameCache(frame)
+        if time_budget is None:
+            time_budget = self.time_budget
+
+        order = sorted(self.strategies, key=lambda name: self.stats[name].score(), reverse=True)
+        start = time.perf_counter()
+        self.last_tier = None
+        self.last_skipped = []
+
+        for i, name in enumerate(order):
+            stats = self.stats[name]
+            elapsed = time.perf_counter() - start
+            if i > 0 and elapsed + stats.cost > time_budget:
+                self.last_skipped.append(name)
+                stats.decay()
+                continue
+
+            strategy_start = time.perf_counter()
+            results = self.strategies[name](frame, cache)
+            stats.record(time.perf_counter() - strategy_start, bool(results))
+
+            if results:
+                self.last_tier = name
+                return results, name
+
+        return [], None
+
+    def reset(self):
+        """重置检测会话（清空运动模糊帧历史）"""
+        self.motion_processor.reset()
+        self.last_valid = None
+
+    def shutdown(self):
+        """关闭检测器内部线程池"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.decode_executor.shutdown(wait=False, cancel_futures=True)
+
+
+class QRTracker:
+    """二维码ROI跟踪（锁定目标后只在预测位置附近解码，定期或丢失时回退到整帧扫描）"""
+
+    def __init__(self, full_scan_interval=TRACK_FULL_SCAN_INTERVAL):
+        self.full_scan_interval = full_scan_interval
+        self.points = None  # 目标（二维码及其所在方形）的顶点
+        self.last_time = 0
+        self.frames_since_full_scan = 0
+        self.history = deque(maxlen=HISTORY_LENGTH)  # 最近几帧目标中心的像素坐标：(时间, 中心)
+
+    def predict(self, current_time):
+        """根据像素空间中目标中心的移动速度预测目标顶点的当前位置"""
+        if len(self.history) < 2:
+            return self.points
+
+        (t0, c0), (t1, c1) = self.history[0], self.history[-1]
+        if t1 <= t0:
+            return self.points
+        velocity = (c1 - c0) / (t1 - t0)
+        return self.points + velocity * (current_time - self.last_time)
+
+    def roi(self, frame_shape, current_time):
+        """返回本帧的检测ROI (x1, y1, x2, y2)，返回None表示需要整帧扫描"""
+        if self.points is None or self.frames_since_full_scan >= self.full_scan_interval:
+            self.frames_since_full_scan = 0
+            return None
+        self.frames_since_full_scan += 1
+
+        predicted = self.predict(current_time)
+        (x1, y1), (x2, y2) = predicted.min(axis=0), predicted.max(axis=0)
+        padding = max(TRACK_ROI_MIN_PADDING, TRACK_ROI_PADDING * max(x2 - x1, y2 - y1))
+
+        height, width = frame_shape[:2]
+        x1, y1 = max(0, int(x1 - padding)), max(0, int(y1 - padding))
+        x2, y2 = min(width, int(x2 + padding)), min(height, int(y2 + padding))
+        if x2 - x1 < TRACK_MIN_ROI_SIZE or y2 - y1 < TRACK_MIN_ROI_SIZE:
+            self.lost()
+            return None
+        return x1, y1, x2, y2
+
+    def update(self, points, current_time, anchor=None):
+        """记录本帧锁定目标的位置，anchor为估计速度用的参考顶点（默认为全部顶点）"""
+        self.points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+        self.last_time = current_time
+        anchor = self.points if anchor is None else np.asarray(anchor, dtype=np.float32).reshape(-1, 2)
+        self.history.append((current_time, anchor.mean(axis=0)))
+
+    def lost(self):
+        """目标丢失，下一帧回退到整帧扫描"""
+        self.points = None
+        self.frames_since_full_scan = 0
+        self.history.clear()
+
+
+class FrameProcessor:
+    """长期存在的帧处理引擎（线程池只创建一次，所有检测器共享同一只读帧）"""
+
+    def __init__(self, max_workers=MAX_WORKERS):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # 二维码检测会话，保留运动模糊帧历史
+        self.qr_detector = QRDetector()
+        self.detectors = {
+            'squares': find_squares_optimized,
+            'qr': partial(detect_and_decode_qrcode, detector=self.qr_detector),
+            'tilted_qr': detect_tilted_qrcode,
+        }
+
+    def submit(self, cache):
+        """提交一帧（及其预处理缓存）进行并行检测，返回各检测器对应的future"""
+        return {name: self.executor.submit(detector, cache.frame, cache=cache)
+                for name, detector in self.detectors.items()}
+
+    def submit_roi(self, cache, roi, lut=None):
+        """只在ROI内提交检测（跟踪模式），结果坐标已换算到整帧；lut为亮度补偿查找表"""
+        x1, y1, x2, y2 = roi
+        roi_frame = cache.frame[y1:y2, x1:x2]
+        roi_cache = FrameCache(roi_frame if lut is None else cv2.LUT(roi_frame, lut))
+        return {
+            'squares': self.executor.submit(find_squares_in_roi, roi_cache, (x1, y1)),
+            'qr': self.executor.submit(decode_qrcode_in_roi, roi_cache, (x1, y1), self.qr_detector),
+        }
+
+    @staticmethod
+    def collect(futures, timeout=1.0):
+        """等待并收集各检测器的结果
+
+        超时或出错时先取消尚未开始的任务、等待正在运行的任务结束再抛出异常：
+        帧可能是采集环形缓冲区的槽位，检测器仍在读取时不能进入下一帧（也避免有状态的检测会话被并发调用）。
+        """
+        try:
+            return {name: future.result(timeout=timeout) for name, future in futures.items()}
+        except BaseException:
+            for future in futures.values():
+                future.cancel()
+            wait(futures.values())
+            raise
+
+    def shutdown(self):
+        """关闭线程池"""
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.qr_detector.shutdown()
+
+
+# 进程后端工作进程内的状态（已映射的共享内存段及其所属的帧槽代数、二维码检测会话）
+_WORKER_SEGMENTS = {}
+_WORKER_GENERATION = None
+_WORKER_QR_DETECTOR = None
+
+
+def _attach_shared_memory(name, generation):
+    """在工作进程中映射共享内存段（段的生命周期由主进程负责）
+
+    主进程重建帧槽时代数加一，工作进程随之关闭旧段的映射，使已unlink的段能被释放。
+    """
+    global _WORKER_GENERATION
+
+    if generation != _WORKER_GENERATION:
+        for segment in _WORKER_SEGMENTS.values():
+            try:
+                segment.close()
+            except BufferError:  # 仍有数组引用该段，交由垃圾回收释放
+                pass
+        _WORKER_SEGMENTS.clear()
+        _WORKER_GENERATION = generation
+
+    segment = _WORKER_SEGMENTS.get(name)
+    if segment is None:
+        try:
+            segment = shared_memory.SharedMemory(name=name, track=False)
+        except TypeError:  # Python < 3.13：工作进程与主进程共用同一个resource_tracker，重复登记无影响
+            segment = shared_memory.SharedMemory(name=name)
+        _WORKER_SEGMENTS[name] = segment
+    return segment
+
+
+def _process_detect(detector, name, generation, shape, dtype, offset=None, lut=None):
+    """工作进程入口：从共享内存取帧并运行指定检测器
+
+    offset不为None时共享内存中只有ROI图像，offset为ROI左上角在整帧中的坐标。
+    """
+    global _WORKER_QR_DETECTOR
+
+    frame = np.ndarray(shape, dtype=dtype, buffer=_attach_shared_memory(name, generation).buf)
+    if detector == 'qr' and _WORKER_QR_DETECTOR is None:
+        _WORKER_QR_DETECTOR = QRDetector()
+
+    if offset is not None:
+        cache = FrameCache(frame if lut is None else cv2.LUT(frame, lut))
+        if detector == 'squares':
+            return find_squares_in_roi(cache, offset)
+        return decode_qrcode_in_roi(cache, offset, _WORKER_QR_DETECTOR)
+
+    cache = FrameCache(frame)
+    if detector == 'squares':
+        return find_squares_optimized(frame, cache=cache)
+    if detector == 'qr':
+        return detect_and_decode_qrcode(frame, detector=_WORKER_QR_DETECTOR, cache=cache)
+    return detect_tilted_qrcode(frame, cache=cache)
+
+
+class ProcessFrameProcessor:
+    """进程池帧处理引擎（接口同FrameProcessor）
+
+    方形检测和二维码检测中大量纯Python代码会受GIL限制，进程后端让它们真正在不同核心上运行。
+    帧只复制一次到共享内存帧槽中，工作进程直接映射读取，不经过pickle；
+    一帧的所有检测完成后帧槽才会被复用。
+    二维码检测固定交给单独的一个工作进程，运动模糊帧历史和策略统计才能看到连续的帧。
+    """
 
-        # 第二级：运动模糊处理
-        motion_results = self.detect_motion_blur_qr(frame)
-        if motion_results:
-            return motion_results
+    def __init__(self, max_workers=MAX_WORKERS, slots=SHARED_FRAME_SLOTS):
+        self.executor = ProcessPoolExecutor(max_workers=max(1, max_workers - 1))
+        self.qr_executor = ProcessPoolExecutor(max_workers=1)  # 有状态的二维码检测会话
+        if os.name == 'posix':
+            # 先启动resource_tracker再在创建帧槽之前启动工作进程：
+            # 工作进程与主进程共用同一个resource_tracker，且fork时不会继承帧槽的映射
+            resource_tracker.ensure_running()
+            for executor in (self.executor, self.qr_executor):
+                executor.submit(int).result()
+        self.detectors = ('squares', 'qr', 'tilted_qr')
+        self.slot_count = slots
+        self.segments = []  # 共享内存帧槽
+        self.generation = 0  # 帧槽代数，重建帧槽时加一
+        self.free = deque()
+        self.pending = {}  # 帧槽 -> 尚未完成的任务数
+        self.cond = Condition()
+
+    def _acquire_slot(self, frame):
+        """取得一个空闲帧槽并把帧复制进去"""
+        with self.cond:
+            if self.segments and self.segments[0].size < frame.nbytes:
+                # 帧尺寸变大，等待所有帧槽空闲后重建
+                while self.pending:
+                    self.cond.wait()
+                self._release_segments()
+            if not self.segments:
+                self.segments = [shared_memory.SharedMemory(create=True, size=frame.nbytes)
+                                 for _ in range(self.slot_count)]
+                self.free = deque(range(self.slot_count))
+            while not self.free:
+                self.cond.wait()
+            slot = self.free.popleft()
+
+        np.copyto(np.ndarray(frame.shape, dtype=frame.dtype, buffer=self.segments[slot].buf), frame)
+        return slot
+
+    def _submit(self, slot, frame, tasks, lut=None):
+        segment = self.segments[slot]
+        with self.cond:
+            self.pending[slot] = len(tasks)
+        futures = {}
+        for name, offset in tasks:
+            executor = self.qr_executor if name == 'qr' else self.executor
+            future = executor.submit(_process_detect, name, segment.name, self.generation,
+                                     frame.shape, frame.dtype.str, offset, lut)
+            future.add_done_callback(lambda _, slot=slot: self._task_done(slot))
+            futures[name] = future
+        return futures
+
+    def _task_done(self, slot):
+        with self.cond:
+            if slot not in self.pending:  # 关闭时已清理
+                return
+            self.pending[slot] -= 1
+            if self.pending[slot] == 0:
+                del self.pending[slot]
+                self.free.append(slot)
+                self.cond.notify_all()
+
+    def submit(self, cache):
+        """提交一帧进行并行检测，返回各检测器对应的future"""
+        slot = self._acquire_slot(cache.frame)
+        return self._submit(slot, cache.frame, [(name, None) for name in self.detectors])
+
+    def submit_roi(self, cache, roi, lut=None):
+        """只在ROI内提交检测（跟踪模式），结果坐标已换算到整帧；lut为亮度补偿查找表"""
+        x1, y1, x2, y2 = roi
+        roi_frame = cache.frame[y1:y2, x1:x2]
+        slot = self._acquire_slot(roi_frame)  # 只复制ROI
+        return self._submit(slot, roi_frame, [('squares', (x1, y1)), ('qr', (x1, y1))], lut)
+
+    collect = staticmethod(FrameProcessor.collect)
+
+    def _release_segments(self):
+        for segment in self.segments:
+            segment.close()
+            segment.unlink()
+        self.segments = []
+        self.free.clear()
+        self.generation += 1
+
+    def shutdown(self):
+        """关闭进程池并释放共享内存"""
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        self.qr_executor.shutdown(wait=True, cancel_futures=True)
+        with self.cond:
+            self.pending.clear()
+            self._release_segments()
+
+
+class FrameSource(ABC):
+    """帧源基类（接口与cv2.VideoCapture兼容，并为每帧提供时间戳）"""
+
+    live = False  # 是否为实时采集设备
+    buffered = False  # 是否已由后台线程缓冲（是则主循环无需预取下一帧）
 
-        # 第三级：倾斜检测
-        return self.detect_tilted_qr(frame)
+    def __init__(self):
+        self.timestamp = None  # 最近一帧的时间戳(秒)
+
+    def isOpened(self):
+        return True
+
+    def read(self):
+        ret, frame, _ = self.read_timestamped()
+        return ret, frame
+
+    @abstractmethod
+    def read_timestamped(self):
+        """读取一帧，返回(ret, frame, timestamp)"""
+        pass
+
+    def get(self, prop):
+        return 0
+
+    def set(self, prop, value):
+        """设置采集属性（曝光、增益等），不支持时返回False"""
+        return False
+
+    def release(self):
+        pass
+
+
+class CameraSource(FrameSource):
+    """摄像头帧源（时间戳取采集时的系统时间）"""
+
+    live = True
+
+    def __init__(self, camera_id):
+        super().__init__()
+        self.cap = cv2.VideoCapture(camera_id)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read_timestamped(self):
+        ret, frame = self.cap.read()
+        self.timestamp = time.time()
+        return ret, frame, self.timestamp
+
+    def get(self, prop):
+        return self.cap.get(prop)
+
+    def set(self, prop, value):
+        return self.cap.set(prop, value)
+
+    def grab(self):
+        return self.cap.grab()
+
+    def retrieve(self, out=None):
+        """解码已抓取的帧，尽量直接写入out"""
+        return self.cap.retrieve(out)
+
+    def release(self):
+        self.cap.release()
+
+
+class ThreadedCapture(FrameSource):
+    """后台采集线程 + 预分配的环形帧缓冲区
+
+    采集线程持续从摄像头取帧并直接解码到环形缓冲区中，避免帧在驱动中排队造成延迟。
+    每帧附带曝光时间戳（grab返回时刻，作为帧的时间戳）和采集时间戳（解码完成时刻）。
+    读取到的帧在下一次读取前保持有效，之后其缓冲区会被采集线程复用。
+    """
+
+    live = True
+    buffered = True
+
+    def __init__(self, source, policy=CAPTURE_POLICY, ring_size=CAPTURE_RING_SIZE):
+        super().__init__()
+        if policy not in ('latest', 'drop_oldest'):
+            raise ValueError(f"未知的丢帧策略: {policy}")
+        self.source = source
+        self.policy = policy
+        self.buffers = [None] * max(ring_size, 3)
+        self.free = deque(range(len(self.buffers)))  # 可写入的缓冲区
+        self.ready = deque()  # 已写入、未读取的帧：(缓冲区序号, 曝光时间戳, 采集时间戳, 帧序号)
+        self.held = None  # 当前由读取方持有的缓冲区
+        self.cond = Condition()
+        self.running = False
+        self.sequence = 0
+        self.dropped = 0  # 未被读取就被丢弃的帧数
+        self.capture_timestamp = None
+        self.pending_props = {}  # 待采集线程设置的属性：属性 -> (值, 请求序号)
+        self.prop_results = {}  # 采集线程的设置结果：属性 -> (请求序号, 是否成功)
+        self.prop_sequence = 0
+        self.unsupported_props = set()  # 设置失败的属性
+        self.closed = False  # 已调用release
+        self.source_released = False
+        self.thread = None
+        if self.source.isOpened():
+            self.running = True
+            self.thread = Thread(target=self._capture_loop, daemon=True)
+            self.thread.start()
+
+    def isOpened(self):
+        return self.source.isOpened()
+
+    def get(self, prop):
+        with self.cond:
+            if prop in self.pending_props:
+                return self.pending_props[prop][0]
+        return self.source.get(prop)
+
+    def set(self, prop, value, timeout=CAPTURE_SET_TIMEOUT):
+        """属性设置交给采集线程在两次取帧之间执行，等待其结果；已知不支持或超时未执行时返回False"""
+        with self.cond:
+            if prop in self.unsupported_props or not self.running:
+                return False
+            self.prop_sequence += 1
+            sequence = self.prop_sequence
+            self.pending_props[prop] = (value, sequence)
+            done = self.cond.wait_for(lambda: self.prop_results.get(prop, (0,))[0] >= sequence
+                                      or not self.running, timeout)
+            result = self.prop_results.get(prop)
+            return bool(done) and result is not None and result[0] >= sequence and result[1]
+
+    def _capture_loop(self):
+        try:
+            self._capture_frames()
+        finally:
+            # release()等待超时（采集线程阻塞在grab中）时由采集线程退出后释放摄像头
+            if self.closed:
+                self._release_source()
+
+    def _capture_frames(self):
+        failures = 0
+        while self.running:
+            with self.cond:
+                props, self.pending_props = self.pending_props, {}
+                if self.free:
+                    slot = self.free.popleft()
+                else:
+                    slot = self.ready.popleft()[0]
+                    self.dropped += 1
+
+            if props:
+                results = {prop: (sequence, self.source.set(prop, value))
+                           for prop, (value, sequence) in props.items()}
+                with self.cond:
+                    self.prop_results.update(results)
+                    self.unsupported_props.update(prop for prop, (_, ok) in results.items() if not ok)
+                    self.cond.notify_all()
+
+            buffer = self.buffers[slot]
+            ok = self.source.grab()
+            exposure_time = time.time()
+            if ok:
+                ok, frame = self.source.retrieve(buffer)
+            capture_time = time.time()
+
+            with self.cond:
+                if not ok:
+                    self.free.append(slot)
+                    failures += 1
+                    if failures >= CAPTURE_MAX_FAILURES:
+                        self.running = False
+                        self.cond.notify_all()
+                    continue
+                failures = 0
+                self.buffers[slot] = frame
+                if self.policy == 'latest':
+                    while self.ready:
+                        self.free.append(self.ready.popleft()[0])
+                        self.dropped += 1
+                self.ready.append((slot, exposure_time, capture_time, self.sequence))
+                self.sequence += 1
+                self.cond.notify_all()
+
+    def read_timestamped(self):
+        with self.cond:
+            while not self.ready and self.running:
+                self.cond.wait()
+            if not self.ready:
+                return False, None, self.timestamp
+
+            # 归还上一帧的缓冲区
+            if self.held is not None:
+                self.free.append(self.held)
+            self.held, self.timestamp, self.capture_timestamp, _ = self.ready.popleft()
+            return True, self.buffers[self.held], self.timestamp
+
+    def _release_source(self):
+        with self.cond:
+            if self.source_released:
+                return
+            self.source_released = True
+        self.source.release()
+
+    def release(self):
+        with self.cond:
+            self.running = False
+            self.closed = True
+            self.cond.notify_all()
+        if self.thread is not None:
+            self.thread.join(timeout=1.0)
+        # 采集线程仍在grab中时不能释放摄像头，交由采集线程退出时释放
+        if self.thread is None or not self.thread.is_alive():
+            self._release_source()
+
+
+class ReplaySource(FrameSource):
+    """离线回放帧源（时间戳为 帧序号/帧率，与运行速度无关；realtime为True时按原帧率回放，否则全速回放）"""
+
+    def __init__(self, fps=REPLAY_DEFAULT_FPS, realtime=True):
+        super().__init__()
+        self.fps = fps if fps and fps > 0 else REPLAY_DEFAULT_FPS
+        self.realtime = realtime
+        self.index = 0
+        self.wall_start = None
+
+    @abstractmethod
+    def next_frame(self):
+        """返回下一帧，没有更多帧时返回None"""
+        pass
+
+    def read_timestamped(self):
+        frame = self.next_frame()
+        if frame is None:
+            return False, None, self.timestamp
+
+        self.timestamp = self.index / self.fps
+        self.index += 1
+
+        if self.realtime:
+            if self.wall_start is None:
+                self.wall_start = time.perf_counter()
+            delay = self.wall_start + self.timestamp - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+
+        return True, frame, self.timestamp
+
+
+class VideoFileSource(ReplaySource):
+    """视频文件回放"""
+
+    def __init__(self, path, realtime=True, fps=None):
+        self.cap = cv2.VideoCapture(path)
+        super().__init__(fps or self.cap.get(cv2.CAP_PROP_FPS), realtime)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def next_frame(self):
+        ret, frame = self.cap.read()
+        return frame if ret else None
+
+    def release(self):
+        self.cap.release()
+
+
+class ImageSequenceSource(ReplaySource):
+    """图像序列目录回放（按文件名排序的PNG图像或单帧.npy文件）"""
+
+    def __init__(self, directory, realtime=True, fps=REPLAY_DEFAULT_FPS):
+        super().__init__(fps, realtime)
+        self.paths = sorted(os.path.join(directory, name) for name in os.listdir(directory)
+                            if name.lower().endswith(REPLAY_FRAME_EXTENSIONS))
+
+    def isOpened(self):
+        return bool(self.paths)
+
+    def next_frame(self):
+        while self.index < len(self.paths):
+            path = self.paths[self.index]
+            frame = np.load(path) if path.lower().endswith('.npy') else cv2.imread(path, cv2.IMREAD_COLOR)
+            if frame is not None:
+                return frame
+            # 无法读取的文件直接跳过（保持时间戳连续）
+            del self.paths[self.index]
+        return None
+
+
+class NpyFrameSource(ReplaySource):
+    """.npy帧转储回放（形状为(N, H, W[, C])的数组，以内存映射方式读取）"""
+
+    def __init__(self, path, realtime=True, fps=REPLAY_DEFAULT_FPS):
+        super().__init__(fps, realtime)
+        self.frames = np.load(path, mmap_mode='r')
+
+    def isOpened(self):
+        return self.frames.ndim in (3, 4) and len(self.frames) > 0
+
+    def next_frame(self):
+        if self.index >= len(self.frames):
+            return None
+        return np.ascontiguousarray(self.frames[self.index])
+
+
+def open_frame_source(source, realtime=True):
+    """根据参数创建帧源：摄像头编号、视频文件、图像序列目录、.npy文件或已有的FrameSource"""
+    if isinstance(source, FrameSource):
+        return source
+    if isinstance(source, int) or (isinstance(source, str) and source.isdigit()):
+        camera = CameraSource(int(source))
+        return ThreadedCapture(camera) if CAPTURE_THREADED else camera
+    if os.path.isdir(source):
+        return ImageSequenceSource(source, realtime)
+    if source.lower().endswith('.npy'):
+        return NpyFrameSource(source, realtime)
+    return VideoFileSource(source, realtime)
+
+
+class OverlayCompositor:
+    """在显示分辨率下合成叠加层（先缩小帧再绘制，按显示尺寸缓存预乘透明度的网格层）"""
+
+    def __init__(self):
+        self.grid_cache = {}  # (帧宽, 帧高, 显示宽, 显示高) -> 已乘以GRID_ALPHA的网格层
+
+    def grid(self, frame_width, frame_height, display_size):
+        key = (frame_width, frame_height) + tuple(display_size)
+        if key not in self.grid_cache:
+            grid = create_centered_coordinate_grid(frame_width, frame_height)
+            if (frame_width, frame_height) != tuple(display_size):
+                grid = cv2.resize(grid, display_size, interpolation=cv2.INTER_AREA)
+            self.grid_cache[key] = cv2.convertScaleAbs(grid, alpha=GRID_ALPHA)
+        return self.grid_cache[key]
+
+    def render(self, frame, display_size, qr_results=(), squares=(), zoom_rect=None,
+               show_contours=True, grid_enabled=True, calibration=None, lut=None):
+        """生成显示图像（检测结果坐标为整帧坐标，绘制时换算到显示分辨率）"""
+        height, width = frame.shape[:2]
+        display_size = tuple(display_size)
+        if (width, height) == display_size:
+            display = frame.copy()
+        else:
+            # 缩小不足一半时双线性插值已无明显混叠，且比INTER_AREA快数倍
+            shrink = min(display_size[0] / width, display_size[1] / height)
+            interpolation = cv2.INTER_LINEAR if shrink > 0.5 else cv2.INTER_AREA
+            display = cv2.resize(frame, display_size, interpolation=interpolation)
+
+        # 亮度补偿只作用于缩小后的显示图像
+        if lut is not None:
+            cv2.LUT(display, lut, dst=display)
+
+        # display * (1 - GRID_ALPHA) + grid * GRID_ALPHA
+        if grid_enabled:
+            cv2.scaleAdd(display, 1 - GRID_ALPHA, self.grid(width, height, display_size), dst=display)
+
+        scale = np.float32([display_size[0] / width, display_size[1] / height])
+        s = float(min(scale))
+        thickness = max(1, round(2 * s))
+
+        def to_display(points):
+            return np.round(np.asarray(points, dtype=np.float32) * scale).astype(np.int32)
+
+        # 绘制QR码
+        for qr in qr_results:
+            if "rect" in qr:  # 倾斜QR码
+                cv2.polylines(display, [to_display(qr["rect"])], True, DEBUG_COLORS['tilted_qr'], thickness)
+            else:  # 标准QR码
+                x, y, w, h = qr.get("position", (0, 0, 10, 10))
+                (x1, y1), (x2, y2) = to_display([[x, y], [x + w, y + h]])
+                cv2.rectangle(display, (x1, y1), (x2, y2), DEBUG_COLORS['standard_qr'], thickness)
+
+            # 绘制多边形顶点
+            if "polygon" in qr:
+                for point in to_display(qr["polygon"]):
+                    cv2.circle(display, tuple(point), max(2, round(5 * s)), (0, 0, 255), -1)
+
+        # 绘制方形
+        if show_contours:
+            for square in squares:
+                if square is None or len(square) < 4:
+                    continue
+                points = to_display(square)
+                cv2.drawContours(display, [points], -1, DEBUG_COLORS['square'], thickness)
+                for point in points:
+                    cv2.circle(display, tuple(point), max(2, round(6 * s)), DEBUG_COLORS['square'], -1)
+
+                center, mm_x, mm_y, mm_z, rotation = calculate_object_position(square, width, height, calibration)
+
+                # 显示坐标信息
+                info_x = int(center[0] * scale[0] - 100 * s)
+                info_y = int(center[1] * scale[1] + 80 * s)
+                cv2.rectangle(display, (info_x - int(5 * s), info_y - int(50 * s)),
+                              (info_x + int(220 * s), info_y + int(30 * s)), (40, 40, 40), -1)
+                for text, dy, color in ((f"X: {mm_x:.1f}mm", -20, (0, 255, 255)),
+                                        (f"Y: {mm_y:.1f}mm", 0, (200, 100, 255)),
+                                        (f"Rot: {rotation:.1f}°", 20, (255, 200, 0))):
+                    cv2.putText(display, text, (info_x, info_y + int(dy * s)),
+                                cv2.FONT_HERSHEY_SIMPLEX, 0.5 * s, color, 1)
+
+        # 绘制放大区域
+        if zoom_rect is not None:
+            points = to_display(zoom_rect)
+            cv2.drawContours(display, [points], 0, ZOOM_SEARCH_COLOR, thickness)
+            cv2.putText(display, "ZOOM AREA", tuple(points[0]),
+                        cv2.FONT_HERSHEY_SIMPLEX, 0.7 * s, ZOOM_SEARCH_COLOR, thickness)
+
+        return display
 
 
 class GPUAccelerator:
@@ -460,25 +1488,6 @@ def four_point_transform(image, pts):
     return warped
 
 
-def angle(pt1, pt2, pt0):
-    """计算三个点之间的角度余弦值"""
-    if pt1 is None or pt2 is None or pt0 is None:
-        return 0.0
-
-    vec1 = np.array([pt1[0] - pt0[0], pt1[1] - pt0[1]], dtype=np.float64)
-    vec2 = np.array([pt2[0] - pt0[0], pt2[1] - pt0[1]], dtype=np.float64)
-
-    dot = np.dot(vec1, vec2)
-    norm1 = np.linalg.norm(vec1)
-    norm2 = np.linalg.norm(vec2)
-
-    if norm1 * norm2 < 1e-10:
-        return 0.0
-
-    cosine = dot / (norm1 * norm2)
-    return np.clip(cosine, -1.0, 1.0)
-
-
 def is_border_contour(contour, image_shape, margin=20):
     """检查轮廓是否在图像边缘"""
     if contour is None or image_shape is None:
@@ -495,104 +1504,6 @@ def is_border_contour(contour, image_shape, margin=20):
     return False
 
 
-def is_not_barcode(contour, barcode_rects, intersection_threshold=0.01, area_ratio_threshold=0.7):
-    """
-    增强版二维码判断（新增面积比例检测）
-    完全重写以解决NoneType错误
-    """
-    # 快速检查：如果没有二维码或轮廓无效
-    if not barcode_rects or contour is None or len(contour) < 3:
-        return True
-
-    try:
-        # 优化轮廓处理（确保二维数组）
-        contour = contour.reshape(-1, 2) if contour.ndim == 3 else contour
-        if len(contour) < 3:  # 至少需要3个点构成多边形
-            return True
-
-        # 计算轮廓面积
-        contour_area = cv2.contourArea(contour)
-        if contour_area < 1:
-            return True
-
-        # 使用更高效的多边形近似
-        epsilon = 0.01 * cv2.arcLength(contour, True)
-        contour_poly = cv2.approxPolyDP(contour, epsilon, True)
-
-        # 检查近似后的轮廓有效性
-        if contour_poly is None or len(contour_poly) < 3:
-            return True
-
-        # 确保contour_poly是二维数组 (N,2)
-        contour_poly = contour_poly.reshape(-1, 2)
-        if len(contour_poly) < 3:
-            return True
-
-        # 预计算轮廓边界
-        min_x, min_y = np.min(contour_poly, axis=0)
-        max_x, max_y = np.max(contour_poly, axis=0)
-
-        for b_rect in barcode_rects:
-            # 快速检查：矩形是否有效
-            if b_rect is None or len(b_rect) != 4:
-                continue
-
-            # 解析二维码矩形
-            bx, by, bw, bh = map(int, b_rect)
-            qr_area = bw * bh
-
-            # ========== 新增：面积比例快速判断 ==========
-            area_ratio = min(contour_area, qr_area) / max(contour_area, qr_area)
-            if area_ratio > area_ratio_threshold:
-                return False  # 面积相似度超过阈值，直接判定为二维码
-
-            # 快速边界检查
-            if (min_x > bx + bw or max_x < bx or
-                    min_y > by + bh or max_y < by):
-                continue
-
-            # 计算相交面积
-            intersection_area = 0
-            try:
-                # 创建二维码轮廓
-                qr_contour = np.array([
-                    [bx, by],
-                    [bx + bw, by],
-                    [bx + bw, by + bh],
-                    [bx, by + bh]
-                ], dtype=np.int32)
-
-                # 方法1：使用凸包相交计算
-                if len(contour_poly) >= 3 and len(qr_contour) >= 3:
-                    _, intersect = cv2.intersectConvexConvex(
-                        np.ascontiguousarray(contour_poly, dtype=np.float32),
-                        np.ascontiguousarray(qr_contour, dtype=np.float32)
-                    )
-                    if intersect is not None and len(intersect) >= 3:
-                        intersection_area = cv2.contourArea(intersect)
-                    else:
-                        # 方法2：矩形重叠计算
-                        x_overlap = max(0, min(max_x, bx + bw) - max(min_x, bx))
-                        y_overlap = max(0, min(max_y, by + bh) - max(min_y, by))
-                        intersection_area = x_overlap * y_overlap
-
-                # 双条件判断（相交比例或面积比例）
-                intersection_ratio = intersection_area / min(contour_area, qr_area)
-                if (intersection_ratio > intersection_threshold or
-                        area_ratio > area_ratio_threshold):
-                    return False
-
-            except Exception as e:
-                print(f"Intersection calc skipped: {str(e)}")
-                continue
-
-    except Exception as e:
-        print(f"Error in is_not_barcode: {str(e)}")
-        return True  # 出错时保守返回True
-
-    return True
-
-
 def find_largest_rectangle(contours, min_area=1000):
     """从轮廓中找出面积最大的矩形"""
     max_area = 0
@@ -749,8 +1660,8 @@ def analyze_last_zoomed_frame():
         return results
 
 
-def zoom_and_search(image, rect, zoom_factor=1.5):
-    """在指定矩形区域内放大并搜索二维码"""
+def zoom_and_search(image, rect, zoom_factor=1.5, lut=None):
+    """在指定矩形区域内放大并搜索二维码（lut为亮度补偿查找表，只作用于裁剪区域）"""
     if image is None or rect is None:
         return None
 
@@ -781,6 +1692,8 @@ def zoom_and_search(image, rect, zoom_factor=1.5):
         zoomed_region = image[y1:y2, x1:x2]
         if zoomed_region is None or zoomed_region.size == 0:
             return None
+        if lut is not None:
+            zoomed_region = cv2.LUT(zoomed_region, lut)
 
         # 在放大区域中搜索二维码
         zoomed_qr = pyzbar.decode(zoomed_region)
@@ -818,11 +1731,113 @@ def zoom_and_search(image, rect, zoom_factor=1.5):
         return None
 
 
-def find_squares_optimized(image):
-    """优化后的方形检测函数（支持GPU加速）"""
+def square_threshold_levels(blurred, levels=SQUARE_THRESH_LEVELS, adaptive=ADAPTIVE_THRESH_LEVELS):
+    """计算方形检测的二值化阈值序列（不含第0级的Canny边缘）"""
+    if levels <= 1:
+        return []
+
+    if adaptive and blurred is not None:
+        # 按灰度分位数选取阈值，使每一级都落在图像实际的亮度范围内
+        percentiles = np.linspace(0, 100, levels + 1)[1:-1]
+        thresholds = np.percentile(blurred[::4, ::4], percentiles)
+        return sorted(set(int(t) for t in thresholds))
+
+    return [(l + 1) * 255 // levels for l in range(1, levels)]
+
+
+def contour_bounds(contours):
+    """批量计算轮廓的外接矩形，返回(M, 4)数组：min_x, min_y, max_x, max_y"""
+    lengths = np.fromiter((len(c) for c in contours), dtype=np.intp, count=len(contours))
+    points = np.concatenate(contours).reshape(-1, 2)
+    starts = np.concatenate(([0], np.cumsum(lengths)[:-1]))
+    mins = np.minimum.reduceat(points, starts, axis=0)
+    maxs = np.maximum.reduceat(points, starts, axis=0)
+    return np.hstack((mins, maxs))
+
+
+def barcode_contour_mask(contours, barcode_rects, intersection_threshold=0.01, area_ratio_threshold=0.7):
+    """标记属于二维码区域的轮廓，返回布尔掩码
+
+    轮廓面积与某个二维码矩形面积相似，或与其相交面积（轮廓近似多边形的凸包与矩形的精确相交）
+    超过较小面积的intersection_threshold时视为二维码。只对外接矩形相交的轮廓计算相交面积。
+    """
+    rects = np.asarray(barcode_rects, dtype=np.float64).reshape(-1, 4).astype(np.int64)
+    bx, by, bw, bh = rects[:, 0], rects[:, 1], rects[:, 2], rects[:, 3]
+    qr_areas = (bw * bh).astype(np.float64)
+
+    contour_areas = np.array([cv2.contourArea(c) for c in contours], dtype=np.float64)
+    valid = contour_areas >= 1
+    min_areas = np.maximum(np.minimum(contour_areas[:, None], qr_areas), 1e-10)
+    area_ratio = min_areas / np.maximum(np.maximum(contour_areas[:, None], qr_areas), 1e-10)
+    is_barcode = np.any(area_ratio > area_ratio_threshold, axis=1)
+
+    bounds = contour_bounds(contours)
+    overlap = ((bounds[:, 0:1] <= bx + bw) & (bounds[:, 2:3] >= bx) &
+               (bounds[:, 1:2] <= by + bh) & (bounds[:, 3:4] >= by))
+    qr_polys = [np.float32([[x, y], [x + w, y], [x + w, y + h], [x, y + h]]) for x, y, w, h in rects]
+
+    for i in np.flatnonzero(valid & ~is_barcode & overlap.any(axis=1)):
+        contour = contours[i].reshape(-1, 2)
+        poly = cv2.approxPolyDP(contour, 0.01 * cv2.arcLength(contour, True), True)
+        if poly is None or len(poly) < 3:
+            continue
+        hull = np.ascontiguousarray(cv2.convexHull(poly).reshape(-1, 2), dtype=np.float32)
+        for j in np.flatnonzero(overlap[i]):
+            intersection_area, _ = cv2.intersectConvexConvex(hull, qr_polys[j])
+            if intersection_area / min_areas[i, j] > intersection_threshold:
+                is_barcode[i] = True
+                break
+
+    return is_barcode & valid
+
+
+def filter_square_candidates(quads, contours, barcode_rects, min_area=MIN_AREA, max_cosine=MAX_COSINE,
+                             intersection_threshold=0.01, area_ratio_threshold=0.7):
+    """批量筛选四边形候选（面积、凸性、直角余弦、二维码重叠），返回布尔掩码
+
+    contours为各四边形对应的原始轮廓，用于判断是否属于二维码区域。
+    """
+    quads = np.asarray(quads, dtype=np.float64).reshape(-1, 4, 2)
+    if len(quads) == 0:
+        return np.zeros(0, dtype=bool)
+
+    prev_pts = np.roll(quads, 1, axis=1)
+    next_pts = np.roll(quads, -1, axis=1)
+
+    # 面积（鞋带公式）
+    areas = np.abs(np.sum(quads[:, :, 0] * next_pts[:, :, 1] - next_pts[:, :, 0] * quads[:, :, 1], axis=1)) / 2
+    mask = areas > min_area
+
+    # 凸性：相邻边叉积同号
+    vec_prev = prev_pts - quads
+    vec_next = next_pts - quads
+    turn = vec_prev[:, :, 0] * vec_next[:, :, 1] - vec_prev[:, :, 1] * vec_next[:, :, 0]
+    mask &= np.all(turn > 0, axis=1) | np.all(turn < 0, axis=1)
+
+    # 各角的余弦值
+    dot = np.sum(vec_prev * vec_next, axis=2)
+    norms = np.linalg.norm(vec_prev, axis=2) * np.linalg.norm(vec_next, axis=2)
+    cosine = np.where(norms < 1e-10, 0.0, dot / np.maximum(norms, 1e-10))
+    mask &= np.max(np.abs(np.clip(cosine, -1.0, 1.0)), axis=1) < max_cosine
+
+    # 排除二维码区域（只需检查通过了几何筛选的候选）
+    if barcode_rects and mask.any():
+        candidates = np.flatnonzero(mask)
+        mask[candidates] = ~barcode_contour_mask([contours[i] for i in candidates], barcode_rects,
+                                                 intersection_threshold, area_ratio_threshold)
+
+    return mask
+
+
+def find_squares_optimized(image, cache=None, levels=SQUARE_THRESH_LEVELS, adaptive=ADAPTIVE_THRESH_LEVELS):
+    """优化后的方形检测函数（支持GPU加速，候选四边形批量向量化筛选）"""
     if image is None:
         return []
 
+    if cache is None:
+        cache = FrameCache(image)
+
+    processed = None
     if CUDA_AVAILABLE:
         # GPU加速路径
         gpu_frame = gpu_accel.upload_to_gpu(image)
@@ -838,108 +1853,107 @@ def find_squares_optimized(image):
 
     if edges is None:
         # 回退到CPU处理
-        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-        blurred = cv2.GaussianBlur(gray, GAUSSIAN_BLUR_SIZE, 0)
-        edges = cv2.Canny(blurred, 0, THRESH)
-        edges = cv2.dilate(edges, None)
+        edges = cache.get('square_edges', lambda: cv2.dilate(
+            cache.edges(0, THRESH, GAUSSIAN_BLUR_SIZE), None))
 
-    barcodes = pyzbar.decode(image)
-    barcode_rects = [barcode.rect for barcode in barcodes if hasattr(barcode, 'rect')]
+    barcode_rects = [barcode.rect for barcode in cache.barcodes() if hasattr(barcode, 'rect')]
 
-    squares = []
-    for l in range(N):
-        if l == 0:
+    height, width = image.shape[:2]
+    margin = 20
+    min_bbox = np.array([margin, margin, -np.inf, -np.inf])
+    max_bbox = np.array([np.inf, np.inf, width - margin, height - margin])
+
+    # 自适应模式需要根据模糊图的灰度分布选择阈值
+    thresholds = square_threshold_levels(cache.blurred(GAUSSIAN_BLUR_SIZE) if adaptive else None,
+                                         levels, adaptive)
+
+    quads = []
+    sources = []  # 各四边形对应的原始轮廓
+    for level in [None] + thresholds:
+        if level is None:
             current_edges = edges
+        elif processed and processed['blurred']:
+            _, current_edges = cv2.cuda.threshold(processed['blurred'], level, 255, cv2.THRESH_BINARY)
+            current_edges = gpu_accel.download_from_gpu(current_edges)
         else:
-            if CUDA_AVAILABLE and processed and processed['blurred']:
-                blurred_gpu = processed['blurred']
-                _, current_edges = cv2.cuda.threshold(blurred_gpu, (l + 1) * 255 // N, 255, cv2.THRESH_BINARY)
-                current_edges = gpu_accel.download_from_gpu(current_edges)
-            else:
-                _, current_edges = cv2.threshold(blurred, (l + 1) * 255 // N, 255, cv2.THRESH_BINARY)
+            _, current_edges = cv2.threshold(cache.blurred(GAUSSIAN_BLUR_SIZE), level, 255, cv2.THRESH_BINARY)
 
         contours, _ = cv2.findContours(current_edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+        contours = [c for c in contours if len(c) >= 3]
+        if not contours:
+            continue
 
-        for contour in contours:
-            if contour is None or len(contour) < 3:
-                continue
-
-            if is_border_contour(contour, image.shape):
-                continue
-
-            if not is_not_barcode(contour, barcode_rects):
-                continue
-
-            epsilon = 0.02 * cv2.arcLength(contour, True)
-            approx = cv2.approxPolyDP(contour, epsilon, True)
-
-            if approx is None or len(approx) != 4:
-                continue
+        # 批量剔除边缘轮廓以及外接矩形面积不足的轮廓（近似多边形面积不会超过外接矩形）
+        bounds = contour_bounds(contours)
+        bbox_areas = (bounds[:, 2] - bounds[:, 0]) * (bounds[:, 3] - bounds[:, 1])
+        keep = np.all((bounds >= min_bbox) & (bounds <= max_bbox), axis=1) & (bbox_areas > MIN_AREA)
 
-            area = cv2.contourArea(approx)
-            if area > MIN_AREA and cv2.isContourConvex(approx):
-                max_cosine = 0
-                for j in range(4):
-                    cosine = abs(angle(
-                        approx[j][0],
-                        approx[(j + 2) % 4][0],
-                        approx[(j + 1) % 4][0]
-                    ))
-                    max_cosine = max(max_cosine, cosine)
+        for idx in np.flatnonzero(keep):
+            contour = contours[idx]
+            approx = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+            if approx is not None and len(approx) == 4:
+                quads.append(approx.reshape(4, 2))
+                sources.append(contour)
 
-                if max_cosine < MAX_COSINE:
-                    approx = approx.reshape(4, 2).astype(np.float32)
-                    squares.append(approx)
+    if not quads:
+        return []
 
-    return squares
+    quads = np.asarray(quads, dtype=np.float32)
+    mask = filter_square_candidates(quads, sources, barcode_rects)
+    return list(quads[mask])
 
 
 def merge_close_squares(squares):
-    """合并接近的方形"""
+    """合并接近的方形（网格空间索引查找邻近方形，角点匹配向量化）"""
     if squares is None or len(squares) < 2:
         return squares
 
-    centers = []
-    areas = []
-    rotations = []
-
-    for square in squares:
-        if square is None or len(square) < 4:
-            continue
+    squares = [np.asarray(square, dtype=np.float32).reshape(-1, 2)[:4]
+               for square in squares if square is not None and len(square) >= 4]
+    if len(squares) < 2:
+        return squares
 
-        center = np.mean(square, axis=0)
-        centers.append(center)
-        areas.append(cv2.contourArea(square))
+    quads = np.stack(squares)
+    centers = quads.mean(axis=1)
+    next_pts = np.roll(quads, -1, axis=1)
+    areas = np.abs(np.sum(quads[:, :, 0] * next_pts[:, :, 1] - next_pts[:, :, 0] * quads[:, :, 1], axis=1)) / 2
+    edge = quads[:, 1] - quads[:, 0]
+    rotations = np.degrees(np.arctan2(edge[:, 1], edge[:, 0]))
 
-        pt0 = square[0]
-        pt1 = square[1]
-        dx = pt1[0] - pt0[0]
-        dy = pt1[1] - pt0[1]
-        rotations.append(np.degrees(np.arctan2(dy, dx)))
+    # 以合并距离为边长建立网格，只需在相邻的3x3个格子中查找
+    cells = np.floor(centers / MERGE_DISTANCE_THRESHOLD).astype(np.int64)
+    grid = {}
+    for idx, (gx, gy) in enumerate(cells):
+        grid.setdefault((gx, gy), []).append(idx)
 
     groups = []
-    visited = [False] * len(squares)
+    visited = np.zeros(len(quads), dtype=bool)
 
-    for i in range(len(squares)):
-        if visited[i] or squares[i] is None:
+    for i in range(len(quads)):
+        if visited[i]:
             continue
-
-        group = [i]
         visited[i] = True
 
-        for j in range(i + 1, len(squares)):
-            if visited[j] or squares[j] is None:
-                continue
-
-            dist = np.linalg.norm(centers[i] - centers[j])
-            area_ratio = min(areas[i], areas[j]) / max(areas[i], areas[j])
-            angle_diff = min(abs(rotations[i] - rotations[j]), 360 - abs(rotations[i] - rotations[j]))
+        gx, gy = cells[i]
+        neighbors = [j for dx in (-1, 0, 1) for dy in (-1, 0, 1)
+                     for j in grid.get((gx + dx, gy + dy), ()) if j > i]
+        neighbors = np.array(neighbors, dtype=np.int64)
+        if len(neighbors):
+            neighbors = neighbors[~visited[neighbors]]
 
-            if (dist < MERGE_DISTANCE_THRESHOLD and
-                    area_ratio > MERGE_AREA_RATIO_THRESHOLD and
-                    angle_diff < MERGE_ANGLE_THRESHOLD):
-                group.append(j)
-                visited[j] = True
+        group = [i]
+        if len(neighbors):
+            dist = np.linalg.norm(centers[neighbors] - centers[i], axis=1)
+            area_ratio = np.minimum(areas[neighbors], areas[i]) / np.maximum(
+                np.maximum(areas[neighbors], areas[i]), 1e-10)
+            rot_diff = np.abs(rotations[neighbors] - rotations[i])
+            angle_diff = np.minimum(rot_diff, 360 - rot_diff)
+
+            matched = neighbors[(dist < MERGE_DISTANCE_THRESHOLD) &
+                                (area_ratio > MERGE_AREA_RATIO_THRESHOLD) &
+                                (angle_diff < MERGE_ANGLE_THRESHOLD)]
+            visited[matched] = True
+            group.extend(np.sort(matched).tolist())
 
         groups.append(group)
 
@@ -947,38 +1961,15 @@ def merge_close_squares(squares):
     for group in groups:
         if len(group) == 1:
             merged_squares.append(squares[group[0]])
-        else:
-            merged_points = np.zeros((4, 2), dtype=np.float32)
-            max_area_idx = group[0]
-            for idx in group:
-                if areas[idx] > areas[max_area_idx]:
-                    max_area_idx = idx
-
-            ref_square = squares[max_area_idx]
-            for k in range(4):
-                point_sum = np.zeros(2, dtype=np.float32)
-                count = 0
-
-                for idx in group:
-                    min_dist = float('inf')
-                    closest_point = None
-
-                    for m in range(4):
-                        dist = np.linalg.norm(ref_square[k] - squares[idx][m])
-                        if dist < min_dist:
-                            min_dist = dist
-                            closest_point = squares[idx][m]
-
-                    if closest_point is not None:
-                        point_sum += closest_point
-                        count += 1
-
-                if count > 0:
-                    merged_points[k] = point_sum / count
-                else:
-                    merged_points[k] = ref_square[k]
+            continue
+
+        members = quads[group]
+        ref_square = quads[group[int(np.argmax(areas[group]))]]
 
-            merged_squares.append(merged_points)
+        # 对参考方形的每个角点，取组内每个方形最近的角点求平均
+        dist = np.linalg.norm(ref_square[None, :, None, :] - members[:, None, :, :], axis=3)
+        closest = np.take_along_axis(members, np.argmin(dist, axis=2)[:, :, None], axis=1)
+        merged_squares.append(closest.mean(axis=0).astype(np.float32))
 
     return merged_squares
 
@@ -1037,21 +2028,29 @@ def create_centered_coordinate_grid(width, height):
     return grid_image
 
 
-def calculate_object_position(square, frame_width, frame_height):
+def plane_position(points, frame_width, frame_height, calibration=None):
+    """计算若干像素点在工作平面上的坐标(mm，以帧中心为原点)及相机高度
+
+    有匹配当前分辨率的标定时查表换算（含畸变和透视校正），否则按PX_TO_MM线性换算。
+    """
+    points = np.asarray(points, dtype=np.float32).reshape(-1, 2)
+    if calibration is not None and calibration.matches(frame_width, frame_height):
+        return calibration.pixel_to_mm(points), calibration.camera_height or CAMERA_HEIGHT
+    offset = points - np.float32([frame_width // 2, frame_height // 2])
+    return offset * PX_TO_MM, CAMERA_HEIGHT
+
+
+def calculate_object_position(square, frame_width, frame_height, calibration=None):
     """计算物体相对于中心的位置"""
     if square is None or len(square) < 4 or frame_width <= 0 or frame_height <= 0:
         return None, 0, 0, 0, 0
 
     center = np.mean(square, axis=0)
-    cx, cy = center
-    offset_x = cx - frame_width // 2
-    offset_y = cy - frame_height // 2
-    mm_x = offset_x * PX_TO_MM
-    mm_y = offset_y * PX_TO_MM
-    mm_z = CAMERA_HEIGHT
-
-    pt0 = square[0]
-    pt1 = square[1]
+    world, mm_z = plane_position(square, frame_width, frame_height, calibration)
+    mm_x, mm_y = np.mean(world, axis=0)
+
+    pt0 = world[0]
+    pt1 = world[1]
     dx = pt1[0] - pt0[0]
     dy = pt1[1] - pt0[1]
     rotation = np.degrees(np.arctan2(dy, dx))
@@ -1062,27 +2061,21 @@ def calculate_object_position(square, frame_width, frame_height):
     return center, mm_x, mm_y, mm_z, rotation
 
 
-def calculate_qr_position(qr_polygon, frame_width, frame_height):
+def calculate_qr_position(qr_polygon, frame_width, frame_height, calibration=None):
     """计算QR码相对于中心的位置（使用多边形顶点）"""
     if qr_polygon is None or len(qr_polygon) < 4 or frame_width <= 0 or frame_height <= 0:
         return None, 0, 0, 0, 0
 
     # 计算中心点
     center = np.mean(qr_polygon, axis=0)
-    cx, cy = center
-
-    # 计算相对于图像中心的偏移
-    offset_x = cx - frame_width // 2
-    offset_y = cy - frame_height // 2
 
-    # 转换为毫米
-    mm_x = offset_x * PX_TO_MM
-    mm_y = offset_y * PX_TO_MM
-    mm_z = CAMERA_HEIGHT
+    # 顶点换算到平面坐标(mm)，中心取平面上的顶点均值
+    world, mm_z = plane_position(qr_polygon, frame_width, frame_height, calibration)
+    mm_x, mm_y = np.mean(world, axis=0)
 
     # 计算旋转角度（使用第一条边的角度）
-    pt0 = qr_polygon[0]
-    pt1 = qr_polygon[1]
+    pt0 = world[0]
+    pt1 = world[1]
     dx = pt1[0] - pt0[0]
     dy = pt1[1] - pt0[1]
     rotation = np.degrees(np.arctan2(dy, dx))
@@ -1235,14 +2228,21 @@ def show_processed_images(processed_images):
     cv2.imshow("Processed Images", canvas)
 
 
-def detect_and_decode_qrcode(image):
+def detect_and_decode_qrcode(image, detector=None, cache=None):
     """改进的QR码检测和解码函数（使用新的时域分析版本）"""
     if image is None:
         return []
 
-    detector = QRDetector()
-    results = detector.multi_strategy_detect(image)
+    # 未传入检测会话时临时创建（无帧历史，运动模糊策略不会生效）
+    if detector is None:
+        detector = QRDetector()
+    results, tier = detector.scheduled_detect(image, cache)
+    return format_qr_results(results, source=tier)
 
+
+def format_qr_results(results, offset=(0, 0), source=None):
+    """将解码结果整理为统一的字典格式（offset为ROI在整帧中的左上角坐标，source为命中的检测策略）"""
+    ox, oy = offset
     formatted_results = []
     for barcode in results:
         if barcode is None:
@@ -1272,6 +2272,10 @@ def detect_and_decode_qrcode(image):
                 [x, y + h]
             ], dtype=np.float32)
 
+        # 换算到整帧坐标系
+        x, y = x + ox, y + oy
+        qr_polygon = qr_polygon + np.float32([ox, oy])
+
         barcode_data = barcode.data.decode("utf-8")
         barcode_type = barcode.type
 
@@ -1285,12 +2289,30 @@ def detect_and_decode_qrcode(image):
             "id": qr_id,
             "direction": direction,
             "secure": secure,
-            "source": "standard_qr" if hasattr(barcode, 'rect') else "tilted_qr"
+            "source": source or ("standard_qr" if hasattr(barcode, 'rect') else "tilted_qr")
         })
 
     return formatted_results
 
-def detect_tilted_qrcode(image):
+
+def find_squares_in_roi(cache, offset):
+    """在ROI内检测方形，结果换算到整帧坐标系"""
+    squares = find_squares_optimized(cache.frame, cache)
+    return [square + np.float32(offset) for square in squares]
+
+
+def decode_qrcode_in_roi(cache, offset, detector=None):
+    """在ROI内检测二维码，结果换算到整帧坐标系
+
+    传入检测会话时与整帧扫描一样按策略调度（含倾斜、运动模糊策略），否则只用pyzbar解码。
+    """
+    if detector is None:
+        return format_qr_results(cache.barcodes(), offset)
+    results, tier = detector.scheduled_detect(cache.frame, cache)
+    return format_qr_results(results, offset, source=tier)
+
+
+def detect_tilted_qrcode(image, cache=None):
     """改进的倾斜QR码检测函数（使用新的时域分析版本）"""
     # 这个功能已经被整合到QRDetector类中
     return []
@@ -1355,59 +2377,12 @@ def save_squares(orig_image, squares, output_dir="detected_squares"):
         cv2.imshow(f"Square {i + 1}", warped)
 
 
-def update_coordinate_history(console : VisualConsole) -> None | dict:
-    """更新坐标历史记录并计算平均值"""
-    global COORDINATE_HISTORY, LAST_AVG_TIME, DETECTED, AXIS_X, AXIS_Y, ROT
-
-    current_time = time.time()
-
-    with COORD_LOCK:
-        detected = DETECTED
-        x, y, rot = AXIS_X, AXIS_Y, ROT
-
-    if detected:
-        with COORD_LOCK:
-            COORDINATE_HISTORY.append({
-                'time': current_time,
-                'x': x,
-                'y': y,
-                'rot': rot
-            })
-
-    if current_time - LAST_AVG_TIME >= 1.0:
-        LAST_AVG_TIME = current_time
-
-        with COORD_LOCK:
-            COORDINATE_HISTORY = deque(
-                [d for d in COORDINATE_HISTORY
-                 if current_time - d['time'] <= 1.0],
-                maxlen=100
-            )
-
-            if COORDINATE_HISTORY and DETECTED:
-                #坐标参数：avg_x,avg_y,avg_rot是三个接口
-                avg_x = sum(d['x'] for d in COORDINATE_HISTORY) / len(COORDINATE_HISTORY)
-                avg_y = sum(d['y'] for d in COORDINATE_HISTORY) / len(COORDINATE_HISTORY)
-                avg_rot = sum(d['rot'] for d in COORDINATE_HISTORY) / len(COORDINATE_HISTORY)
-
-                '''
-                print(f"[{time.strftime('%H:%M:%S')}] 平均坐标 - "
-                      f"X: {avg_x:.1f}mm, Y: {avg_y:.1f}mm, 旋转: {avg_rot:.1f}° "
-                      f"(基于{len(COORDINATE_HISTORY)}帧)")
-                '''
-                console.add_message(f"[{time.strftime('%H:%M:%S')}] 平均坐标 - "
-                      f"X: {avg_x:.1f}mm, Y: {avg_y:.1f}mm, 旋转: {avg_rot:.1f}° "
-                      f"(基于{len(COORDINATE_HISTORY)}帧)")
-                return {
-                    'x': AXIS_X,
-                    'y': AXIS_Y,
-                    'rot': ROT
-                }
-
-            else:
-                #print(f"[{time.strftime('%H:%M:%S')}] 未检测到目标")
-                console.add_message(f"[{time.strftime('%H:%M:%S')}] 未检测到目标")
-                return None
+@lru_cache(maxsize=2 * (MAX_BRIGHTNESS - MIN_BRIGHTNESS) + 2)
+def brightness_lut(brightness):
+    """亮度偏移查找表（256项，按整数偏移缓存）"""
+    lut = np.clip(np.arange(256, dtype=np.int16) + int(brightness), 0, 255).astype(np.uint8)
+    lut.flags.writeable = False
+    return lut
 
 
 def adjust_brightness(image, brightness=0):
@@ -1415,8 +2390,9 @@ def adjust_brightness(image, brightness=0):
     if image is None:
         return None
 
+    brightness = int(round(brightness))
     if brightness != 0:
-        image = cv2.convertScaleAbs(image, alpha=1.0, beta=brightness)
+        image = cv2.LUT(image, brightness_lut(brightness))
     return image
 
 
@@ -1447,28 +2423,6 @@ def calculate_qr_brightness(image, qr_rect):
     return np.mean(gray)
 
 
-def update_brightness(image, qr_rects):
-    """根据二维码区域更新亮度设置"""
-    global CURRENT_BRIGHTNESS
-
-    if image is None or not qr_rects:
-        return adjust_brightness(image, CURRENT_BRIGHTNESS)
-
-    qr_rect = qr_rects[0]["position"]
-    current_brightness = calculate_qr_brightness(image, qr_rect)
-
-    if current_brightness is None:
-        return adjust_brightness(image, CURRENT_BRIGHTNESS)
-
-    brightness_diff = TARGET_QR_BRIGHTNESS - current_brightness
-    brightness_adjustment = brightness_diff * BRIGHTNESS_ADJUSTMENT_RATE
-    CURRENT_BRIGHTNESS += brightness_adjustment
-    CURRENT_BRIGHTNESS = np.clip(CURRENT_BRIGHTNESS, MIN_BRIGHTNESS, MAX_BRIGHTNESS)
-
-    adjusted_image = adjust_brightness(image, CURRENT_BRIGHTNESS)
-    return adjusted_image
-
-
 def update_secure_status(qr_id, has_red_circle):
     """更新安全状态记录"""
     global secure_status
@@ -1485,33 +2439,6 @@ def get_secure_status(qr_id):
         return secure_status.get(qr_id, False)
 
 
-def update_priority_lock(current_qr_id, current_time):
-    """更新优先级锁定状态"""
-    global priority_lock, priority_lock_time
-
-    with PRIORITY_LOCK:
-        if priority_lock is None:
-            # 没有锁定，直接锁定当前最高ID的二维码
-            priority_lock = current_qr_id
-            priority_lock_time = current_time
-        elif current_qr_id > priority_lock:
-            # 检测到更高ID的二维码，更新锁定
-            priority_lock = current_qr_id
-            priority_lock_time = current_time
-        elif current_time - priority_lock_time > PRIORITY_LOCK_DURATION:
-            # 锁定超时，释放锁定
-            priority_lock = None
-            priority_lock_time = 0
-
-
-def should_keep_priority_lock(current_time):
-    """检查是否应该保持当前优先级锁定"""
-    with PRIORITY_LOCK:
-        if priority_lock is None:
-            return False
-        return current_time - priority_lock_time <= PRIORITY_LOCK_DURATION
-
-
 def draw_debug_info(image, detections):
     """绘制调试信息（检测来源标记）"""
     if not DEBUG_MODE or image is None or not detections:
@@ -1539,9 +2466,252 @@ def draw_debug_info(image, detections):
                         cv2.FONT_HERSHEY_SIMPLEX, 0.4, color, 1)
 
 
-def visual_detect_2(camera_id : int, console : VisualConsole):
-    global COORDINATE_HISTORY, LAST_AVG_TIME, DETECTED, AXIS_X, AXIS_Y, ROT, CURRENT_BRIGHTNESS
-    global priority_lock, priority_lock_time, DEBUG_MODE, ZOOM_WINDOW_VISIBLE, last_zoomed_frame
+class TargetFusion:
+    """多相机目标融合（各会话发布自己的目标，由唯一的发送线程按权重融合近期目标后输出）
+
+    只融合同一二维码ID的目标；只有位于共享世界坐标系（以标定板为原点的标定）中的目标才会相互平均，
+    以图像中心为原点的目标各自独立，不与其他相机混合。
+    """
+
+    def __init__(self, max_age=FUSION_MAX_AGE):
+        self.max_age = max_age
+        self.targets = {}  # 会话名 -> (时间戳, 权重, 二维码ID, 是否在世界坐标系, x, y, rot)
+        self.version = 0  # 每次发布加一，发送线程据此判断是否有新目标
+        self.lock = Lock()
+        self.thread = None
+
+    def publish(self, name, target, weight=1.0, world_frame=False):
+        """发布一个相机的目标；target为None表示该相机丢失目标"""
+        with self.lock:
+            if target is None:
+                self.targets.pop(name, None)
+            else:
+                self.targets[name] = (time.monotonic(), weight, target.get('qr_id', 0), world_frame,
+                                      target['x'], target['y'], target['rot'])
+                self.version += 1
+
+    def fused(self, now=None):
+        """返回融合后的目标字典，没有有效目标时返回None"""
+        if now is None:
+            now = time.monotonic()
+        with self.lock:
+            recent = [t for t in self.targets.values() if now - t[0] <= self.max_age]
+        if not recent:
+            return None
+
+        # 与单相机相同，优先输出ID最大的二维码
+        qr_id = max(t[2] for t in recent)
+        same = [t for t in recent if t[2] == qr_id]
+        shared = [t for t in same if t[3]]
+        if len(shared) != len(same):
+            # 各自坐标系下的坐标不能平均：有世界坐标系中的目标时只用它们，否则取最新的一个
+            same = shared if shared else [max(same, key=lambda t: t[0])]
+
+        targets = np.array([t[4:] for t in same], dtype=np.float64)
+        weights = np.array([t[1] for t in same], dtype=np.float64)
+        x, y = (weights @ targets[:, 0:2]) / weights.sum()
+        # 旋转角以90°为周期（方形对称），在圆周上取平均：2°与88°应融合为0°附近而非45°
+        phase = np.radians(targets[:, 2] * 4)
+        rot = np.degrees(np.arctan2(weights @ np.sin(phase), weights @ np.cos(phase))) / 4 % 90
+        if rot >= 90:  # 极小的负角取模后可能因舍入得到90
+            rot = 0.0
+        return {'x': float(x), 'y': float(y), 'rot': float(rot), 'qr_id': qr_id, 'cameras': len(same)}
+
+    def start(self, emit, interval=COORD_EMIT_INTERVAL):
+        """启动唯一的发送线程，每interval秒把有新发布时的融合目标交给emit"""
+        if self.thread is None:
+            self.thread = Thread(target=self._emit_loop, args=(emit, interval), daemon=True)
+            self.thread.start()
+
+    def _emit_loop(self, emit, interval):
+        emitted = 0
+        while True:
+            time.sleep(interval)
+            with self.lock:
+                version = self.version
+            if version == emitted:
+                continue
+            emitted = version
+            target = self.fused()
+            if target is not None:
+                try:
+                    emit(target)
+                except Exception:
+                    pass
+
+
+class DetectionSession:
+    """单个相机的检测会话状态（运行标志、目标坐标、亮度补偿、优先级锁定和坐标历史）
+
+    每个相机各自持有一个会话，多个相机可以在各自的线程中同时运行，
+    有共享的TargetFusion时只向其发布目标，由融合器统一输出。
+    """
+
+    def __init__(self, name='camera', fusion=None, weight=1.0, display=True, calibration=None):
+        self.name = name
+        self.calibration = calibration  # 相机标定（CameraCalibration），为None时按PX_TO_MM换算
+        self.fusion = fusion
+        self.weight = weight
+        self.display = display  # 是否向界面输出图像（多相机时通常只显示一路）
+        self.running = True
+
+        # 目标输出
+        self.detected = False
+        self.axis_x = 0
+        self.axis_y = 0
+        self.rot = 0
+
+        # 亮度补偿
+        self.brightness = 0  # 'lut'方式的亮度偏移
+        self.brightness_control = BRIGHTNESS_CONTROL
+        self.camera_value = None  # 'camera'方式下摄像头属性的当前值
+        self.camera_set_time = float('-inf')
+
+        # 优先级锁定
+        self.priority_lock = None  # 当前锁定的二维码ID
+        self.priority_lock_time = 0  # 锁定开始时间
+
+        # 坐标历史
+        self.coordinates = CoordinateWindow(COORD_HISTORY_CAPACITY)
+        self.coord_lock = Lock()
+        self.last_avg_time = time.time()  # 上次计算平均值的时间
+
+        ACTIVE_SESSIONS.add(self)
+
+    def stop(self):
+        self.running = False
+
+    def reset_clock(self, timestamp):
+        """以帧时间戳重新开始坐标计时（回放源的时间戳从0开始）"""
+        self.last_avg_time = timestamp
+        with self.coord_lock:
+            self.coordinates.clear()
+
+    def target(self):
+        return {'x': self.axis_x, 'y': self.axis_y, 'rot': self.rot}
+
+    def update_priority_lock(self, current_qr_id, current_time):
+        """更新优先级锁定状态"""
+        if self.priority_lock is None:
+            self.priority_lock = current_qr_id
+            self.priority_lock_time = current_time
+        elif current_qr_id > self.priority_lock:
+            self.priority_lock = current_qr_id
+            self.priority_lock_time = current_time
+        elif current_time - self.priority_lock_time > PRIORITY_LOCK_DURATION:
+            self.priority_lock = None
+            self.priority_lock_time = 0
+
+    def should_keep_priority_lock(self, current_time):
+        """检查是否应该保持当前优先级锁定"""
+        if self.priority_lock is None:
+            return False
+        return current_time - self.priority_lock_time <= PRIORITY_LOCK_DURATION
+
+    def update_brightness(self, image, qr_rects, cap=None, current_time=None):
+        """根据二维码区域的亮度更新亮度补偿（不修改图像）
+
+        'lut'方式只更新补偿量，由brightness_lut()提供给检测ROI和显示图像使用；
+        'camera'方式直接调节摄像头属性，摄像头不支持时回退到'lut'方式。
+        """
+        if image is None or not qr_rects:
+            return
+
+        current_brightness = calculate_qr_brightness(image, qr_rects[0]["position"])
+        if current_brightness is None:
+            return
+
+        brightness_diff = TARGET_QR_BRIGHTNESS - current_brightness
+        if self.brightness_control == 'camera' and cap is not None:
+            if self._control_camera(cap, brightness_diff, current_time):
+                return
+            self.brightness_control = 'lut'
+
+        brightness_adjustment = brightness_diff * BRIGHTNESS_ADJUSTMENT_RATE
+        self.brightness = np.clip(self.brightness + brightness_adjustment, MIN_BRIGHTNESS, MAX_BRIGHTNESS)
+
+    def _control_camera(self, cap, brightness_diff, current_time=None):
+        """按亮度偏差调节摄像头属性（限制设置频率），设置失败时返回False"""
+        if current_time is None:
+            current_time = time.time()
+        if self.camera_value is None:
+            self.camera_value = cap.get(CAMERA_BRIGHTNESS_PROP)
+
+        target = float(np.clip(self.camera_value + brightness_diff * CAMERA_BRIGHTNESS_RATE,
+                               *CAMERA_BRIGHTNESS_RANGE))
+        if abs(target - self.camera_value) < 1 or current_time - self.camera_set_time < CAMERA_CONTROL_INTERVAL:
+            return True
+        if not cap.set(CAMERA_BRIGHTNESS_PROP, target):
+            return False
+        self.camera_value = target
+        self.camera_set_time = current_time
+        return True
+
+    def brightness_lut(self):
+        """当前亮度补偿的查找表，无需补偿时返回None"""
+        brightness = int(round(self.brightness))
+        return brightness_lut(brightness) if brightness != 0 else None
+
+    def update_coordinate_history(self, console : VisualConsole, current_time=None) -> None | dict:
+        """更新坐标历史记录并计算平均值"""
+        if current_time is None:
+            current_time = time.time()
+
+        with self.coord_lock:
+            if self.detected:
+                self.coordinates.append(current_time, self.axis_x, self.axis_y, self.rot)
+
+        if current_time - self.last_avg_time >= COORD_EMIT_INTERVAL:
+            self.last_avg_time = current_time
+
+            with self.coord_lock:
+                self.coordinates.expire(current_time, COORD_WINDOW)
+                count = len(self.coordinates)
+                average = self.coordinates.average(COORD_AVERAGE_MODE) if count and self.detected else None
+
+            if average is not None:
+                #坐标参数：avg_x,avg_y,avg_rot是三个接口
+                avg_x, avg_y, avg_rot = average
+                console.add_message(f"[{time.strftime('%H:%M:%S')}] 平均坐标 - "
+                      f"X: {avg_x:.1f}mm, Y: {avg_y:.1f}mm, 旋转: {avg_rot:.1f}° "
+                      f"(基于{count}帧)")
+                return self.target()
+            else:
+                #print(f"[{time.strftime('%H:%M:%S')}] 未检测到目标")
+                console.add_message(f"[{time.strftime('%H:%M:%S')}] 未检测到目标")
+                if self.fusion is not None:
+                    self.fusion.publish(self.name, None)
+                return None
+
+    def in_world_frame(self, frame_width, frame_height):
+        """本相机输出的坐标是否位于多相机共享的世界坐标系中"""
+        return (self.calibration is not None and self.calibration.world_frame
+                and self.calibration.matches(frame_width, frame_height))
+
+    def publish(self, info, console, frame_width, frame_height):
+        """输出本相机目标：有融合器时发布给融合器，否则直接发送"""
+        if self.fusion is None:
+            console.master.add_task(Message(MsgType.VISUAL_MODE, info))
+        else:
+            self.fusion.publish(self.name, info, self.weight, self.in_world_frame(frame_width, frame_height))
+
+
+def load_camera_calibration(camera_id):
+    """读取摄像头编号对应的标定文件，不存在时返回None"""
+    return load_calibration(CALIBRATION_FILE_PATTERN.format(camera_id))
+
+
+def visual_detect_2(camera_id : int | str | FrameSource, console : VisualConsole, realtime=True, session=None):
+    """检测主循环；camera_id可以是摄像头编号，也可以是视频文件、图像序列目录、.npy文件或FrameSource（用于离线回放）
+
+    session为该相机的DetectionSession，省略时新建一个独立会话。
+    """
+    global DEBUG_MODE, ZOOM_WINDOW_VISIBLE, last_zoomed_frame
+
+    if session is None:
+        session = DetectionSession(str(camera_id))
+    if session.calibration is None and (isinstance(camera_id, int) or str(camera_id).isdigit()):
+        session.calibration = load_camera_calibration(camera_id)
 
     try:
         # 初始化日志
@@ -1553,12 +2723,14 @@ def visual_detect_2(camera_id : int, console : VisualConsole):
         #print("NumPy版本:", np.__version__)
         #print("OpenCV版本:", cv2.__version__)
         console.add_message("program start")
+        if session.calibration is not None:
+            console.add_message(f"calibration loaded: {session.calibration.image_size[0]}x{session.calibration.image_size[1]}")
 
-        # 初始化摄像头
+        # 初始化帧源
         try:
-            cap = cv2.VideoCapture(camera_id)
+            cap = open_frame_source(camera_id, realtime)
             if not cap.isOpened():
-                raise RuntimeError("无法打开摄像头")
+                raise RuntimeError("无法打开摄像头" if cap.live else f"无法打开帧源: {camera_id}")
         except Exception as e:
             #logger.error(f"摄像头初始化失败: {str(e)}")
             console.add_message(f"camera init failed: {str(e)}")
@@ -1606,19 +2778,26 @@ def visual_detect_2(camera_id : int, console : VisualConsole):
             return
         '''
 
-        # 初始化网格层
+        # 读取第一帧
+        first_frame = None
         try:
-            ret, first_frame = cap.read()
+            ret, first_frame, first_time = cap.read_timestamped()
             if not ret:
                 raise RuntimeError("无法获取第一帧")
-            grid_layer = create_centered_coordinate_grid(first_frame.shape[1], first_frame.shape[0])
+            # 坐标平均按帧时间戳计时（回放源的时间戳从0开始）
+            session.reset_clock(first_time)
         except Exception as e:
-            #logger.error(f"初始化网格层失败: {str(e)}")
-            console.add_message(f"init grid layer failed: {str(e)}")
-            grid_layer = None
+            #logger.error(f"读取第一帧失败: {str(e)}")
+            console.add_message(f"read first frame failed: {str(e)}")
 
-        # 初始化线程池
-        executor = ThreadPoolExecutor(max_workers=MAX_WORKERS)
+        # 叠加层合成（网格层按显示尺寸缓存）
+        compositor = OverlayCompositor()
+
+        # 初始化帧处理引擎（线程池/进程池在整个运行期间复用）
+        if VISION_BACKEND == 'process':
+            frame_processor = ProcessFrameProcessor(max_workers=MAX_WORKERS)
+        else:
+            frame_processor = FrameProcessor(max_workers=MAX_WORKERS)
 
         # 性能统计
         fps = 0
@@ -1630,20 +2809,27 @@ def visual_detect_2(camera_id : int, console : VisualConsole):
         last_valid_square = None
         current_zoom_rect = None
 
-        while True:
-            global LOOP_FLAG
-            if not LOOP_FLAG:
-                break
+        # 预取的下一帧（与当前帧的检测流水线并行采集）
+        pending_frame = first_frame
+        pending_time = cap.timestamp
 
-            try:
-                # 读取帧
-                ret, frame = cap.read()
-                if not ret:
-                    #logger.warning("无法获取帧")
-                    console.add_message("无法获取帧")
-                    break
+        # 二维码ROI跟踪
+        qr_tracker = QRTracker()
+        current_qr_id = 0
 
-                current_time = time.time()
+        while session.running:
+            try:
+                # 读取帧（优先使用上一轮预取的帧）
+                if pending_frame is None:
+                    ret, frame, current_time = cap.read_timestamped()
+                    if not ret:
+                        #logger.warning("无法获取帧")
+                        console.add_message("无法获取帧" if cap.live else "回放结束")
+                        break
+                else:
+                    frame = pending_frame
+                    current_time = pending_time
+                    pending_frame = None
 
                 # 转换为3通道图像（如果是灰度图）
                 try:
@@ -1653,33 +2839,46 @@ def visual_detect_2(camera_id : int, console : VisualConsole):
                     #logger.error(f"图像转换失败: {str(e)}")
                     continue
 
-                orig = frame.copy()
+                # 检测器只通过FrameCache的只读视图访问帧，无需再复制
+                orig = frame
 
-                # 并行处理任务
+                # 并行处理任务（各检测器共享同一预处理缓存）
+                frame_cache = FrameCache(frame)
+                track_roi = qr_tracker.roi(frame.shape, current_time) if TRACKING_ENABLED else None
+                roi_lut = session.brightness_lut() if brightness_adjustment else None
                 try:
-                    with ThreadPoolExecutor(max_workers=3) as executor:
-                        squares_future = executor.submit(find_squares_optimized, frame.copy())
-                        qr_future = executor.submit(detect_and_decode_qrcode, frame.copy())
-                        tilted_qr_future = executor.submit(detect_tilted_qrcode, frame.copy())
-
-                        try:
-                            squares = squares_future.result(timeout=1.0)
-                            qr_results = qr_future.result(timeout=1.0)
-                            tilted_qr_results = tilted_qr_future.result(timeout=1.0)
-                        except Exception as e:
-                            #logger.error(f"并行处理超时: {str(e)}")
-                            console.add_message(f"parallel processing timeout: {str(e)}")
-                            continue
+                    if track_roi is not None:
+                        futures = frame_processor.submit_roi(frame_cache, track_roi, roi_lut)
+                    else:
+                        futures = frame_processor.submit(frame_cache)
                 except Exception as e:
                     #logger.error(f"并行处理失败: {str(e)}")
                     console.add_message(f"parallel processing failed: {str(e)}")
                     continue
 
+                # 检测进行的同时采集下一帧（后台缓冲的帧源直接在下一轮取最新帧）
+                if not cap.buffered:
+                    ret, pending_frame, pending_time = cap.read_timestamped()
+                    if not ret:
+                        pending_frame = None
+
+                try:
+                    results = frame_processor.collect(futures, timeout=1.0)
+                    # 跟踪丢失时立即对本帧进行整帧扫描
+                    if track_roi is not None and not results['qr']:
+                        qr_tracker.lost()
+                        results = frame_processor.collect(frame_processor.submit(frame_cache), timeout=1.0)
+                    squares = results['squares']
+                    qr_results = results['qr']
+                    tilted_qr_results = results.get('tilted_qr', [])
+                except Exception as e:
+                    #logger.error(f"并行处理超时: {str(e)}")
+                    console.add_message(f"parallel processing timeout: {str(e)}")
+                    continue
+
                 # 边缘检测用于寻找放大区域
                 try:
-                    gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-                    blurred = cv2.GaussianBlur(gray, (5, 5), 0)
-                    edges = cv2.Canny(blurred, 50, 150)
+                    edges = frame_cache.edges(50, 150, (5, 5))
                     all_contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
                 except Exception as e:
                     #logger.error(f"边缘检测失败: {str(e)}")
@@ -1708,7 +2907,7 @@ def visual_detect_2(camera_id : int, console : VisualConsole):
 
                         if current_zoom_rect is not None:
                             try:
-                                zoom_qr_results = zoom_and_search(frame, current_zoom_rect)
+                                zoom_qr_results = zoom_and_search(frame, current_zoom_rect, lut=roi_lut)
                                 if zoom_qr_results:
                                     all_qr_results.extend(zoom_qr_results)
                                     all_qr_results.sort(key=lambda x: x.get("id", 0), reverse=True)
@@ -1731,7 +2930,7 @@ def visual_detect_2(camera_id : int, console : VisualConsole):
                 # 确定显示内容
                 display_squares = []
                 display_qr = None
-                DETECTED = False
+                session.detected = False
 
                 try:
                     if all_qr_results:
@@ -1754,16 +2953,16 @@ def visual_detect_2(camera_id : int, console : VisualConsole):
                                 continue
 
                         # 更新优先级锁定
-                        update_priority_lock(current_qr_id, current_time)
+                        session.update_priority_lock(current_qr_id, current_time)
 
                         # 检查是否保持锁定
-                        if should_keep_priority_lock(current_time) and priority_lock != current_qr_id:
+                        if session.should_keep_priority_lock(current_time) and session.priority_lock != current_qr_id:
                             if last_valid_qr is not None:
                                 display_qr = last_valid_qr.get("polygon")
                                 if display_qr is not None:
-                                    center, AXIS_X, AXIS_Y, _, ROT = calculate_qr_position(
-                                        display_qr, frame.shape[1], frame.shape[0])
-                                    DETECTED = True
+                                    center, session.axis_x, session.axis_y, _, session.rot = calculate_qr_position(
+                                        display_qr, frame.shape[1], frame.shape[0], session.calibration)
+                                    session.detected = True
                         else:
                             qr_polygon = current_max_id_qr["polygon"]
                             qr_center = np.mean(qr_polygon, axis=0)
@@ -1776,106 +2975,55 @@ def visual_detect_2(camera_id : int, console : VisualConsole):
 
                             if qr_containing:
                                 display_squares = [max(qr_containing, key=cv2.contourArea)]
-                                center, AXIS_X, AXIS_Y, _, ROT = calculate_object_position(
-                                    display_squares[0], frame.shape[1], frame.shape[0])
-                                DETECTED = True
+                                center, session.axis_x, session.axis_y, _, session.rot = calculate_object_position(
+                                    display_squares[0], frame.shape[1], frame.shape[0], session.calibration)
+                                session.detected = True
                                 last_valid_square = display_squares[0]
                                 last_valid_qr = current_max_id_qr
                             else:
                                 display_qr = qr_polygon
-                                center, AXIS_X, AXIS_Y, _, ROT = calculate_qr_position(
-                                    display_qr, frame.shape[1], frame.shape[0])
-                                DETECTED = True
+                                center, session.axis_x, session.axis_y, _, session.rot = calculate_qr_position(
+                                    display_qr, frame.shape[1], frame.shape[0], session.calibration)
+                                session.detected = True
                                 last_valid_qr = current_max_id_qr
                                 last_valid_square = None
-                    elif last_valid_qr is not None and should_keep_priority_lock(current_time):
+                    elif last_valid_qr is not None and session.should_keep_priority_lock(current_time):
                         display_qr = last_valid_qr.get("polygon")
                         if display_qr is not None:
-                            center, AXIS_X, AXIS_Y, _, ROT = calculate_qr_position(
-                                display_qr, frame.shape[1], frame.shape[0])
-                            DETECTED = True
+                            center, session.axis_x, session.axis_y, _, session.rot = calculate_qr_position(
+                                display_qr, frame.shape[1], frame.shape[0], session.calibration)
+                            session.detected = True
                 except Exception as e:
                     #logger.error(f"确定显示内容失败: {str(e)}")
                     console.add_message(f"determine display content failed: {str(e)}")
 
-                # 亮度调整
+                # 更新跟踪目标（二维码及包含它的方形）
+                if all_qr_results and all_qr_results[0].get("polygon") is not None:
+                    # 方形数量逐帧可能变化，速度只按二维码中心估计
+                    qr_polygon = all_qr_results[0]["polygon"]
+                    qr_tracker.update(np.vstack([qr_polygon] + display_squares), current_time, anchor=qr_polygon)
+                else:
+                    qr_tracker.lost()
+
+                # 亮度调整（只更新补偿量，下一帧起作用于检测ROI和显示图像，不再改写整帧）
                 if brightness_adjustment and all_qr_results:
                     try:
-                        frame = update_brightness(frame, all_qr_results)
+                        session.update_brightness(frame, all_qr_results, cap, current_time)
                     except Exception as e:
                         #logger.error(f"亮度调整失败: {str(e)}")
                         console.add_message(f"brightness adjustment failed: {str(e)}")
 
-                # 创建显示图像
-                display = frame.copy()
-
-                # 添加网格层
-                if grid_enabled and grid_layer is not None:
+                # 在显示分辨率下合成叠加层（没有界面在显示时跳过）
+                display = None
+                display_size = getattr(console, 'display_size', None)
+                if session.display and display_size is not None and getattr(console, 'viewer_attached', True):
                     try:
-                        display = cv2.addWeighted(display, 1 - GRID_ALPHA, grid_layer, GRID_ALPHA, 0)
+                        display = compositor.render(frame, display_size, all_qr_results, display_squares,
+                                                    current_zoom_rect, show_contours, grid_enabled,
+                                                    session.calibration, roi_lut)
                     except Exception as e:
-                        #logger.error(f"添加网格层失败: {str(e)}")
-                        console.add_message(f"add grid layer failed: {str(e)}")
-
-                # 绘制检测结果
-                try:
-                    # 绘制QR码
-                    for qr in all_qr_results:
-                        try:
-                            if "rect" in qr:  # 倾斜QR码
-                                cv2.polylines(display, [qr["rect"].astype(int)], True, DEBUG_COLORS['tilted_qr'], 2)
-                            else:  # 标准QR码
-                                x, y, w, h = qr.get("position", (0, 0, 10, 10))
-                                cv2.rectangle(display, (x, y), (x + w, y + h), DEBUG_COLORS['standard_qr'], 2)
-
-                            # 绘制多边形顶点
-                            if "polygon" in qr:
-                                for point in qr["polygon"]:
-                                    cv2.circle(display, tuple(point.astype(int)), 5, (0, 0, 255), -1)
-                        except Exception as e:
-                            #logger.error(f"绘制QR码失败: {str(e)}")
-                            console.add_message(f"draw qr failed: {str(e)}")
-
-                    # 绘制方形
-                    if show_contours and display_squares:
-                        for square in display_squares:
-                            try:
-                                if square is not None and len(square) >= 4:
-                                    cv2.drawContours(display, [square.astype(int)], -1, DEBUG_COLORS['square'], 2)
-                                    for point in square:
-                                        cv2.circle(display, tuple(point.astype(int)), 6, DEBUG_COLORS['square'], -1)
-
-                                    center, mm_x, mm_y, mm_z, rotation = calculate_object_position(
-                                        square, frame.shape[1], frame.shape[2])
-
-                                    # 显示坐标信息
-                                    info_x = int(center[0] - 100)
-                                    info_y = int(center[1] + 80)
-                                    cv2.rectangle(display, (info_x - 5, info_y - 50),
-                                                  (info_x + 220, info_y + 30), (40, 40, 40), -1)
-
-                                    cv2.putText(display, f"X: {mm_x:.1f}mm", (info_x, info_y - 20),
-                                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (0, 255, 255), 1)
-                                    cv2.putText(display, f"Y: {mm_y:.1f}mm", (info_x, info_y),
-                                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (200, 100, 255), 1)
-                                    cv2.putText(display, f"Rot: {rotation:.1f}°", (info_x, info_y + 20),
-                                                cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255, 200, 0), 1)
-                            except Exception as e:
-                                #logger.error(f"绘制方形失败: {str(e)}")
-                                console.add_message(f"draw square failed: {str(e)}")
-
-                    # 绘制放大区域
-                    if current_zoom_rect is not None:
-                        try:
-                            cv2.drawContours(display, [current_zoom_rect], 0, ZOOM_SEARCH_COLOR, 2)
-                            cv2.putText(display, "ZOOM AREA", tuple(current_zoom_rect[0]),
-                                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, ZOOM_SEARCH_COLOR, 2)
-                        except Exception as e:
-                            #logger.error(f"绘制放大区域失败: {str(e)}")
-                            pass
-                except Exception as e:
-                    #logger.error(f"绘制结果失败: {str(e)}")
-                    pass
+                        #logger.error(f"绘制结果失败: {str(e)}")
+                        console.add_message(f"render overlay failed: {str(e)}")
 
                 # 显示放大窗口
                 if ZOOM_WINDOW_VISIBLE:
@@ -1886,16 +3034,17 @@ def visual_detect_2(camera_id : int, console : VisualConsole):
                         pass
 
                 # 更新坐标历史
-                info = update_coordinate_history(console)
+                info = session.update_coordinate_history(console, current_time)
                 if info is not None:
                     info['qr_id'] = current_qr_id
                     console.add_message(f'QR id: {current_qr_id}')
-                    console.master.add_task(Message(MsgType.VISUAL_MODE, info))
+                    session.publish(info, console, frame.shape[1], frame.shape[0])
 
                 # 显示主窗口
                 try:
                     #cv2.imshow("Multi-Square Detector", display)
-                    console.set_image(display)
+                    if display is not None:
+                        console.set_image(display)
                 except Exception as e:
                     #logger.error(f"显示窗口失败: {str(e)}")
                     break
@@ -1957,9 +3106,12 @@ def visual_detect_2(camera_id : int, console : VisualConsole):
     finally:
         # 清理资源
         try:
-            executor.shutdown()
+            frame_processor.shutdown()
             cap.release()
-            cv2.destroyAllWindows()
+            try:
+                cv2.destroyAllWindows()
+            except cv2.error:
+                pass  # 无GUI支持的OpenCV（如CI上的headless构建）
             #logger.info("程序正常退出")
             console.add_message("program exited")
         except Exception as e:
@@ -75,7 +75,8 @@ class ProgramConsole(AbstractConsole):
         byte_path = self.var_byte_path.get()
         data = {
             "file_path" : byte_path,
-            "address" : 0x01FF3000
+            "address" : 0x01FF3000,
+            "delta" : True      # 只重写内容有变化的扇区
         }
         self.master.add_task(Message(MsgType.WRITE_FLASH, data))
 
@@ -1,6 +1,7 @@
 from visual import set_thread_alive
 from .AbstractConsole import AbstractConsole
 import cv2
+import numpy as np
 import threading
 from concurrent.futures import ThreadPoolExecutor, as_completed
 
@@ -8,7 +9,10 @@ import tkinter as tk
 from PIL import Image, ImageTk
 
 from s_serial import MsgType, Message
-from visual import set_loop_flag, visual_detect_2
+from visual import visual_detect_2, DetectionSession, TargetFusion, load_camera_calibration
+
+DISPLAY_SIZE = (500, 400)  # 图像显示尺寸(宽, 高)
+DISPLAY_MAX_FPS = 30  # 最大刷新率，与检测帧率无关
 
 
 class MessageChunk(tk.Frame):
@@ -22,8 +26,12 @@ class MessageChunk(tk.Frame):
         self.text.grid(row=3, column=0, padx=10, pady=10, sticky=tk.NSEW)
 
     def add_message(self, message : str):
+        self.add_messages([message])
+
+    def add_messages(self, messages : list):
+        """一次插入多条消息（只能在Tk线程调用）"""
         self.text.config(state=tk.NORMAL)
-        self.text.insert(tk.END, message + "\n")
+        self.text.insert(tk.END, "".join(message + "\n" for message in messages))
         self.text.see(tk.END)
         self.text.config(state=tk.DISABLED)
 
@@ -32,7 +40,10 @@ class VisualConsole(AbstractConsole):
     def __init__(self, master):
         super().__init__(master)
 
-        self.visual_detect_thread = None
+        # 每个摄像头一个检测会话，可同时运行多个，目标经融合后输出
+        self.sessions = {}  # 摄像头编号 -> (DetectionSession, 线程)
+        self.fusion = TargetFusion()
+        self.fusion.start(lambda target: self.master.add_task(Message(MsgType.VISUAL_MODE, target)))
 
         self.label_select_cameras = tk.Label(self, text="请选择摄像头:")
         self.var_cameras_index = tk.StringVar()
@@ -43,11 +54,21 @@ class VisualConsole(AbstractConsole):
         self.btn_stop = tk.Button(self, text="停止", command=self._stop)
 
         self.image = Image.open("./NRST.png")
-        self.image = self.image.resize((500, 400), Image.Resampling.LANCZOS)
+        self.image = self.image.resize(DISPLAY_SIZE, Image.Resampling.LANCZOS)
         self.photo = ImageTk.PhotoImage(self.image)
         self.label_image = tk.Label(self, image=self.photo)
         #self.label_image.image = self.photo
 
+        # 显示邮箱：检测线程只放入最新一帧，由Tk线程按固定频率取出刷新（旧帧直接丢弃）
+        self.display_size = DISPLAY_SIZE  # 检测线程直接按该尺寸合成显示图像
+        self.viewer_attached = False  # 控件当前是否可见，不可见时检测线程跳过绘制
+        self._display_lock = threading.Lock()
+        self._pending_image = None
+        self._resized = np.empty((DISPLAY_SIZE[1], DISPLAY_SIZE[0], 3), dtype=np.uint8)
+        self._display_rgb = np.empty_like(self._resized)
+        self._pending_messages = []  # 检测线程提交的消息，由Tk线程批量插入
+        self.after(1000 // DISPLAY_MAX_FPS, self._refresh_display)
+
         self.message_chunk = MessageChunk(self)
 
         self.label_select_cameras.grid(row=0, column=0, pady=2, sticky=tk.NW)
@@ -96,22 +117,39 @@ class VisualConsole(AbstractConsole):
         self.label_select_cameras.config(text="请选择摄像头:")
 
     def _start(self):
-        if self.visual_detect_thread is None or not self.visual_detect_thread.is_alive():
-            try:
-                camera_index = int(self.var_cameras_index.get())
-            except ValueError:
-                self.master.add_message(Message(MsgType.CREATE_ERROR_WINDOW, "请选择摄像头"))
-                return
-            set_loop_flag(True)
-            self.visual_detect_thread = threading.Thread(target=visual_detect_2, args=(camera_index, self), daemon=True)
-            self.visual_detect_thread.start()
+        try:
+            camera_index = int(self.var_cameras_index.get())
+        except ValueError:
+            self.master.add_message(Message(MsgType.CREATE_ERROR_WINDOW, "请选择摄像头"))
+            return
+
+        # 清理已结束的会话
+        self.sessions = {index: (session, thread) for index, (session, thread) in self.sessions.items()
+                         if thread.is_alive() and session.running}
+        if camera_index in self.sessions:
+            return
+
+        # 多相机融合要求各相机的坐标位于同一世界坐标系（以标定板为原点的标定）
+        calibration = load_camera_calibration(camera_index)
+        calibrations = [session.calibration for session, _ in self.sessions.values()] + [calibration]
+        if len(calibrations) > 1 and not all(c is not None and c.world_frame for c in calibrations):
+            self.master.add_message(Message(MsgType.CREATE_ERROR_WINDOW,
+                                            "多相机同时检测需要各摄像头都使用以标定板为原点的标定(--board-origin)"))
+            return
+
+        # 只有一路画面输出到界面：没有其他会话在显示时由新会话显示
+        display = not any(session.display for session, _ in self.sessions.values())
+        session = DetectionSession(f"camera {camera_index}", fusion=self.fusion, display=display,
+                                   calibration=calibration)
+        thread = threading.Thread(target=visual_detect_2, args=(camera_index, self),
+                                  kwargs={'session': session}, daemon=True)
+        self.sessions[camera_index] = (session, thread)
+        thread.start()
 
     def _stop(self):
-        if self.visual_detect_thread is not None:
+        for session, _ in self.sessions.values():
             #set_thread_alive(False)
-            set_loop_flag(False)
-            #self.visual_detect_thread.join()
-            #self.visual_detect_thread = None
+            session.stop()
 
             #self.image = Image.open("./NRST.png")
             #self.image = self.image.resize((500, 400), Image.Resampling.LANCZOS)
@@ -120,11 +158,33 @@ class VisualConsole(AbstractConsole):
             #self.label_image.image = self.photo
 
     def set_image(self, image):
-        display_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
-        self.image = Image.fromarray(display_rgb)
-        self.image = self.image.resize((500, 400), Image.Resampling.LANCZOS)
-        self.photo = ImageTk.PhotoImage(self.image)
-        self.label_image.config(image=self.photo)
+        """提交一帧待显示图像（可在任意线程调用，不触碰Tk）"""
+        with self._display_lock:
+            self._pending_image = image
+
+    def _refresh_display(self):
+        """在Tk线程中插入待显示的消息，取出最新一帧并刷新显示"""
+        self.viewer_attached = bool(self.winfo_viewable())
+
+        with self._display_lock:
+            image = self._pending_image
+            self._pending_image = None
+            messages, self._pending_messages = self._pending_messages, []
+        if messages:
+            self.message_chunk.add_messages(messages)
+
+        if image is not None:
+            if image.shape[1::-1] == DISPLAY_SIZE:
+                cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=self._display_rgb)
+            else:
+                cv2.resize(image, DISPLAY_SIZE, dst=self._resized, interpolation=cv2.INTER_AREA)
+                cv2.cvtColor(self._resized, cv2.COLOR_BGR2RGB, dst=self._display_rgb)
+            # 原地更新PhotoImage，无需重建
+            self.photo.paste(Image.fromarray(self._display_rgb))
+
+        self.after(1000 // DISPLAY_MAX_FPS, self._refresh_display)
 
     def add_message(self, message : str):
-        self.message_chunk.add_message(message)
\ No newline at end of file
+        """提交一条消息（可在任意线程调用，由Tk线程在下次刷新时插入）"""
+        with self._display_lock:
+            self._pending_messages.append(message)
\ No newline at end of file